@@ -21,7 +21,9 @@ async def cmd_help(message: Message):
 /start - Начать работу с ботом
 /help - Показать это сообщение
 /drivers - Показать список водителей
+/find - Поиск водителя по имени, номеру или заметкам
 /call_summary - Суммаризация звонка
+/call_full - Транскрипция, анализ и профиль водителя по одной записи
 /transcribe - Транскрибация аудио по спикерам (работает коректно с двумя спикерами)
 """
     
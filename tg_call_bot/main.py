@@ -15,6 +15,9 @@ from handlers.cmd import register_handlers
 from modules.notion.handlers import router as notion_router
 from modules.admin.handlers import router as admin_router
 from modules.openai.handlers import router as openai_router
+from modules.notion.outbox import comment_outbox
+from modules.notion.mirror import driver_mirror
+from share.usecases import resume_jobs
 
 
 # Настройка логирования
@@ -50,6 +53,13 @@ async def main():
     # Регистрация обработчиков
     register_handlers(dp)
     
+    # Фоновая отправка очереди комментариев в Notion (досылает записи, оставшиеся после перезапуска)
+    comment_outbox.start(bot)
+    # Фоновая синхронизация локальной копии базы водителей для /find
+    driver_mirror.start()
+    # Продолжаем обработку аудио, прерванную перезапуском бота
+    resume_jobs(bot)
+    
     # Запуск бота
     if WEBHOOK_URL:
         # Запуск через вебхук
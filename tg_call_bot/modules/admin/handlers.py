@@ -15,6 +15,16 @@ from share.promt_utils import (
 from share.utils import (
     add_allowed_user, remove_allowed_user, get_allowed_users_list, is_allowed_user, reload_users, get_users_count
 )
+from modules.notion.client import notion_service, roster_cache, invalidate_driver_list
+from modules.notion.outbox import comment_outbox
+from modules.notion.mirror import driver_mirror
+from modules.notion.short_ids import short_ids
+from share.transcript_cache import transcript_cache
+from share.job_queue import audio_queue
+from share.job_journal import job_journal
+from modules.openai.gpt_cache import gpt_cache
+from modules.openai.model_router import model_router, LATENCY_BUCKETS
+from modules.openai.resilience import resilient
 from .states import AdminStates
 
 logger = logging.getLogger(__name__)
@@ -38,7 +48,8 @@ def get_admin_keyboard():
             InlineKeyboardButton(text="📋 Логи", callback_data="admin_logs")
         ],
         [
-            InlineKeyboardButton(text="👥 Пользователи", callback_data="admin_users")
+            InlineKeyboardButton(text="👥 Пользователи", callback_data="admin_users"),
+            InlineKeyboardButton(text="🗂 Notion", callback_data="admin_notion")
         ],
         [
             InlineKeyboardButton(text="❌ Закрыть", callback_data="admin_close")
@@ -162,6 +173,10 @@ async def admin_callback_handler(callback: CallbackQuery, state: FSMContext):
         await start_remove_user(callback, state)
     elif action == "admin_users_reload":
         await reload_users_from_file(callback)
+    elif action == "admin_notion":
+        await show_notion_menu(callback)
+    elif action == "admin_notion_roster_reset":
+        await reset_roster_cache(callback)
 
 async def show_stats(callback: CallbackQuery):
     """Показать статистику бота"""
@@ -176,6 +191,55 @@ async def show_stats(callback: CallbackQuery):
 📈 Статус: Активен
     """
     
+    queue = audio_queue.stats()
+    text += "\n<b>Очередь обработки аудио:</b>\n"
+    text += f"В очереди: <b>{queue['depth']}</b> (пользователей: {queue['users_waiting']}), в работе: <b>{queue['running']}</b> / {queue['workers']}\n"
+    text += f"Загрузка обработчиков: {queue['utilization']:.0%}, среднее ожидание: {queue['avg_wait']:.0f} сек, средняя обработка: {queue['avg_duration']:.0f} сек\n"
+    text += f"Обработано: {queue['completed']}, отклонено (очередь полна): {queue['rejected']}\n"
+    
+    journal = job_journal.stats()
+    unfinished = sum(count for stage, count in journal.items() if stage not in ("delivered", "failed"))
+    text += f"Журнал задач: незавершенных <b>{unfinished}</b>, доставлено {journal.get('delivered', 0)}, с ошибкой {journal.get('failed', 0)}\n"
+    
+    cache = transcript_cache.stats()
+    text += "\n<b>Кэш транскрипций:</b>\n"
+    text += f"Записей: <b>{cache['entries']}</b>, {cache['size_mb']:.1f} / {cache['max_mb']:.0f} МБ\n"
+    text += f"Попаданий: <b>{cache['hits']}</b>, распознано заново: <b>{cache['misses']}</b>\n"
+    
+    gpt = gpt_cache.stats()
+    text += "\n<b>Кэш ответов GPT:</b>\n"
+    text += f"Ответов: <b>{gpt['entries']}</b> (в памяти {gpt['memory']})\n"
+    text += f"Попаданий: <b>{gpt['hits']}</b>, запросов к GPT: <b>{gpt['misses']}</b>\n"
+    
+    routing = model_router.stats()
+    if routing["models"]:
+        text += "\n<b>Модели GPT:</b>\n"
+        for m in routing["models"]:
+            status = "✅" if m["healthy"] else "⚠️"
+            text += (
+                f"{status} {m['model']}: вызовов <b>{m['calls']}</b>, ошибок {m['error_rate']:.0%}, "
+                f"p50 {m['p50']:.1f} сек, p95 {m['p95']:.1f} сек\n"
+            )
+            bars = ", ".join(
+                f"{'&gt;' + str(LATENCY_BUCKETS[-2]) if bound == float('inf') else '≤' + str(bound)}: {count}"
+                for bound, count in m["histogram"] if count
+            )
+            if bars:
+                text += f"   {bars}\n"
+        decisions = ", ".join(f"{model} ({reason}): {count}" for (reason, model), count in routing["decisions"].items())
+        if decisions:
+            text += f"Выбор модели: {decisions}\n"
+    
+    calls = resilient.stats()
+    if calls:
+        states = {"closed": "✅ работает", "half_open": "🔄 пробный запрос", "open": "⛔ запросы отклоняются"}
+        text += "\n<b>Вызовы OpenAI:</b>\n"
+        for kind, c in calls.items():
+            text += f"{kind}: {states[c['state']]}, повторов <b>{c['retries']}</b>, размыканий {c['trips']}"
+            if c["hedges"]:
+                text += f", дублей {c['hedges']} (быстрее {c['hedge_wins']})"
+            text += "\n"
+    
     keyboard = InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(text="🔙 Назад", callback_data="admin_back")]
     ])
@@ -698,3 +762,59 @@ async def process_remove_user(message: Message, state: FSMContext):
     
     await state.clear()
 
+
+# Функции управления интеграцией с Notion
+async def show_notion_menu(callback: CallbackQuery):
+    """Показать состояние кэшей Notion"""
+    roster = roster_cache.stats()
+    age = f"{roster['age']} сек назад" if roster["age"] is not None else "не загружен"
+    
+    text = "🗂 <b>Notion</b>\n\n"
+    text += "<b>Кэш водителей:</b>\n"
+    text += f"Записей: <b>{roster['rows']}</b>\n"
+    text += f"Синхронизирован: {age} (TTL {roster['ttl']} сек)\n"
+    text += f"Версия: {roster['version']}\n"
+    
+    flight = notion_service.flight.stats()
+    text += "\n<b>Объединение запросов:</b>\n"
+    text += f"Попаданий: <b>{flight['hits']}</b>, промахов: <b>{flight['misses']}</b>, объединено: <b>{flight['coalesced']}</b>\n"
+    text += f"Выполняется сейчас: {flight['inflight']}\n"
+    
+    sched = notion_service.scheduler.stats()
+    text += "\n<b>Планировщик запросов:</b>\n"
+    text += f"В очереди: интерактивных <b>{sched['queue_interactive']}</b>, фоновых <b>{sched['queue_background']}</b>\n"
+    text += f"Ожидание слота: среднее {sched['wait_avg']:.2f} сек, p95 {sched['wait_p95']:.2f} сек, макс {sched['wait_max']:.2f} сек\n"
+    text += f"Запросов: {sched['requests']}, ответов 429: {sched['rate_limited']}\n"
+    if sched["paused_for"] > 0:
+        text += f"⏸ Пауза по Retry-After: {sched['paused_for']:.1f} сек\n"
+    
+    outbox = comment_outbox.stats()
+    oldest = f"{outbox['oldest_age']} сек" if outbox["oldest_age"] is not None else "—"
+    text += "\n<b>Очередь комментариев:</b>\n"
+    text += f"В очереди: <b>{outbox['depth']}</b> (с ошибками: {outbox['failing']}), самая старая: {oldest}\n"
+    text += f"Отправлено с запуска: {outbox['delivered']}, не отправлено (failed): {outbox['failed']}\n"
+    
+    mirror = driver_mirror.stats()
+    mirror_age = f"{mirror['age']} сек назад" if mirror["age"] is not None else "еще не синхронизирована"
+    text += "\n<b>Локальная копия (/find):</b>\n"
+    text += f"Записей: <b>{mirror['rows']}</b>, синхронизирована: {mirror_age}, FTS5: {'да' if mirror['fts'] else 'нет'}\n"
+    
+    ids = short_ids.stats()
+    text += "\n<b>Короткие ID кнопок:</b>\n"
+    text += f"Всего: <b>{ids['total']}</b>, в памяти: {ids['cached']}\n"
+    
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="🔄 Обновить", callback_data="admin_notion")],
+        [InlineKeyboardButton(text="🗑 Сбросить кэш водителей", callback_data="admin_notion_roster_reset")],
+        [InlineKeyboardButton(text="🔙 Назад", callback_data="admin_back")]
+    ])
+    
+    await callback.message.edit_text(text, reply_markup=keyboard)
+
+
+async def reset_roster_cache(callback: CallbackQuery):
+    """Сбрасывает кэш списка водителей"""
+    invalidate_driver_list()
+    logger.info(f"Админ {callback.from_user.id} сбросил кэш водителей")
+    await callback.answer("✅ Кэш водителей сброшен")
+    await show_notion_menu(callback)
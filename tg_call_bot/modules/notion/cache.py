@@ -0,0 +1,227 @@
+import asyncio
+import logging
+import time
+from typing import AsyncIterator, Dict, List, Optional
+
+from .schema import DriverRecord
+
+# Настройка логирования
+logger = logging.getLogger(__name__)
+
+
+class _SharedScan:
+    """
+    Полная загрузка базы, которую читают все запросы холодного старта
+
+    Загрузку ведет одна фоновая задача, а каждый запрос проходит по уже
+    полученным пачкам с начала и затем ждет следующие.
+    """
+
+    def __init__(self):
+        self.batches: List[List[DriverRecord]] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self._updated = asyncio.Event()
+
+    def _notify(self) -> None:
+        self._updated.set()
+        self._updated = asyncio.Event()
+
+    def publish(self, batch: List[DriverRecord]) -> None:
+        self.batches.append(batch)
+        self._notify()
+
+    def finish(self, error: Optional[BaseException] = None) -> None:
+        self.done = True
+        self.error = error
+        self._notify()
+
+    async def follow(self) -> AsyncIterator[List[DriverRecord]]:
+        index = 0
+        while True:
+            while index < len(self.batches):
+                yield self.batches[index]
+                index += 1
+            if self.done:
+                if self.error is not None:
+                    raise self.error
+                return
+            await self._updated.wait()
+
+
+class RosterCache:
+    """
+    In-process кэш списка водителей с TTL и дельта-синхронизацией
+
+    Пока кэш свежий, список отдается из памяти. После истечения TTL
+    из Notion запрашиваются только записи, у которых last_edited_time
+    изменился с момента последней синхронизации, и они сливаются в кэш.
+    Запрос к базе не возвращает удаленные страницы, поэтому раз в
+    full_sync_interval секунд кэш перезагружается целиком.
+    """
+
+    def __init__(self, service, ttl: int = 60, full_sync_interval: int = 1800):
+        """
+        Args:
+            service: NotionService, из которого загружается список
+            ttl (int): Время жизни кэша в секундах
+            full_sync_interval (int): Интервал полной перезагрузки в секундах
+        """
+        self.service = service
+        self.ttl = ttl
+        self.full_sync_interval = full_sync_interval
+
+        self._rows: Dict[str, DriverRecord] = {}
+        self._snapshot: List[DriverRecord] = []
+        self._synced_at = 0.0
+        self._full_synced_at = 0.0
+        self._edited_cursor: Optional[str] = None
+        self._lock = asyncio.Lock()
+        self._scan: Optional[_SharedScan] = None
+        self._scan_task: Optional[asyncio.Task] = None
+
+        # Версия меняется при каждом изменении содержимого кэша
+        self.version = 0
+
+    @property
+    def is_loaded(self) -> bool:
+        return self._full_synced_at > 0
+
+    def _is_fresh(self) -> bool:
+        return self.is_loaded and time.monotonic() - self._synced_at < self.ttl
+
+    def _needs_full_sync(self) -> bool:
+        return not self.is_loaded or time.monotonic() - self._full_synced_at >= self.full_sync_interval
+
+    def _rebuild_snapshot(self) -> None:
+        self._snapshot = sorted(self._rows.values(), key=lambda d: d.name.lower())
+        self.version += 1
+
+    def _merge(self, batch: List[DriverRecord]) -> int:
+        """Сливает пачку записей в кэш, архивные записи удаляются. Возвращает число изменений"""
+        changed = 0
+        for row in batch:
+            if row.archived:
+                if self._rows.pop(row.id, None) is not None:
+                    changed += 1
+                continue
+            if self._rows.get(row.id) != row:
+                self._rows[row.id] = row
+                changed += 1
+            edited = row.last_edited_time
+            if edited and (self._edited_cursor is None or edited > self._edited_cursor):
+                self._edited_cursor = edited
+        return changed
+
+    async def _full_sync(self) -> None:
+        rows = []
+        async for batch in self.service.iter_names_and_ids():
+            rows.extend(batch)
+        self._apply_full(rows)
+
+    def _apply_full(self, rows: List[DriverRecord]) -> None:
+        self._rows = {}
+        self._edited_cursor = None
+        self._merge(rows)
+        self._rebuild_snapshot()
+        self._synced_at = self._full_synced_at = time.monotonic()
+        logger.info(f"Кэш водителей полностью обновлен: {len(self._rows)} записей")
+
+    async def _delta_sync(self) -> None:
+        changed = 0
+        async for batch in self.service.iter_names_and_ids(edited_since=self._edited_cursor):
+            changed += self._merge(batch)
+        if changed:
+            self._rebuild_snapshot()
+        self._synced_at = time.monotonic()
+        logger.info(f"Дельта-синхронизация кэша водителей: изменено {changed} записей")
+
+    async def refresh(self) -> None:
+        """Обновляет кэш: дельта-синхронизация или полная перезагрузка по расписанию"""
+        async with self._lock:
+            if self._is_fresh():
+                # Пока ждали блокировку, кэш уже обновил другой запрос
+                return
+            if self._needs_full_sync():
+                await self._full_sync()
+            else:
+                await self._delta_sync()
+
+    async def get(self) -> List[DriverRecord]:
+        """
+        Возвращает список водителей из кэша, при необходимости обновив его
+
+        Returns:
+            List[DriverRecord]: Отсортированный по имени список водителей
+        """
+        if not self._is_fresh():
+            await self.refresh()
+        return self._snapshot
+
+    def peek(self) -> Optional[List[DriverRecord]]:
+        """Текущий список без обращения к Notion (None, если кэш еще не загружен)"""
+        return self._snapshot if self.is_loaded else None
+
+    async def iter_batches(self) -> AsyncIterator[List[DriverRecord]]:
+        """
+        Отдает список водителей пачками
+
+        Теплый кэш отдается одной пачкой. При холодном старте страницы
+        Notion отдаются по мере получения и одновременно наполняют кэш,
+        чтобы первый запрос не ждал загрузки всей базы. Загрузку ведет
+        одна фоновая задача под блокировкой кэша, остальные запросы
+        холодного старта читают ее пачки, а не сканируют базу заново.
+        """
+        if self._scan is None and self._needs_full_sync() and not self._lock.locked():
+            self._scan = _SharedScan()
+            self._scan_task = asyncio.create_task(self._run_scan(self._scan))
+        if self._scan is not None:
+            async for batch in self._scan.follow():
+                yield batch
+            return
+        yield await self.get()
+
+    async def _run_scan(self, scan: _SharedScan) -> None:
+        """Полная загрузка для iter_batches: пачки публикуются по мере получения"""
+        try:
+            async with self._lock:
+                if not self._needs_full_sync():
+                    # Пока ждали блокировку, базу уже загрузил другой запрос
+                    if self._snapshot:
+                        scan.publish(self._snapshot)
+                else:
+                    rows = []
+                    async for batch in self.service.iter_names_and_ids():
+                        visible = [row for row in batch if not row.archived]
+                        rows.extend(visible)
+                        if visible:
+                            scan.publish(visible)
+                    self._apply_full(rows)
+        except Exception as e:
+            logger.error(f"Ошибка загрузки списка водителей: {e}")
+            scan.finish(e)
+        else:
+            scan.finish()
+        finally:
+            if self._scan is scan:
+                self._scan = None
+
+    def invalidate(self) -> None:
+        """Полностью сбрасывает кэш, следующий запрос перезагрузит базу"""
+        self._rows = {}
+        self._snapshot = []
+        self._synced_at = self._full_synced_at = 0.0
+        self._edited_cursor = None
+        self.version += 1
+        logger.info("Кэш водителей сброшен")
+
+    def stats(self) -> Dict:
+        """Возвращает состояние кэша для админ панели"""
+        now = time.monotonic()
+        return {
+            "rows": len(self._rows),
+            "version": self.version,
+            "age": int(now - self._synced_at) if self.is_loaded else None,
+            "full_age": int(now - self._full_synced_at) if self.is_loaded else None,
+            "ttl": self.ttl,
+        }
@@ -1,10 +1,17 @@
-import asyncio
-from datetime import datetime
-from typing import List, Dict, Optional, Tuple
+from typing import AsyncIterator, List, Dict, Optional, Tuple
 from notion_client import AsyncClient
 import logging
 
-from share.config import NOTION_KEY, NOTION_DATABASE_ID
+from share.config import (
+    NOTION_KEY, NOTION_DATABASE_ID, NOTION_PAGE_SIZE, NOTION_MAX_ROWS,
+    NOTION_ROSTER_TTL, NOTION_ROSTER_FULL_SYNC, NOTION_COALESCE_TTL,
+    NOTION_RATE_LIMIT, NOTION_RATE_BURST, NOTION_MAX_RETRIES
+)
+from share.singleflight import SingleFlight
+from .cache import RosterCache
+from .richtext import split_comment, to_rich_text
+from .schema import DriverRecord, decode_driver
+from .scheduler import NotionScheduler, PRIORITY_INTERACTIVE, PRIORITY_BACKGROUND
 
 # Настройка логирования
 logger = logging.getLogger(__name__)
@@ -16,57 +23,131 @@ class NotionService:
         """Инициализация клиента Notion"""
         self.client = AsyncClient(auth=NOTION_KEY)
         self.database_id = NOTION_DATABASE_ID
+        # Объединение одинаковых конкурентных чтений страниц и комментариев
+        self.flight = SingleFlight("notion", ttl=NOTION_COALESCE_TTL)
+        # Все запросы к API проходят через планировщик с учетом лимита Notion
+        self.scheduler = NotionScheduler(rate=NOTION_RATE_LIMIT, burst=NOTION_RATE_BURST, max_retries=NOTION_MAX_RETRIES)
     
-    async def get_names_and_ids(self) -> List[Dict[str, str]]:
+    async def _request(self, priority: int, method, **kwargs):
+        """Выполняет метод API Notion через планировщик запросов"""
+        return await self.scheduler.run(lambda: method(**kwargs), priority)
+    
+    async def iter_names_and_ids(
+        self,
+        page_size: Optional[int] = None,
+        max_rows: Optional[int] = None,
+        edited_since: Optional[str] = None,
+        priority: int = PRIORITY_BACKGROUND,
+    ) -> AsyncIterator[List[DriverRecord]]:
         """
-        Получает список имен и ID из базы данных Notion
+        Постранично получает записи водителей из базы данных Notion, следуя next_cursor
         
-        Returns:
-            List[Dict[str, str]]: Список словарей с ключами 'id', 'name'
+        Args:
+            page_size (Optional[int]): Размер страницы запроса (по умолчанию NOTION_PAGE_SIZE)
+            max_rows (Optional[int]): Максимум записей (по умолчанию NOTION_MAX_ROWS)
+            edited_since (Optional[str]): ISO-время; если задано, возвращаются только
+                записи, измененные начиная с этого момента (дельта-синхронизация)
+            priority (int): Приоритет запросов в планировщике
+            
+        Yields:
+            List[DriverRecord]: Пачка записей по мере получения страниц
         """
+        page_size = min(page_size or NOTION_PAGE_SIZE, 100)
+        max_rows = max_rows or NOTION_MAX_ROWS
+        
+        cursor = None
+        total = 0
         try:
-            # Запрос к базе данных
-            response = await self.client.databases.query(
-                database_id=self.database_id,
-                sorts=[
-                    {
-                        "property": "Name",
-                        "direction": "ascending"
+            while total < max_rows:
+                query = {
+                    "database_id": self.database_id,
+                    "sorts": [
+                        {
+                            "property": "Name",
+                            "direction": "ascending"
+                        }
+                    ],
+                    "page_size": min(page_size, max_rows - total),
+                }
+                if edited_since:
+                    query["filter"] = {
+                        "timestamp": "last_edited_time",
+                        "last_edited_time": {"on_or_after": edited_since}
                     }
-                ]
-            )
-            
-            results = []
-            for page in response["results"]:
-                page_id = page["id"]
+                if cursor:
+                    query["start_cursor"] = cursor
+                
+                # Запрос очередной страницы базы данных
+                response = await self._request(priority, self.client.databases.query, **query)
                 
-                # Получаем название страницы (Name - это Title property)
-                name_property = page["properties"].get("Name", {})
-                if name_property.get("type") == "title":
-                    title_list = name_property.get("title", [])
-                    if title_list:
-                        name = "".join([text["plain_text"] for text in title_list])
-                    else:
-                        name = "Без названия"
-                else:
-                    name = "Без названия"
+                batch = [decode_driver(page) for page in response["results"]]
+                total += len(batch)
+                if batch:
+                    yield batch
                 
-                results.append({
-                    "id": page_id,
-                    "name": name
-                })
+                cursor = response.get("next_cursor")
+                if not response.get("has_more") or not cursor:
+                    break
+            else:
+                logger.warning(f"Достигнут лимит записей NOTION_MAX_ROWS={max_rows}, список водителей усечен")
             
-            logger.info(f"Получено {len(results)} записей из Notion")
-            return results
+            logger.info(f"Получено {total} записей из Notion")
             
         except Exception as e:
             logger.error(f"Ошибка при получении данных из Notion: {e}")
             raise Exception(f"Не удалось получить данные из Notion: {e}")
     
+    async def get_names_and_ids(self) -> List[DriverRecord]:
+        """
+        Получает полный список записей водителей из базы данных Notion
+        
+        Returns:
+            List[DriverRecord]: Список записей водителей
+        """
+        results = []
+        async for batch in self.iter_names_and_ids():
+            results.extend(batch)
+        return results
+    
+    async def create_comment(self, page_id: str, comment: str) -> int:
+        """
+        Создает комментарий к странице в Notion, не перехватывая ошибки
+        
+        Нужен очереди комментариев, которая сама решает по ошибке Notion,
+        повторять запись или отказаться от нее.
+        
+        Args:
+            page_id (str): ID страницы в Notion
+            comment (str): Комментарий для добавления
+            
+        Returns:
+            int: Количество записанных комментариев (частей)
+        """
+        parts = split_comment(comment)
+        # Создаем новые комментарии к странице строго по порядку частей
+        for part in parts:
+            await self._request(
+                PRIORITY_BACKGROUND,
+                self.client.comments.create,
+                parent={"page_id": page_id},
+                rich_text=to_rich_text(part)
+            )
+        
+        # Сбрасываем недавний результат, чтобы новый комментарий сразу был виден
+        self.flight.forget_prefix(("comments", page_id))
+        logger.info(f"Комментарий создан для страницы {page_id} (частей: {len(parts)})")
+        return len(parts)
+    
     async def add_comment_to_page(self, page_id: str, comment: str) -> bool:
         """
         Создает новый комментарий к странице в Notion
         
+        Длинный текст делится на text-объекты по 2000 символов, а если не помещается
+        в один комментарий - на несколько пронумерованных комментариев, которые
+        записываются по порядку. При ошибке запись останавливается на ней, поэтому
+        для повторов без дублей длинный текст лучше ставить в очередь
+        (enqueue_comment сохраняет каждую часть отдельной записью).
+        
         Args:
             page_id (str): ID страницы в Notion
             comment (str): Комментарий для добавления
@@ -75,28 +156,83 @@ class NotionService:
             bool: True если комментарий добавлен успешно, False в противном случае
         """
         try:
-            # Создаем новый комментарий к странице
-            await self.client.comments.create(
-                parent={"page_id": page_id},
-                rich_text=[
-                    {
-                        "text": {
-                            "content": comment
-                        }
-                    }
-                ]
-            )
-            
-            logger.info(f"Комментарий создан для страницы {page_id}")
+            await self.create_comment(page_id, comment)
             return True
             
         except Exception as e:
             logger.error(f"Ошибка при создании комментария для страницы {page_id}: {e}")
             return False
     
+    @staticmethod
+    def _parse_comment(comment: Dict) -> Dict:
+        """Преобразует комментарий Notion в словарь с текстом, временем и автором"""
+        comment_data = {
+            "id": comment["id"],
+            "created_time": comment["created_time"],
+            "last_edited_time": comment["last_edited_time"],
+            "created_by": comment.get("created_by", {}),
+            "text": ""
+        }
+        
+        # Извлекаем текст комментария
+        rich_text = comment.get("rich_text", [])
+        if rich_text:
+            comment_data["text"] = "".join([text.get("plain_text", "") for text in rich_text])
+        return comment_data
+    
+    async def fetch_comments_page(
+        self,
+        page_id: str,
+        cursor: Optional[str] = None,
+        page_size: Optional[int] = None,
+        priority: int = PRIORITY_INTERACTIVE,
+    ) -> Tuple[List[Dict], Optional[str]]:
+        """
+        Получает одну страницу комментариев к странице Notion
+        
+        Args:
+            page_id (str): ID страницы в Notion
+            cursor (Optional[str]): next_cursor предыдущей страницы комментариев
+            page_size (Optional[int]): Размер страницы (по умолчанию NOTION_PAGE_SIZE)
+            priority (int): Приоритет запроса в планировщике
+            
+        Returns:
+            Tuple[List[Dict], Optional[str]]: Комментарии и курсор следующей страницы (None - больше нет)
+        """
+        params = {"block_id": page_id, "page_size": min(page_size or NOTION_PAGE_SIZE, 100)}
+        if cursor:
+            params["start_cursor"] = cursor
+        response = await self.flight.do(
+            ("comments", page_id, cursor),
+            lambda: self._request(priority, self.client.comments.list, **params)
+        )
+        comments = [self._parse_comment(comment) for comment in response.get("results", [])]
+        next_cursor = response.get("next_cursor") if response.get("has_more") else None
+        return comments, next_cursor
+    
+    async def iter_page_comments(
+        self,
+        page_id: str,
+        page_size: Optional[int] = None,
+        priority: int = PRIORITY_INTERACTIVE,
+    ) -> AsyncIterator[List[Dict]]:
+        """
+        Постранично получает комментарии к странице, следуя next_cursor
+        
+        Yields:
+            List[Dict]: Пачка комментариев (от старых к новым) по мере получения страниц
+        """
+        cursor = None
+        while True:
+            comments, cursor = await self.fetch_comments_page(page_id, cursor, page_size, priority)
+            if comments:
+                yield comments
+            if not cursor:
+                break
+    
     async def get_page_comments(self, page_id: str) -> List[Dict]:
         """
-        Получает список комментариев к странице
+        Получает список всех комментариев к странице
         
         Args:
             page_id (str): ID страницы в Notion
@@ -105,25 +241,9 @@ class NotionService:
             List[Dict]: Список комментариев с информацией о времени создания и авторе
         """
         try:
-            # Получаем комментарии к странице
-            response = await self.client.comments.list(block_id=page_id)
-            
             comments = []
-            for comment in response.get("results", []):
-                comment_data = {
-                    "id": comment["id"],
-                    "created_time": comment["created_time"],
-                    "last_edited_time": comment["last_edited_time"],
-                    "created_by": comment.get("created_by", {}),
-                    "text": ""
-                }
-                
-                # Извлекаем текст комментария
-                rich_text = comment.get("rich_text", [])
-                if rich_text:
-                    comment_data["text"] = "".join([text.get("plain_text", "") for text in rich_text])
-                
-                comments.append(comment_data)
+            async for batch in self.iter_page_comments(page_id):
+                comments.extend(batch)
             
             logger.info(f"Получено {len(comments)} комментариев для страницы {page_id}")
             return comments
@@ -132,7 +252,7 @@ class NotionService:
             logger.error(f"Ошибка при получении комментариев для страницы {page_id}: {e}")
             return []
     
-    async def get_page_details(self, page_id: str) -> Optional[Dict]:
+    async def get_page_details(self, page_id: str) -> Optional[DriverRecord]:
         """
         Получает детальную информацию о странице
         
@@ -140,61 +260,14 @@ class NotionService:
             page_id (str): ID страницы в Notion
             
         Returns:
-            Optional[Dict]: Информация о странице или None в случае ошибки
+            Optional[DriverRecord]: Информация о странице или None в случае ошибки
         """
         try:
-            page = await self.client.pages.retrieve(page_id=page_id)
-            properties = page["properties"]
-            
-            # Извлекаем данные из свойств
-            result = {
-                "id": page["id"],
-                "name": "",
-                "status": "",
-                "about_driver": "",
-                "number": "",
-                "date": "",
-                "notes": "",
-                "trailer": False
-            }
-            
-            # Name (Title)
-            if "Name" in properties and properties["Name"]["type"] == "title":
-                title_list = properties["Name"].get("title", [])
-                result["name"] = "".join([text["plain_text"] for text in title_list])
-            
-            # Status (Select)
-            if "status" in properties and properties["status"]["type"] == "select":
-                select_obj = properties["status"].get("select")
-                if select_obj:
-                    result["status"] = select_obj.get("name", "")
-            
-            # About in the driver (Rich Text)
-            if "About in the driver" in properties and properties["About in the driver"]["type"] == "rich_text":
-                rich_text_list = properties["About in the driver"].get("rich_text", [])
-                result["about_driver"] = "".join([text["plain_text"] for text in rich_text_list])
-            
-            # Number (Rich Text)
-            if "Number" in properties and properties["Number"]["type"] == "rich_text":
-                rich_text_list = properties["Number"].get("rich_text", [])
-                result["number"] = "".join([text["plain_text"] for text in rich_text_list])
-            
-            # Date
-            if "Date" in properties and properties["Date"]["type"] == "date":
-                date_obj = properties["Date"].get("date")
-                if date_obj:
-                    result["date"] = date_obj.get("start", "")
-            
-            # Notes (Rich Text)
-            if "Notes" in properties and properties["Notes"]["type"] == "rich_text":
-                rich_text_list = properties["Notes"].get("rich_text", [])
-                result["notes"] = "".join([text["plain_text"] for text in rich_text_list])
-            
-            # Trailer (Checkbox)
-            if "Trailer" in properties and properties["Trailer"]["type"] == "checkbox":
-                result["trailer"] = properties["Trailer"].get("checkbox", False)
-            
-            return result
+            page = await self.flight.do(
+                ("page", page_id),
+                lambda: self._request(PRIORITY_INTERACTIVE, self.client.pages.retrieve, page_id=page_id)
+            )
+            return decode_driver(page)
             
         except Exception as e:
             logger.error(f"Ошибка при получении деталей страницы {page_id}: {e}")
@@ -204,16 +277,50 @@ class NotionService:
 # Создаем глобальный экземпляр сервиса
 notion_service = NotionService()
 
+# Кэш списка водителей поверх сервиса
+roster_cache = RosterCache(notion_service, ttl=NOTION_ROSTER_TTL, full_sync_interval=NOTION_ROSTER_FULL_SYNC)
+
 
 # Функции-обертки для удобного использования
-async def get_driver_list() -> List[Dict[str, str]]:
+async def get_driver_list() -> List[DriverRecord]:
+    """
+    Получает список водителей для выбора
+    
+    Returns:
+        List[DriverRecord]: Список с водителями
+    """
+    return await roster_cache.get()
+
+
+def iter_driver_list() -> AsyncIterator[List[DriverRecord]]:
     """
-    Получает список водителей (имена и ID) для выбора
+    Постранично получает список водителей, чтобы отрисовывать его до окончания загрузки
     
     Returns:
-        List[Dict[str, str]]: Список с водителями
+        AsyncIterator[List[DriverRecord]]: Пачки водителей по мере получения страниц
     """
-    return await notion_service.get_names_and_ids()
+    return roster_cache.iter_batches()
+
+
+async def get_driver_snapshot() -> Tuple[List[DriverRecord], int]:
+    """
+    Возвращает загруженный список водителей и его версию для листания страниц
+
+    Пока кэш загружен, Notion не запрашивается даже после истечения TTL:
+    листание должно показывать тот же список, что и первая страница.
+
+    Returns:
+        Tuple[List[DriverRecord], int]: Отсортированный список и версия кэша
+    """
+    drivers = roster_cache.peek()
+    if drivers is None:
+        drivers = await roster_cache.get()
+    return drivers, roster_cache.version
+
+
+def invalidate_driver_list() -> None:
+    """Сбрасывает кэш списка водителей, следующий запрос загрузит базу заново"""
+    roster_cache.invalidate()
 
 
 async def add_comment(page_id: str, comment: str) -> bool:
@@ -230,7 +337,7 @@ async def add_comment(page_id: str, comment: str) -> bool:
     return await notion_service.add_comment_to_page(page_id, comment)
 
 
-async def get_driver_info(page_id: str) -> Optional[Dict]:
+async def get_driver_info(page_id: str) -> Optional[DriverRecord]:
     """
     Получает полную информацию о водителе
     
@@ -238,7 +345,7 @@ async def get_driver_info(page_id: str) -> Optional[Dict]:
         page_id (str): ID записи водителя
         
     Returns:
-        Optional[Dict]: Информация о водителе
+        Optional[DriverRecord]: Информация о водителе
     """
     return await notion_service.get_page_details(page_id)
 
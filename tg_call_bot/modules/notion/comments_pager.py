@@ -0,0 +1,107 @@
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from .formatters import comment_entry
+
+# Ограничение Telegram - 4096 символов, оставляем запас под заголовок и экранирование
+SCREEN_LIMIT = 3500
+# Сколько держать загруженные комментарии водителя, пока пользователь листает
+PAGER_TTL = 600
+PAGER_MAX = 200
+
+FetchPage = Callable[[str, Optional[str]], Awaitable[Tuple[List[Dict], Optional[str]]]]
+
+
+class CommentsPager:
+    """
+    Комментарии водителя, разбитые на экраны для просмотра в Telegram
+
+    Комментарии подгружаются из Notion страницами только тогда, когда
+    пользователь долистал до экрана, которому их не хватает.
+    """
+
+    def __init__(self, driver_id: str, fetch_page: FetchPage):
+        self.driver_id = driver_id
+        self.fetch_page = fetch_page
+        self.entries: List[str] = []
+        self.cursor: Optional[str] = None
+        self.exhausted = False
+        # Границы экранов: индексы entries [start, end)
+        self.screens: List[Tuple[int, int]] = []
+        self.touched_at = time.monotonic()
+
+    async def _load_more(self) -> bool:
+        """Подгружает следующую страницу комментариев. Возвращает False, если их больше нет"""
+        if self.exhausted:
+            return False
+        comments, self.cursor = await self.fetch_page(self.driver_id, self.cursor)
+        start = len(self.entries) + 1
+        self.entries.extend(comment_entry(i, c, SCREEN_LIMIT) for i, c in enumerate(comments, start))
+        self.exhausted = self.cursor is None
+        return bool(comments) or not self.exhausted
+
+    async def _build_screen(self) -> bool:
+        """Собирает следующий экран. Возвращает False, если комментарии закончились"""
+        start = self.screens[-1][1] if self.screens else 0
+        end, size = start, 0
+        while True:
+            if end == len(self.entries) and not await self._load_more():
+                break
+            if end == len(self.entries):
+                continue
+            entry_size = len(self.entries[end]) + 1
+            if end > start and size + entry_size > SCREEN_LIMIT:
+                break
+            size += entry_size
+            end += 1
+        if end == start and self.screens:
+            return False
+        self.screens.append((start, end))
+        return True
+
+    async def screen(self, number: int) -> Tuple[int, List[str], bool]:
+        """
+        Возвращает экран с номером number (с нуля), подгружая комментарии при необходимости
+
+        Returns:
+            Tuple[int, List[str], bool]: Фактический номер экрана, строки комментариев
+                и есть ли следующий экран
+        """
+        self.touched_at = time.monotonic()
+        while len(self.screens) <= number and await self._build_screen():
+            pass
+        number = min(number, len(self.screens) - 1)
+        start, end = self.screens[number]
+        has_next = number + 1 < len(self.screens) or end < len(self.entries) or not self.exhausted
+        return number, self.entries[start:end], has_next
+
+    @property
+    def loaded(self) -> int:
+        return len(self.entries)
+
+
+_pagers: "OrderedDict[str, CommentsPager]" = OrderedDict()
+
+
+def get_pager(driver_id: str, fetch_page: FetchPage, reset: bool = False) -> CommentsPager:
+    """
+    Возвращает просмотрщик комментариев водителя, сохраненный между нажатиями кнопок
+
+    Args:
+        driver_id: ID записи водителя
+        fetch_page: Функция загрузки страницы комментариев (page_id, cursor)
+        reset: Начать просмотр заново (перечитать комментарии из Notion)
+    """
+    now = time.monotonic()
+    for key in [k for k, p in _pagers.items() if now - p.touched_at > PAGER_TTL]:
+        _pagers.pop(key, None)
+
+    pager = _pagers.get(driver_id)
+    if pager is None or reset:
+        pager = CommentsPager(driver_id, fetch_page)
+        _pagers[driver_id] = pager
+    _pagers.move_to_end(driver_id)
+    while len(_pagers) > PAGER_MAX:
+        _pagers.popitem(last=False)
+    return pager
@@ -1,3 +1,5 @@
+from .schema import DriverRecord
+
 def escape_md(text: str) -> str:
     if text is None:
         return ""
@@ -5,44 +7,73 @@ def escape_md(text: str) -> str:
         text = text.replace(ch, f"\\{ch}")
     return text
 
-def driver_brief(info: dict) -> str:
-    name = escape_md(info.get("name",""))
+def driver_brief(info: DriverRecord) -> str:
+    name = escape_md(info.name)
     parts = [f"👤 Выбран водитель: *{name}*"]
-    if info.get("status"): parts.append(f"📊 Статус: {escape_md(info['status'])}")
-    if info.get("number"): parts.append(f"📞 Номер: {escape_md(info['number'])}")
-    if info.get("about_driver"):
-        about = info["about_driver"]
+    if info.status: parts.append(f"📊 Статус: {escape_md(info.status)}")
+    if info.number: parts.append(f"📞 Номер: {escape_md(info.number)}")
+    if info.about_driver:
+        about = info.about_driver
         parts.append(f"ℹ️ О водителе: {escape_md(about[:100] + ('...' if len(about)>100 else ''))}")
-    if info.get("date"): parts.append(f"📅 Дата: {escape_md(info['date'])}")
-    if "trailer" in info: parts.append("🚛 Прицеп: Да" if info["trailer"] else "🚛 Прицеп: Нет")
-    if info.get("notes"):
-        notes = info["notes"]
+    if info.date: parts.append(f"📅 Дата: {escape_md(info.date)}")
+    parts.append("🚛 Прицеп: Да" if info.trailer else "🚛 Прицеп: Нет")
+    if info.notes:
+        notes = info.notes
         preview = notes[:200] + ("..." if len(notes) > 200 else "")
         parts.append("\n📝 Текущие заметки:")
         parts.append(escape_md(preview))
     parts.append("\n🎙️ Теперь отправьте запись звонка (аудио) или текстовый комментарий:")
     return "\n".join(parts)
 
-def driver_full(info: dict, comments: list[dict] | None) -> str:
-    name = escape_md(info.get("name",""))
-    txt = [f"👤 *{name}*\n", f"🆔 `{escape_md(info.get('id',''))[:8]}...`"]
-    if info.get("status"): txt.append(f"📊 Статус: {escape_md(info['status'])}")
-    if info.get("about_driver"): txt.append(f"ℹ️ О водителе: {escape_md(info['about_driver'])}")
-    if info.get("number"): txt.append(f"📞 Номер: {escape_md(info['number'])}")
-    if info.get("date"): txt.append(f"📅 Дата: {escape_md(info['date'])}")
-    txt.append(f"🚛 Прицеп: {'Да' if info.get('trailer') else 'Нет'}")
-    if info.get("notes"):
+def driver_full(info: DriverRecord, comments: list[dict] | None, has_more: bool = False) -> str:
+    name = escape_md(info.name)
+    txt = [f"👤 *{name}*\n", f"🆔 `{escape_md(info.id)[:8]}...`"]
+    if info.status: txt.append(f"📊 Статус: {escape_md(info.status)}")
+    if info.about_driver: txt.append(f"ℹ️ О водителе: {escape_md(info.about_driver)}")
+    if info.number: txt.append(f"📞 Номер: {escape_md(info.number)}")
+    if info.date: txt.append(f"📅 Дата: {escape_md(info.date)}")
+    txt.append(f"🚛 Прицеп: {'Да' if info.trailer else 'Нет'}")
+    if info.notes:
         txt.append("\n📝 *Заметки:*")
-        txt.append(escape_md(info["notes"]))
+        txt.append(escape_md(info.notes))
     if comments:
-        txt.append(f"\n💬 *Комментарии ({len(comments)}):*")
-        for c in comments[-3:]:
+        # Notion отдает комментарии от старых к новым. Если загружена только первая
+        # страница, последние из нее - не самые свежие, поэтому показываем первые
+        if has_more:
+            txt.append(f"\n💬 *Первые комментарии (всего больше {len(comments)}):*")
+            shown = comments[:3]
+        else:
+            txt.append(f"\n💬 *Комментарии ({len(comments)}):*")
+            shown = comments[-3:]
+        for c in shown:
             created = c.get("created_time","")[:16].replace("T"," ")
             body = c.get("text","")
             body = body[:100] + ("..." if len(body) > 100 else "")
             txt.append(f"• [{created or 'Неизвестно'}] {escape_md(body)}")
-        if len(comments) > 3:
+        if has_more:
+            txt.append("... новые комментарии - в разделе «Все комментарии»")
+        elif len(comments) > 3:
             txt.append(f"... и еще {len(comments)-3} комментариев")
     else:
         txt.append("\n💬 Комментарии отсутствуют")
     return "\n".join(txt)
+
+def comment_entry(i: int, c: dict, limit: int) -> str:
+    created = c.get("created_time","")[:16].replace("T"," ")
+    text = c.get("text","")
+    entry = f"*{i}.* [{created or 'Неизвестно'}]\n{escape_md(text)}\n"
+    if len(entry) > limit:
+        # Один комментарий не должен занимать больше экрана; не оставляем оборванное экранирование
+        cut = limit - len(f"*{i}.* [{created or 'Неизвестно'}]\n") - 10
+        body = escape_md(text)[:cut].rstrip("\\")
+        entry = f"*{i}.* [{created or 'Неизвестно'}]\n{body}{escape_md('...')}\n"
+    return entry
+
+def comments_screen(info: DriverRecord, entries: list[str], page: int, loaded: int, exhausted: bool) -> str:
+    total = f"Всего: {loaded}" if exhausted else f"Загружено: {loaded}"
+    lines = [f"💬 *Все комментарии к {escape_md(info.name)}*\n", f"{total} · стр. {page + 1}\n"]
+    if entries:
+        lines.extend(entries)
+    else:
+        lines.append("Комментарии отсутствуют")
+    return "\n".join(lines)
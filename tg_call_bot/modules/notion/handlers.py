@@ -1,43 +1,131 @@
-import logging, os
+import logging, html, time
 from aiogram import Router, F
-from aiogram.filters import Command, StateFilter
+from aiogram.filters import Command, CommandObject, StateFilter
 from aiogram.types import Message, CallbackQuery
 from aiogram.fsm.context import FSMContext
 
-from modules.notion.client import get_driver_list, add_comment, get_driver_info, get_driver_comments
+from modules.notion.client import notion_service, iter_driver_list, get_driver_snapshot, get_driver_info
+from modules.notion.outbox import enqueue_comment
+from modules.notion.mirror import driver_mirror, find_drivers
 from .states import NotionStates
-from .keyboards import drivers_kb, cancel_comment_kb, info_list_kb, info_nav_kb, comments_nav_kb
-from .formatters import escape_md, driver_brief, driver_full
-from .usecases import transcribe_file
+from .keyboards import (
+    cancel_comment_kb, info_nav_kb, comments_nav_kb, search_results_kb,
+    driver_list_kb, pages_count, letter_page, LIST_KINDS,
+)
+from .formatters import escape_md, driver_brief, driver_full, comments_screen
+from .comments_pager import get_pager
+from .short_ids import resolve_short_id
+from share.config import STREAM_EDIT_INTERVAL
+from share.usecases import run_job
+from share.job_journal import job_journal, STAGE_DELIVERED
+from share.job_queue import audio_queue, queue_notifier, QueueFullError
 
 logger = logging.getLogger(__name__)
 router = Router()
 
 
+# Подсказки к спискам водителей по виду списка (см. LIST_KINDS)
+_LIST_PROMPTS = {
+    "select": "Выберите водителя для добавления комментария:",
+    "info": "Выберите водителя:",
+    "bundle": "Выберите водителя, которому сохранить анализ звонка:",
+}
+
+def _list_text(drivers: list, page: int, prompt: str) -> str:
+    total = pages_count(drivers)
+    pages = f" (стр. {page + 1}/{total})" if total > 1 else ""
+    return f"👥 Найдено {len(drivers)} водителей{pages}.\n{prompt}"
+
+async def _render_driver_list(target: Message, kind: str) -> int:
+    """Отрисовывает список водителей по мере получения страниц из Notion
+
+    Сообщение target редактируется сразу после первой страницы, поэтому пользователь
+    видит первых водителей, не дожидаясь загрузки всей базы. Дальше правки идут
+    не чаще STREAM_EDIT_INTERVAL, чтобы большая база не упиралась в лимит Telegram.
+    Возвращает количество загруженных водителей.
+    """
+    prompt = _LIST_PROMPTS[kind]
+    loaded = []
+    edited_at = None
+    async for batch in iter_driver_list():
+        loaded.extend(batch)
+        if edited_at is not None and time.monotonic() - edited_at < STREAM_EDIT_INTERVAL:
+            continue
+        edited_at = time.monotonic()
+        await target.edit_text(
+            f"👥 Загружено {len(loaded)} водителей, загрузка продолжается...\n{prompt}",
+            reply_markup=driver_list_kb(kind, loaded)
+        )
+    if not loaded:
+        await target.edit_text("❌ Водители не найдены в базе данных")
+        return 0
+    # Итоговая страница строится по отсортированному списку из кэша
+    drivers, version = await get_driver_snapshot()
+    await target.edit_text(
+        _list_text(drivers, 0, prompt),
+        reply_markup=driver_list_kb(kind, drivers, 0, version)
+    )
+    return len(drivers)
+
+async def _show_list_page(callback: CallbackQuery, kind: str, page: int):
+    """Показывает страницу списка из загруженного кэша, не обращаясь к Notion"""
+    drivers, version = await get_driver_snapshot()
+    if not drivers:
+        return await callback.answer("❌ Водители не найдены в базе данных")
+    page = max(0, min(page, pages_count(drivers) - 1))
+    await callback.message.edit_text(
+        _list_text(drivers, page, _LIST_PROMPTS[kind]),
+        reply_markup=driver_list_kb(kind, drivers, page, version)
+    )
+    await callback.answer()
+
+@router.callback_query(F.data.startswith("drv_page:"))
+async def handle_list_page(callback: CallbackQuery):
+    _, kind, page = callback.data.split(":", 2)
+    if kind not in LIST_KINDS:
+        return await callback.answer()
+    try:
+        await _show_list_page(callback, kind, int(page))
+    except Exception:
+        logger.exception("Ошибка при переходе по страницам списка водителей")
+        await callback.answer("❌ Произошла ошибка при загрузке списка")
+
+@router.callback_query(F.data.startswith("drv_jump:"))
+async def handle_list_jump(callback: CallbackQuery):
+    _, kind, letter = callback.data.split(":", 2)
+    if kind not in LIST_KINDS:
+        return await callback.answer()
+    try:
+        drivers, _ = await get_driver_snapshot()
+        await _show_list_page(callback, kind, letter_page(drivers, letter))
+    except Exception:
+        logger.exception("Ошибка при переходе к букве в списке водителей")
+        await callback.answer("❌ Произошла ошибка при загрузке списка")
+
+@router.callback_query(F.data == "drv_noop")
+async def handle_list_noop(callback: CallbackQuery):
+    await callback.answer()
+
 @router.message(Command("drivers"))
 async def show_drivers_command(message: Message, state: FSMContext):
-    await message.answer("🔄 Загружаю список водителей...")
+    loading = await message.answer("🔄 Загружаю список водителей...")
     try:
-        drivers = await get_driver_list()
-        if not drivers:
-            return await message.answer("❌ Водители не найдены в базе данных")
-        await message.answer(
-            f"👥 Найдено {len(drivers)} водителей.\nВыберите водителя для добавления комментария:",
-            reply_markup=drivers_kb(drivers)
-        )
-        await state.set_state(NotionStates.waiting_for_driver_selection)
-    except Exception as e:
+        if await _render_driver_list(loading, "select"):
+            await state.set_state(NotionStates.waiting_for_driver_selection)
+    except Exception:
         logger.exception("Ошибка при получении списка водителей")
         await message.answer("❌ Произошла ошибка при загрузке списка водителей")
 
 @router.callback_query(F.data.startswith("driver_select:"))
 async def handle_driver_selection(callback: CallbackQuery, state: FSMContext):
-    driver_id = callback.data.split(":", 1)[1]
+    driver_id = resolve_short_id(callback.data.split(":", 1)[1])
+    if not driver_id:
+        return await callback.answer("❌ Кнопка устарела, откройте список заново")
     try:
         info = await get_driver_info(driver_id)
         if not info:
             return await callback.answer("❌ Не удалось получить информацию о водителе")
-        await state.update_data(selected_driver_id=driver_id, selected_driver_name=info.get("name",""))
+        await state.update_data(selected_driver_id=driver_id, selected_driver_name=info.name)
         await callback.message.edit_text(
             driver_brief(info),
             reply_markup=cancel_comment_kb(),
@@ -61,6 +149,22 @@ async def handle_comment_cancel(callback: CallbackQuery, state: FSMContext):
     await state.clear()
     await callback.answer()
 
+async def _deliver_comment(bot, job: dict, result: str, late: bool) -> None:
+    """Ставит в очередь Notion комментарий из задачи, продолженной после перезапуска"""
+    driver_name = job["params"].get("driver_name", "")
+    if not result.strip():
+        await bot.send_message(job["chat_id"], f"❌ Не удалось получить текст комментария для водителя {driver_name}", parse_mode=None)
+        return
+    enqueue_comment(job["params"]["driver_id"], result, chat_id=job["chat_id"], driver_name=driver_name)
+    note = " (обработка была прервана перезапуском бота и завершена позже)" if late else ""
+    await bot.send_message(
+        job["chat_id"],
+        f"✅ Комментарий для водителя {driver_name}{note} принят и будет сохранен в Notion",
+        parse_mode=None
+    )
+
+job_journal.register_delivery("notion_comment", _deliver_comment)
+
 @router.message(StateFilter(NotionStates.waiting_for_comment))
 async def handle_comment_input(message: Message, state: FSMContext):
     data = await state.get_data()
@@ -72,6 +176,7 @@ async def handle_comment_input(message: Message, state: FSMContext):
 
     processing = None
     comment_text = ""
+    job_id = None
 
     try:
         # TEXT
@@ -79,90 +184,171 @@ async def handle_comment_input(message: Message, state: FSMContext):
             comment_text = message.text.strip()
             if not comment_text:
                 return await message.answer("❌ Комментарий не может быть пустым. Попробуйте еще раз:")
-            processing = await message.answer("💾 Сохраняю комментарий в Notion...")
-
-        # VOICE
-        elif message.voice:
-            processing = await message.answer("🎙️ Обрабатываю аудио...")
-            from share.promt_utils import get_promt_call_analyze
-            system_prompt = get_promt_call_analyze()
-            comment_text = await transcribe_file(message.bot, message.voice.file_id, "voice.ogg", system_prompt)
-            await processing.edit_text("💾 Сохраняю комментарий в Notion...")
+            processing = await message.answer("💾 Сохраняю комментарий...")
 
-        # AUDIO/DOCUMENT
-        elif message.audio or message.document:
-            processing = await message.answer("🎙️ Обрабатываю аудиофайл...")
+        # VOICE / AUDIO / DOCUMENT
+        elif message.voice or message.audio or message.document:
+            processing = await message.answer("🎙️ Обрабатываю аудио..." if message.voice else "🎙️ Обрабатываю аудиофайл...")
             from share.promt_utils import get_promt_call_analyze
             system_prompt = get_promt_call_analyze()
-            if message.audio:
-                comment_text = await transcribe_file(message.bot, message.audio.file_id, message.audio.file_name or "audio.mp3", system_prompt)
+            if message.voice:
+                file_id, name = message.voice.file_id, "voice.ogg"
+            elif message.audio:
+                file_id, name = message.audio.file_id, message.audio.file_name or "audio.mp3"
             else:
-                name = message.document.file_name or "audio.mp3"
-                comment_text = await transcribe_file(message.bot, message.document.file_id, name, system_prompt)
-            await processing.edit_text("💾 Сохраняю комментарий в Notion...")
+                file_id, name = message.document.file_id, message.document.file_name or "audio.mp3"
+            # Задача записывается в журнал и будет продолжена, если бот перезапустится
+            job_id = job_journal.create(
+                "notion_comment", message.chat.id, message.from_user.id, file_id, name, system_prompt,
+                driver_id=driver_id, driver_name=driver_name,
+            )
+            try:
+                comment_text = await audio_queue.run(
+                    message.from_user.id,
+                    lambda: run_job(message.bot, job_id),
+                    on_position=queue_notifier(processing)
+                )
+            except QueueFullError:
+                job_journal.fail(job_id, "Очередь переполнена", max_attempts=0)
+                return await processing.edit_text("⏳ Сейчас обрабатывается слишком много файлов. Отправьте запись еще раз через несколько минут:")
+            await processing.edit_text("💾 Сохраняю комментарий...")
 
         else:
             return await message.answer("❌ Отправьте аудиозапись или текстовый комментарий:")
 
         if not comment_text.strip():
+            if job_id is not None:
+                job_journal.fail(job_id, "Пустой текст", max_attempts=0)
             return await processing.edit_text("❌ Не удалось получить текст для комментария. Попробуйте еще раз:")
 
-        # SAVE to Notion
-        ok = await add_comment(driver_id, comment_text)
-        if ok:
-            show = comment_text[:500] + ("..." if len(comment_text) > 500 else "")
-            try:
-                await processing.edit_text(
-                    f"✅ Комментарий успешно добавлен!\n\n"
-                    f"👤 *Водитель:* {escape_md(driver_name)}\n"
-                    f"📝 *Комментарий:*\n{escape_md(show)}",
-                    parse_mode="Markdown"
-                )
-            except Exception:
-                await processing.edit_text(
-                    f"✅ Комментарий успешно добавлен!\n\n"
-                    f"👤 Водитель: {driver_name}\n"
-                    f"📝 Комментарий:\n{show}"
-                )
-        else:
-            await processing.edit_text("❌ Не удалось добавить комментарий. Попробуйте позже.")
+        # SAVE: комментарий попадает в постоянную очередь и отправляется в Notion в фоне,
+        # поэтому результат Whisper+GPT не теряется при ошибке Notion
+        enqueue_comment(driver_id, comment_text, chat_id=message.chat.id, driver_name=driver_name)
+        if job_id is not None:
+            job_journal.advance(job_id, STAGE_DELIVERED)
+        show = comment_text[:500] + ("..." if len(comment_text) > 500 else "")
+        try:
+            await processing.edit_text(
+                f"✅ Комментарий принят и будет сохранен в Notion!\n\n"
+                f"👤 *Водитель:* {escape_md(driver_name)}\n"
+                f"📝 *Комментарий:*\n{escape_md(show)}",
+                parse_mode="Markdown"
+            )
+        except Exception:
+            await processing.edit_text(
+                f"✅ Комментарий принят и будет сохранен в Notion!\n\n"
+                f"👤 Водитель: {driver_name}\n"
+                f"📝 Комментарий:\n{show}"
+            )
 
         await state.clear()
 
     except Exception:
         logger.exception("Ошибка при добавлении комментария")
+        if job_id is not None:
+            job_journal.fail(job_id, "Ошибка при добавлении комментария", max_attempts=0)
         if processing:
             await processing.edit_text("❌ Произошла ошибка при добавлении комментария")
         else:
             await message.answer("❌ Произошла ошибка при добавлении комментария")
         await state.clear()
 
+# --- Анализ из полной обработки звонка (/call_full) ---
+
+def _bundle_analysis(job_id: int) -> str:
+    job = job_journal.get(job_id)
+    if job is None:
+        return ""
+    return job["params"].get("section_results", {}).get("analysis", "")
+
+@router.callback_query(F.data.startswith("bundle_save:"))
+async def handle_bundle_save(callback: CallbackQuery, state: FSMContext):
+    job_id = int(callback.data.split(":", 1)[1])
+    if not _bundle_analysis(job_id).strip():
+        return await callback.answer("❌ Результат обработки устарел, отправьте запись еще раз")
+    try:
+        await state.update_data(bundle_job_id=job_id)
+        if await _render_driver_list(callback.message, "bundle"):
+            await state.set_state(NotionStates.waiting_for_driver_selection)
+        await callback.answer()
+    except Exception:
+        logger.exception("Ошибка при загрузке списка водителей")
+        await callback.answer("❌ Произошла ошибка при загрузке списка")
+
+@router.callback_query(F.data.startswith("bundle_driver:"))
+async def handle_bundle_driver(callback: CallbackQuery, state: FSMContext):
+    driver_id = resolve_short_id(callback.data.split(":", 1)[1])
+    job_id = (await state.get_data()).get("bundle_job_id")
+    if not driver_id or job_id is None:
+        return await callback.answer("❌ Кнопка устарела, откройте список заново")
+    comment_text = _bundle_analysis(job_id)
+    if not comment_text.strip():
+        return await callback.answer("❌ Результат обработки устарел, отправьте запись еще раз")
+    try:
+        info = await get_driver_info(driver_id)
+        if not info:
+            return await callback.answer("❌ Не удалось получить информацию о водителе")
+        # Анализ уже готов - в Notion он уходит через ту же постоянную очередь
+        enqueue_comment(driver_id, comment_text, chat_id=callback.message.chat.id, driver_name=info.name)
+        await callback.message.edit_text(
+            f"✅ Анализ звонка принят и будет сохранен в Notion!\n\n"
+            f"👤 *Водитель:* {escape_md(info.name)}",
+            parse_mode="Markdown"
+        )
+        await state.clear()
+        await callback.answer()
+    except Exception:
+        logger.exception("Ошибка при сохранении анализа в Notion")
+        await callback.answer("❌ Произошла ошибка при сохранении анализа")
+
 @router.message(Command("driver_info"))
 async def show_driver_info_command(message: Message):
-    await message.answer("🔄 Загружаю список водителей...")
+    loading = await message.answer("🔄 Загружаю список водителей...")
     try:
-        drivers = await get_driver_list()
-        if not drivers:
-            return await message.answer("❌ Водители не найдены в базе данных")
-        await message.answer(
-            f"👥 Найдено {len(drivers)} водителей.\nВыберите водителя:",
-            reply_markup=info_list_kb(drivers)
-        )
+        await _render_driver_list(loading, "info")
     except Exception:
         logger.exception("Ошибка при загрузке списка водителей")
         await message.answer("❌ Произошла ошибка при загрузке списка водителей")
 
+@router.message(Command("find"))
+async def find_driver_command(message: Message, command: CommandObject):
+    query = (command.args or "").strip()
+    if not query:
+        return await message.answer("🔎 Использование: /find &lt;имя, номер или текст из заметок&gt;")
+    try:
+        # Поиск идет по локальной копии базы и не обращается к Notion
+        results = find_drivers(query)
+        if not results:
+            if driver_mirror.synced_at is None:
+                return await message.answer("⏳ Локальная база водителей еще синхронизируется, попробуйте чуть позже")
+            return await message.answer("❌ Ничего не найдено")
+        lines = [f"🔎 Найдено: {len(results)}\n"]
+        for r in results:
+            line = f"• <b>{html.escape(r['name'])}</b>"
+            if r["status"]: line += f" — {html.escape(r['status'])}"
+            if r["number"]: line += f" — {html.escape(r['number'])}"
+            if r["snippet"]: line += f"\n  <i>{html.escape(r['snippet'])}</i>"
+            lines.append(line)
+        await message.answer("\n".join(lines), reply_markup=search_results_kb(results))
+    except Exception:
+        logger.exception("Ошибка при поиске водителя")
+        await message.answer("❌ Произошла ошибка при поиске")
+
 @router.callback_query(F.data.startswith("info_show:"))
 async def show_detailed_driver_info(callback: CallbackQuery):
-    driver_id = callback.data.split(":", 1)[1]
+    driver_id = resolve_short_id(callback.data.split(":", 1)[1])
+    if not driver_id:
+        return await callback.answer("❌ Кнопка устарела, откройте список заново")
     try:
         info = await get_driver_info(driver_id)
         if not info:
             return await callback.answer("❌ Не удалось получить информацию о водителе")
-        comments = await get_driver_comments(driver_id)
+        # Для карточки хватает одной страницы комментариев; все комментарии
+        # листаются отдельно и подгружаются по мере пролистывания
+        comments, cursor = await notion_service.fetch_comments_page(driver_id)
         await callback.message.edit_text(
-            driver_full(info, comments),
-            reply_markup=info_nav_kb(),
+            driver_full(info, comments, has_more=cursor is not None),
+            reply_markup=info_nav_kb(driver_id),
             parse_mode="Markdown"
         )
         await callback.answer()
@@ -175,42 +361,49 @@ async def handle_info_cancel(callback: CallbackQuery):
     await callback.message.edit_text("ℹ️ Просмотр информации завершен")
     await callback.answer()
 
+async def _show_comments_screen(callback: CallbackQuery, driver_id: str, page: int, reset: bool = False):
+    info = await get_driver_info(driver_id)
+    if not info:
+        return await callback.answer("❌ Не удалось получить информацию о водителе")
+    
+    # Комментарии подгружаются из Notion по мере пролистывания
+    pager = get_pager(driver_id, notion_service.fetch_comments_page, reset=reset)
+    page, entries, has_next = await pager.screen(page)
+    
+    await callback.message.edit_text(
+        comments_screen(info, entries, page, pager.loaded, pager.exhausted),
+        reply_markup=comments_nav_kb(driver_id, page, has_prev=page > 0, has_next=has_next),
+        parse_mode="Markdown"
+    )
+    await callback.answer()
+
 @router.callback_query(F.data.startswith("show_comments:"))
 async def show_all_comments(callback: CallbackQuery):
-    driver_id = callback.data.split(":", 1)[1]
+    driver_id = resolve_short_id(callback.data.split(":", 1)[1])
+    if not driver_id:
+        return await callback.answer("❌ Кнопка устарела, откройте список заново")
     try:
-        info = await get_driver_info(driver_id)
-        comments = await get_driver_comments(driver_id)
-        if not info:
-            return await callback.answer("❌ Не удалось получить информацию о водителе")
-
-        lines = [f"💬 *Все комментарии к {escape_md(info.get('name',''))}*\n", f"Всего: {len(comments) if comments else 0}\n"]
-        if comments:
-            for i, c in enumerate(comments, 1):
-                created = c.get("created_time","")[:16].replace("T"," ")
-                text = c.get("text","")
-                lines.append(f"*{i}.* [{created or 'Неизвестно'}]\n{escape_md(text)}\n")
-        else:
-            lines.append("Комментарии отсутствуют")
-
-        await callback.message.edit_text(
-            "\n".join(lines),
-            reply_markup=comments_nav_kb(driver_id),
-            parse_mode="Markdown"
-        )
-        await callback.answer()
+        await _show_comments_screen(callback, driver_id, 0, reset=True)
     except Exception:
         logger.exception("Ошибка при показе всех комментариев")
         await callback.answer("❌ Произошла ошибка при загрузке комментариев")
 
+@router.callback_query(F.data.startswith("comments_page:"))
+async def show_comments_page(callback: CallbackQuery):
+    _, token, page = callback.data.split(":", 2)
+    driver_id = resolve_short_id(token)
+    if not driver_id:
+        return await callback.answer("❌ Кнопка устарела, откройте список заново")
+    try:
+        await _show_comments_screen(callback, driver_id, int(page))
+    except Exception:
+        logger.exception("Ошибка при переходе по страницам комментариев")
+        await callback.answer("❌ Произошла ошибка при загрузке комментариев")
+
 @router.callback_query(F.data == "back_to_drivers")
 async def back_to_drivers_list(callback: CallbackQuery):
     try:
-        drivers = await get_driver_list()
-        await callback.message.edit_text(
-            f"👥 Найдено {len(drivers)} водителей.\nВыберите водителя:",
-            reply_markup=info_list_kb(drivers)
-        )
+        await _render_driver_list(callback.message, "info")
         await callback.answer()
     except Exception:
         logger.exception("Ошибка при возврате к списку")
@@ -1,39 +1,122 @@
+from collections import OrderedDict
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 
-def drivers_kb(drivers: list[dict]) -> InlineKeyboardMarkup:
+from share.config import DRIVERS_PER_PAGE
+from .schema import DriverRecord
+from .short_ids import short_id
+
+# Списки водителей: callback выбора и отмены для каждого вида списка
+LIST_KINDS = {
+    "select": ("driver_select", "driver_cancel"),
+    "info": ("info_show", "info_cancel"),
+    "bundle": ("bundle_driver", "driver_cancel"),
+}
+
+# Готовые клавиатуры страниц: (вид, версия списка, страница) -> клавиатура
+_page_cache: "OrderedDict[tuple, InlineKeyboardMarkup]" = OrderedDict()
+_PAGE_CACHE_MAX = 256
+
+def _letter(name: str) -> str:
+    first = name[:1].upper()
+    return first if first.isalpha() else "#"
+
+def pages_count(drivers: list[DriverRecord]) -> int:
+    return max(1, -(-len(drivers) // DRIVERS_PER_PAGE))
+
+def letter_page(drivers: list[DriverRecord], letter: str) -> int:
+    """Номер страницы, на которой начинаются водители на букву letter"""
+    for i, d in enumerate(drivers):
+        if _letter(d.name) == letter:
+            return i // DRIVERS_PER_PAGE
+    return 0
+
+def _build_list_kb(kind: str, drivers: list[DriverRecord], page: int) -> InlineKeyboardMarkup:
+    select_cb, cancel_cb = LIST_KINDS[kind]
+    total = pages_count(drivers)
+    page = max(0, min(page, total - 1))
+    chunk = drivers[page * DRIVERS_PER_PAGE:(page + 1) * DRIVERS_PER_PAGE]
     rows = [
         [InlineKeyboardButton(
-            text=(d["name"][:30] + "..." if len(d["name"]) > 30 else d["name"]),
-            callback_data=f"driver_select:{d['id']}"
+            text=(d.name[:30] + "..." if len(d.name) > 30 else d.name),
+            callback_data=f"{select_cb}:{short_id(d.id)}"
         )]
-        for d in drivers
+        for d in chunk
     ]
-    rows.append([InlineKeyboardButton(text="❌ Отмена", callback_data="driver_cancel")])
+    if total > 1:
+        nav = []
+        if page > 0:
+            nav.append(InlineKeyboardButton(text="⬅️", callback_data=f"drv_page:{kind}:{page - 1}"))
+        nav.append(InlineKeyboardButton(text=f"{page + 1}/{total}", callback_data="drv_noop"))
+        if page < total - 1:
+            nav.append(InlineKeyboardButton(text="➡️", callback_data=f"drv_page:{kind}:{page + 1}"))
+        rows.append(nav)
+        # Переход к букве алфавита: только буквы, с которых начинаются имена
+        letters = list(dict.fromkeys(_letter(d.name) for d in drivers))
+        for i in range(0, len(letters), 8):
+            rows.append([
+                InlineKeyboardButton(text=letter, callback_data=f"drv_jump:{kind}:{letter}")
+                for letter in letters[i:i + 8]
+            ])
+    rows.append([InlineKeyboardButton(text="❌ Отмена", callback_data=cancel_cb)])
     return InlineKeyboardMarkup(inline_keyboard=rows)
 
+def driver_list_kb(kind: str, drivers: list[DriverRecord], page: int = 0, version: int | None = None) -> InlineKeyboardMarkup:
+    """
+    Клавиатура одной страницы списка водителей
+
+    При переданной версии списка готовая клавиатура запоминается, и повторный
+    переход на ту же страницу не пересобирает ее.
+    """
+    if version is None:
+        return _build_list_kb(kind, drivers, page)
+    key = (kind, version, page)
+    markup = _page_cache.get(key)
+    if markup is None:
+        markup = _build_list_kb(kind, drivers, page)
+        _page_cache[key] = markup
+        while len(_page_cache) > _PAGE_CACHE_MAX:
+            _page_cache.popitem(last=False)
+    else:
+        _page_cache.move_to_end(key)
+    return markup
+
+def drivers_kb(drivers: list[DriverRecord], page: int = 0, version: int | None = None) -> InlineKeyboardMarkup:
+    return driver_list_kb("select", drivers, page, version)
+
 def cancel_comment_kb() -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(text="❌ Отмена", callback_data="comment_cancel")]
     ])
 
-def info_list_kb(drivers: list[dict]) -> InlineKeyboardMarkup:
-    rows = [
-        [InlineKeyboardButton(
-            text=(d["name"][:30] + "..." if len(d["name"]) > 30 else d["name"]),
-            callback_data=f"info_show:{d['id']}"
-        )] for d in drivers
-    ]
-    rows.append([InlineKeyboardButton(text="❌ Отмена", callback_data="info_cancel")])
-    return InlineKeyboardMarkup(inline_keyboard=rows)
+def info_list_kb(drivers: list[DriverRecord], page: int = 0, version: int | None = None) -> InlineKeyboardMarkup:
+    return driver_list_kb("info", drivers, page, version)
 
-def info_nav_kb() -> InlineKeyboardMarkup:
+def info_nav_kb(driver_id: str) -> InlineKeyboardMarkup:
+    token = short_id(driver_id)
     return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="💬 Все комментарии", callback_data=f"show_comments:{token}")],
         [InlineKeyboardButton(text="🔙 Назад к списку", callback_data="back_to_drivers")],
         [InlineKeyboardButton(text="❌ Закрыть", callback_data="info_cancel")]
     ])
 
-def comments_nav_kb(driver_id: str) -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="🔙 К информации о водителе", callback_data=f"info_show:{driver_id}")],
+def comments_nav_kb(driver_id: str, page: int = 0, has_prev: bool = False, has_next: bool = False) -> InlineKeyboardMarkup:
+    token = short_id(driver_id)
+    nav = []
+    if has_prev:
+        nav.append(InlineKeyboardButton(text="⬅️ Назад", callback_data=f"comments_page:{token}:{page - 1}"))
+    if has_next:
+        nav.append(InlineKeyboardButton(text="Далее ➡️", callback_data=f"comments_page:{token}:{page + 1}"))
+    return InlineKeyboardMarkup(inline_keyboard=([nav] if nav else []) + [
+        [InlineKeyboardButton(text="🔙 К информации о водителе", callback_data=f"info_show:{token}")],
         [InlineKeyboardButton(text="❌ Закрыть", callback_data="info_cancel")]
     ])
+
+def search_results_kb(results: list[dict]) -> InlineKeyboardMarkup:
+    rows = [
+        [InlineKeyboardButton(
+            text=(r["name"][:30] + "..." if len(r["name"]) > 30 else r["name"]),
+            callback_data=f"info_show:{short_id(r['id'])}"
+        )] for r in results
+    ]
+    rows.append([InlineKeyboardButton(text="❌ Закрыть", callback_data="info_cancel")])
+    return InlineKeyboardMarkup(inline_keyboard=rows)
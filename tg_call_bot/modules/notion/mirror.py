@@ -0,0 +1,279 @@
+import asyncio
+import logging
+import os
+import re
+import sqlite3
+import time
+from typing import Dict, List, Optional, Set
+
+from share.config import NOTION_MIRROR_SYNC, NOTION_ROSTER_FULL_SYNC
+from .client import notion_service
+from .scheduler import PRIORITY_BACKGROUND
+from .schema import DriverRecord
+
+# Настройка логирования
+logger = logging.getLogger(__name__)
+
+_FIELDS = ("name", "status", "about_driver", "number", "date", "notes", "trailer", "last_edited_time")
+
+
+class DriverMirror:
+    """
+    Локальная копия базы водителей Notion в SQLite с полнотекстовым поиском
+
+    Копия обновляется в фоне по last_edited_time: запрашиваются только
+    измененные записи, их комментарии перечитываются. Раз в full_sync_interval
+    секунд база перечитывается целиком, чтобы убрать удаленные записи.
+    Поиск идет по FTS5-индексу (имя, номер, заметки, описание, комментарии)
+    и не обращается к Notion.
+    """
+
+    def __init__(self, service, db_path: str = None, sync_interval: int = 300, full_sync_interval: int = 1800):
+        """
+        Args:
+            service: NotionService для загрузки записей
+            db_path: Путь к файлу SQLite (по умолчанию data/notion_mirror.db)
+            sync_interval: Интервал дельта-синхронизации в секундах
+            full_sync_interval: Интервал полной синхронизации в секундах
+        """
+        if db_path is None:
+            current_dir = os.path.dirname(os.path.abspath(__file__))
+            data_dir = os.path.join(os.path.dirname(os.path.dirname(current_dir)), 'data')
+            db_path = os.path.join(data_dir, 'notion_mirror.db')
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+
+        self.service = service
+        self.db_path = db_path
+        self.sync_interval = sync_interval
+        self.full_sync_interval = full_sync_interval
+
+        self._db = sqlite3.connect(db_path)
+        self._db.row_factory = sqlite3.Row
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS drivers (
+                rowid INTEGER PRIMARY KEY,
+                id TEXT UNIQUE NOT NULL,
+                name TEXT NOT NULL DEFAULT '',
+                status TEXT NOT NULL DEFAULT '',
+                about_driver TEXT NOT NULL DEFAULT '',
+                number TEXT NOT NULL DEFAULT '',
+                date TEXT NOT NULL DEFAULT '',
+                notes TEXT NOT NULL DEFAULT '',
+                trailer INTEGER NOT NULL DEFAULT 0,
+                last_edited_time TEXT NOT NULL DEFAULT '',
+                comments TEXT NOT NULL DEFAULT ''
+            );
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            );
+        """)
+        self.fts = self._create_fts()
+        self._db.commit()
+
+        self._dirty_comments: Set[str] = set()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._full_synced_at = 0.0
+        self.synced_at: Optional[float] = None
+
+    def _create_fts(self) -> bool:
+        """Создает FTS5-индекс с триггерами; без FTS5 поиск работает через LIKE"""
+        try:
+            self._db.executescript("""
+                CREATE VIRTUAL TABLE IF NOT EXISTS drivers_fts USING fts5(
+                    name, number, notes, about_driver, comments,
+                    content='drivers', content_rowid='rowid',
+                    tokenize='unicode61 remove_diacritics 2'
+                );
+                CREATE TRIGGER IF NOT EXISTS drivers_ai AFTER INSERT ON drivers BEGIN
+                    INSERT INTO drivers_fts(rowid, name, number, notes, about_driver, comments)
+                    VALUES (new.rowid, new.name, new.number, new.notes, new.about_driver, new.comments);
+                END;
+                CREATE TRIGGER IF NOT EXISTS drivers_ad AFTER DELETE ON drivers BEGIN
+                    INSERT INTO drivers_fts(drivers_fts, rowid, name, number, notes, about_driver, comments)
+                    VALUES ('delete', old.rowid, old.name, old.number, old.notes, old.about_driver, old.comments);
+                END;
+                CREATE TRIGGER IF NOT EXISTS drivers_au AFTER UPDATE ON drivers BEGIN
+                    INSERT INTO drivers_fts(drivers_fts, rowid, name, number, notes, about_driver, comments)
+                    VALUES ('delete', old.rowid, old.name, old.number, old.notes, old.about_driver, old.comments);
+                    INSERT INTO drivers_fts(rowid, name, number, notes, about_driver, comments)
+                    VALUES (new.rowid, new.name, new.number, new.notes, new.about_driver, new.comments);
+                END;
+            """)
+            return True
+        except sqlite3.OperationalError as e:
+            logger.warning(f"FTS5 недоступен, поиск будет работать через LIKE: {e}")
+            return False
+
+    # --- Хранение ---
+
+    def _get_meta(self, key: str) -> Optional[str]:
+        row = self._db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _set_meta(self, key: str, value: str) -> None:
+        self._db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    def _upsert(self, record: DriverRecord) -> None:
+        values = [getattr(record, field) for field in _FIELDS]
+        self._db.execute(f"""
+            INSERT INTO drivers (id, {", ".join(_FIELDS)}) VALUES (?, {", ".join("?" for _ in _FIELDS)})
+            ON CONFLICT(id) DO UPDATE SET {", ".join(f"{field} = excluded.{field}" for field in _FIELDS)}
+        """, [record.id, *values])
+
+    def _apply(self, records: List[DriverRecord]) -> List[str]:
+        """Сохраняет записи, удаляет архивные. Возвращает ID сохраненных записей"""
+        saved = []
+        for record in records:
+            if record.archived:
+                self._db.execute("DELETE FROM drivers WHERE id = ?", (record.id,))
+                continue
+            self._upsert(record)
+            saved.append(record.id)
+        return saved
+
+    # --- Синхронизация ---
+
+    async def _refresh_comments(self, page_id: str) -> None:
+        texts = []
+        async for batch in self.service.iter_page_comments(page_id, priority=PRIORITY_BACKGROUND):
+            texts.extend(c["text"] for c in batch if c.get("text"))
+        self._db.execute("UPDATE drivers SET comments = ? WHERE id = ?", ("\n".join(texts), page_id))
+
+    async def sync(self) -> int:
+        """
+        Синхронизирует копию с Notion: дельта по last_edited_time или полная по расписанию
+
+        Returns:
+            int: Количество обновленных записей
+        """
+        cursor = self._get_meta("edited_cursor")
+        full = cursor is None or time.monotonic() - self._full_synced_at >= self.full_sync_interval
+
+        changed: List[str] = []
+        seen: Set[str] = set()
+        max_edited = cursor or ""
+        async for batch in self.service.iter_names_and_ids(edited_since=None if full else cursor):
+            for record in batch:
+                seen.add(record.id)
+                max_edited = max(max_edited, record.last_edited_time)
+            existing = {
+                row["id"]: row["last_edited_time"]
+                for row in self._db.execute(
+                    f"SELECT id, last_edited_time FROM drivers WHERE id IN ({','.join('?' for _ in batch)})",
+                    [record.id for record in batch]
+                )
+            }
+            # При полной синхронизации неизмененные записи не перезаписываем
+            fresh = [record for record in batch if existing.get(record.id) != record.last_edited_time]
+            changed.extend(self._apply(fresh))
+            self._db.commit()
+
+        if full:
+            stale = [row[0] for row in self._db.execute("SELECT id FROM drivers") if row[0] not in seen]
+            self._db.executemany("DELETE FROM drivers WHERE id = ?", [(page_id,) for page_id in stale])
+            self._full_synced_at = time.monotonic()
+
+        # Комментарии не меняют last_edited_time страницы, поэтому перечитываем их
+        # для измененных записей и для страниц, куда бот сам писал комментарии
+        pending = set(changed) | self._dirty_comments
+        self._dirty_comments.clear()
+        for page_id in pending:
+            await self._refresh_comments(page_id)
+
+        if max_edited:
+            self._set_meta("edited_cursor", max_edited)
+        self._db.commit()
+        self.synced_at = time.time()
+        logger.info(f"Локальная копия Notion синхронизирована ({'полная' if full else 'дельта'}): {len(changed)} записей")
+        return len(changed)
+
+    def mark_comments_dirty(self, page_id: str) -> None:
+        """Помечает, что комментарии страницы изменились и их нужно перечитать"""
+        self._dirty_comments.add(page_id)
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def start(self) -> None:
+        """Запускает фоновую синхронизацию (вызывается при старте бота)"""
+        self._wakeup = asyncio.Event()
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._sync_loop())
+
+    async def _sync_loop(self) -> None:
+        while True:
+            try:
+                await self.sync()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Ошибка синхронизации локальной копии Notion")
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.sync_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    # --- Поиск ---
+
+    @staticmethod
+    def _fts_query(text: str) -> str:
+        # Каждое слово ищем по префиксу; кавычки защищают от синтаксиса FTS5
+        tokens = re.findall(r"\w+", text.lower())
+        return " ".join(f'"{token}"*' for token in tokens)
+
+    def search(self, text: str, limit: int = 10) -> List[Dict]:
+        """
+        Ищет водителей по имени, номеру, заметкам, описанию и комментариям
+
+        Returns:
+            List[Dict]: Найденные записи с ключами 'id', 'name', 'status', 'number', 'snippet'
+        """
+        query = self._fts_query(text)
+        if not query:
+            return []
+        if self.fts:
+            rows = self._db.execute("""
+                SELECT d.id, d.name, d.status, d.number,
+                       snippet(drivers_fts, -1, '', '', '…', 8) AS snippet
+                FROM drivers_fts JOIN drivers d ON d.rowid = drivers_fts.rowid
+                WHERE drivers_fts MATCH ?
+                ORDER BY bm25(drivers_fts, 10.0, 5.0, 1.0, 1.0, 0.5)
+                LIMIT ?
+            """, (query, limit)).fetchall()
+        else:
+            like = f"%{text.strip()}%"
+            rows = self._db.execute("""
+                SELECT id, name, status, number, '' AS snippet FROM drivers
+                WHERE name LIKE ? OR number LIKE ? OR notes LIKE ? OR about_driver LIKE ? OR comments LIKE ?
+                ORDER BY name LIMIT ?
+            """, (like, like, like, like, like, limit)).fetchall()
+        return [dict(row) for row in rows]
+
+    def stats(self) -> Dict:
+        """Возвращает состояние копии для админ панели"""
+        count = self._db.execute("SELECT COUNT(*) FROM drivers").fetchone()[0]
+        return {
+            "rows": count,
+            "fts": self.fts,
+            "age": int(time.time() - self.synced_at) if self.synced_at else None,
+        }
+
+
+# Создаем глобальный экземпляр локальной копии
+driver_mirror = DriverMirror(notion_service, sync_interval=NOTION_MIRROR_SYNC, full_sync_interval=NOTION_ROSTER_FULL_SYNC)
+
+
+def find_drivers(text: str, limit: int = 10) -> List[Dict]:
+    """
+    Ищет водителей в локальной копии базы без обращения к Notion
+
+    Args:
+        text (str): Строка поиска (имя, номер, слова из заметок или комментариев)
+        limit (int): Максимум результатов
+
+    Returns:
+        List[Dict]: Найденные водители
+    """
+    return driver_mirror.search(text, limit)
@@ -0,0 +1,270 @@
+import asyncio
+import logging
+import os
+import sqlite3
+import time
+from typing import Dict, List, Optional
+
+from notion_client import APIResponseError
+
+from share.config import NOTION_OUTBOX_MAX_ATTEMPTS
+from .client import notion_service
+from .mirror import driver_mirror
+from .richtext import split_comment
+
+# Настройка логирования
+logger = logging.getLogger(__name__)
+
+# Статусы записей очереди
+STATUS_PENDING = "pending"
+STATUS_FAILED = "failed"
+
+
+class CommentOutbox:
+    """
+    Постоянная очередь (outbox) комментариев для записи в Notion
+
+    Комментарий сначала сохраняется в SQLite, пользователь сразу получает
+    подтверждение, а фоновая задача отправляет записи в Notion с повторами.
+    Записи одной страницы отправляются строго по порядку, разные страницы -
+    параллельно. Очередь переживает перезапуск бота: недоставленные записи
+    подхватываются при следующем старте.
+
+    Запись, которую Notion отверг окончательно (ошибка 4xx кроме 409 и 429)
+    или которая не ушла за max_attempts попыток, переводится в статус failed:
+    она остается в базе для разбора, но больше не повторяется и не держит
+    следующие записи своей страницы.
+    """
+
+    def __init__(self, service, db_path: str = None, max_backoff: float = 600.0, mirror=None,
+                 max_attempts: int = 10):
+        """
+        Args:
+            service: NotionService для записи комментариев
+            db_path: Путь к файлу SQLite (по умолчанию data/notion_outbox.db)
+            max_backoff: Максимальная пауза между повторами в секундах
+            mirror: Локальная копия базы, которой сообщается о новых комментариях
+            max_attempts: Максимум попыток отправки одной записи
+        """
+        if db_path is None:
+            current_dir = os.path.dirname(os.path.abspath(__file__))
+            data_dir = os.path.join(os.path.dirname(os.path.dirname(current_dir)), 'data')
+            db_path = os.path.join(data_dir, 'notion_outbox.db')
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+
+        self.service = service
+        self.db_path = db_path
+        self.max_backoff = max_backoff
+        self.mirror = mirror
+        self.max_attempts = max(1, max_attempts)
+        self.bot = None
+        self.delivered = 0
+        self._started_at = time.time()
+
+        self._db = sqlite3.connect(db_path)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                page_id TEXT NOT NULL,
+                comment TEXT NOT NULL,
+                chat_id INTEGER,
+                driver_name TEXT,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt_at REAL NOT NULL DEFAULT 0,
+                last_error TEXT,
+                created_at REAL NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending'
+            )
+        """)
+        # Базы, созданные до появления статусов, дополняем колонкой
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(outbox)")}
+        if "status" not in columns:
+            self._db.execute("ALTER TABLE outbox ADD COLUMN status TEXT NOT NULL DEFAULT 'pending'")
+        self._db.commit()
+
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self, bot=None) -> None:
+        """Запускает фоновую отправку очереди (вызывается при старте бота)"""
+        self.bot = bot
+        self._started_at = time.time()
+        self._wakeup = asyncio.Event()
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._drain_loop())
+        pending = self.stats()["depth"]
+        if pending:
+            logger.info(f"В очереди комментариев Notion {pending} неотправленных записей")
+
+    def enqueue(self, page_id: str, comment: str, chat_id: int = None, driver_name: str = "") -> int:
+        """
+        Сохраняет комментарий в очередь на отправку
+
+        Комментарий, не помещающийся в один комментарий Notion, сохраняется
+        несколькими записями, чтобы повтор не дублировал уже отправленные части.
+
+        Returns:
+            int: ID первой записи в очереди
+        """
+        now = time.time()
+        self._db.executemany(
+            "INSERT INTO outbox (page_id, comment, chat_id, driver_name, created_at) VALUES (?, ?, ?, ?, ?)",
+            [(page_id, part, chat_id, driver_name, now) for part in split_comment(comment)]
+        )
+        self._db.commit()
+        first_id = self._db.execute(
+            "SELECT MIN(id) FROM outbox WHERE page_id = ? AND created_at = ?", (page_id, now)
+        ).fetchone()[0]
+        if self._wakeup is not None:
+            self._wakeup.set()
+        logger.info(f"Комментарий для страницы {page_id} поставлен в очередь (запись {first_id})")
+        return first_id
+
+    def _due_heads(self) -> List[sqlite3.Row]:
+        """Первые по порядку записи каждой страницы, время повтора которых наступило"""
+        return self._db.execute("""
+            SELECT o.* FROM outbox o
+            JOIN (SELECT MIN(id) AS id FROM outbox WHERE status = ? GROUP BY page_id) h ON h.id = o.id
+            WHERE o.next_attempt_at <= ?
+            ORDER BY o.id
+        """, (STATUS_PENDING, time.time())).fetchall()
+
+    def _next_due_in(self) -> Optional[float]:
+        row = self._db.execute(
+            "SELECT MIN(next_attempt_at) FROM outbox WHERE status = ?", (STATUS_PENDING,)
+        ).fetchone()
+        if row[0] is None:
+            return None
+        return max(0.0, row[0] - time.time())
+
+    @staticmethod
+    def _is_permanent(error: Exception) -> bool:
+        """Ошибка, которую повтор не исправит: 4xx кроме конфликта (409) и лимита (429)"""
+        if isinstance(error, APIResponseError):
+            return 400 <= error.status < 500 and error.status not in (409, 429)
+        return False
+
+    async def _deliver(self, row: sqlite3.Row) -> None:
+        permanent = False
+        try:
+            await self.service.create_comment(row["page_id"], row["comment"])
+            ok, error = True, None
+        except Exception as e:
+            ok, error = False, str(e)
+            permanent = self._is_permanent(e)
+
+        if ok:
+            self._db.execute("DELETE FROM outbox WHERE id = ?", (row["id"],))
+            self._db.commit()
+            self.delivered += 1
+            if self.mirror is not None:
+                self.mirror.mark_comments_dirty(row["page_id"])
+            if row["attempts"] > 0 or row["created_at"] < self._started_at:
+                await self._notify_late(row)
+            return
+
+        attempts = row["attempts"] + 1
+        if permanent or attempts >= self.max_attempts:
+            self._db.execute(
+                "UPDATE outbox SET attempts = ?, last_error = ?, status = ? WHERE id = ?",
+                (attempts, error, STATUS_FAILED, row["id"])
+            )
+            self._db.commit()
+            reason = "Notion отклонил запись" if permanent else f"исчерпан лимит попыток: {attempts}"
+            logger.error(f"Запись {row['id']} для страницы {row['page_id']} не отправлена ({reason}): {error}")
+            await self._notify_failed(row)
+            return
+
+        delay = min(self.max_backoff, 5 * (2 ** (attempts - 1)))
+        self._db.execute(
+            "UPDATE outbox SET attempts = ?, next_attempt_at = ?, last_error = ? WHERE id = ?",
+            (attempts, time.time() + delay, error, row["id"])
+        )
+        self._db.commit()
+        logger.warning(f"Не удалось отправить запись {row['id']} в Notion (попытка {attempts}), повтор через {delay} сек: {error}")
+
+    async def _notify_late(self, row: sqlite3.Row) -> None:
+        """Сообщает пользователю, что комментарий сохранен после повторов или перезапуска"""
+        if not self.bot or not row["chat_id"]:
+            return
+        try:
+            await self.bot.send_message(
+                row["chat_id"],
+                f"✅ Комментарий для водителя {row['driver_name'] or ''} сохранен в Notion",
+                parse_mode=None
+            )
+        except Exception as e:
+            logger.warning(f"Не удалось уведомить чат {row['chat_id']}: {e}")
+
+    async def _notify_failed(self, row: sqlite3.Row) -> None:
+        """Сообщает пользователю, что комментарий не удалось сохранить в Notion"""
+        if not self.bot or not row["chat_id"]:
+            return
+        try:
+            await self.bot.send_message(
+                row["chat_id"],
+                f"❌ Не удалось сохранить комментарий для водителя {row['driver_name'] or ''} в Notion",
+                parse_mode=None
+            )
+        except Exception as e:
+            logger.warning(f"Не удалось уведомить чат {row['chat_id']}: {e}")
+
+    async def _drain_loop(self) -> None:
+        """Фоновая отправка: по одной записи на страницу за проход, страницы параллельно"""
+        while True:
+            try:
+                heads = self._due_heads()
+                if heads:
+                    await asyncio.gather(*(self._deliver(row) for row in heads))
+                    continue
+
+                self._wakeup.clear()
+                timeout = self._next_due_in()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+                except asyncio.TimeoutError:
+                    pass
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Ошибка в фоновой отправке очереди комментариев")
+                await asyncio.sleep(5)
+
+    def stats(self) -> Dict:
+        """Возвращает глубину и возраст очереди для админ панели"""
+        row = self._db.execute(
+            "SELECT COUNT(*), MIN(created_at), SUM(attempts > 0) FROM outbox WHERE status = ?",
+            (STATUS_PENDING,)
+        ).fetchone()
+        depth, oldest, failing = row[0], row[1], row[2] or 0
+        failed = self._db.execute(
+            "SELECT COUNT(*) FROM outbox WHERE status = ?", (STATUS_FAILED,)
+        ).fetchone()[0]
+        return {
+            "depth": depth,
+            "oldest_age": int(time.time() - oldest) if oldest else None,
+            "failing": failing,
+            "failed": failed,
+            "delivered": self.delivered,
+        }
+
+
+# Создаем глобальный экземпляр очереди
+comment_outbox = CommentOutbox(notion_service, mirror=driver_mirror, max_attempts=NOTION_OUTBOX_MAX_ATTEMPTS)
+
+
+def enqueue_comment(page_id: str, comment: str, chat_id: int = None, driver_name: str = "") -> int:
+    """
+    Ставит комментарий к записи водителя в очередь на отправку в Notion
+
+    Args:
+        page_id (str): ID записи водителя
+        comment (str): Текст комментария
+        chat_id (int): Чат для уведомления о запоздалой доставке
+        driver_name (str): Имя водителя для уведомления
+
+    Returns:
+        int: ID записи в очереди
+    """
+    return comment_outbox.enqueue(page_id, comment, chat_id, driver_name)
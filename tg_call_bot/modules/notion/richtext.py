@@ -0,0 +1,102 @@
+from typing import Dict, List
+
+# Ограничения Notion API
+TEXT_LIMIT = 2000          # символов в одном text-объекте rich_text (в единицах UTF-16)
+RICH_TEXT_ITEMS_LIMIT = 100  # text-объектов в одном массиве rich_text
+
+# Куски одного комментария склеиваются без потерь, поэтому важны только границы слов
+_WORD_SEPARATORS = ("\n", " ")
+
+
+def _utf16_len(text: str) -> int:
+    # Notion считает длину в единицах UTF-16: эмодзи занимают две
+    return len(text.encode("utf-16-le")) // 2
+
+
+def _window(text: str, limit: int) -> str:
+    """Самый длинный префикс text, который помещается в limit единиц UTF-16"""
+    window = text[:limit]
+    while _utf16_len(window) > limit:
+        window = window[:-max(1, (_utf16_len(window) - limit) // 2)]
+    return window
+
+
+def _find_cut(text: str, limit: int, separators=_WORD_SEPARATORS) -> int:
+    """Позиция разреза не дальше limit, по возможности на границе строки или слова"""
+    window = _window(text, limit)
+    if len(window) == len(text):
+        return len(text)
+    for sep in separators:
+        idx = window.rfind(sep)
+        # Не режем слишком рано на крупных разделителях, чтобы не плодить мелкие куски
+        if idx > 0 and (sep == separators[-1] or idx >= len(window) // 4):
+            return idx + len(sep)
+    return len(window)
+
+
+def split_text(text: str, limit: int = TEXT_LIMIT) -> List[str]:
+    """
+    Делит текст на куски не длиннее limit, не разрывая слова
+
+    Куски склеиваются обратно в исходный текст без потерь, поэтому
+    подходят для text-объектов одного массива rich_text.
+    """
+    chunks = []
+    while text:
+        cut = _find_cut(text, limit)
+        chunks.append(text[:cut])
+        text = text[cut:]
+    return chunks
+
+
+def _close_fences(chunk_groups: List[List[str]]) -> List[str]:
+    """
+    Склеивает группы кусков в части, не ломая блоки кода
+
+    Блок кода, попавший на границу, закрывается в одной части и открывается
+    в следующей.
+    """
+    parts = []
+    reopen_fence = False
+    for group in chunk_groups:
+        part = "".join(group)
+        if reopen_fence:
+            part = "```\n" + part
+        reopen_fence = part.count("```") % 2 == 1
+        if reopen_fence:
+            part = part.rstrip("\n") + "\n```"
+        parts.append(part)
+    return parts
+
+
+def split_comment(content: str) -> List[str]:
+    """
+    Делит текст на части, каждая из которых помещается в один комментарий Notion
+
+    Части набираются по числу кусков split_text - тех самых text-объектов,
+    которые потом соберет to_rich_text, поэтому в каждой части их не больше
+    RICH_TEXT_ITEMS_LIMIT. Если частей несколько, они нумеруются.
+    """
+    chunks = split_text(content)
+    if len(chunks) <= RICH_TEXT_ITEMS_LIMIT:
+        return [content]
+    # Запас в два объекта: номер части и закрытие блока кода могут
+    # сдвинуть разрезы и добавить по куску
+    per_part = RICH_TEXT_ITEMS_LIMIT - 2
+    while True:
+        groups = [chunks[i:i + per_part] for i in range(0, len(chunks), per_part)]
+        total = len(groups)
+        parts = [f"({i}/{total}) {part}" for i, part in enumerate(_close_fences(groups), 1)]
+        if per_part == 1 or all(len(split_text(part)) <= RICH_TEXT_ITEMS_LIMIT for part in parts):
+            return parts
+        per_part -= 1
+
+
+def to_rich_text(content: str) -> List[Dict]:
+    """
+    Собирает массив rich_text из текста с учетом лимита символов на text-объект
+
+    Returns:
+        List[Dict]: text-объекты; для частей из split_comment их не больше RICH_TEXT_ITEMS_LIMIT
+    """
+    return [{"text": {"content": chunk}} for chunk in split_text(content)]
@@ -0,0 +1,155 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import random
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from notion_client import APIResponseError
+
+# Настройка логирования
+logger = logging.getLogger(__name__)
+
+# Приоритеты запросов: чем меньше число, тем раньше запрос получит слот
+PRIORITY_INTERACTIVE = 0  # пользователь ждет ответ (карточка водителя, комментарии)
+PRIORITY_BACKGROUND = 1   # фоновая работа (обновление списка, запись комментариев)
+
+
+class NotionScheduler:
+    """
+    Планировщик запросов к Notion с учетом лимита API
+
+    Token bucket ограничивает частоту запросов (у интеграции Notion ~3 запроса
+    в секунду). Слоты выдаются по приоритету, поэтому интерактивные чтения
+    обгоняют фоновые задачи. Ответ 429 приостанавливает выдачу слотов на время
+    из Retry-After (с джиттером), после чего запрос повторяется.
+    """
+
+    def __init__(self, rate: float = 3.0, burst: int = 3, max_retries: int = 5, base_backoff: float = 1.0):
+        """
+        Args:
+            rate: Запросов в секунду
+            burst: Максимальное количество накопленных токенов
+            max_retries: Максимум повторов после ответа 429
+            base_backoff: Базовая задержка, если Retry-After не передан
+        """
+        self.rate = rate
+        self.burst = burst
+        self.max_retries = max_retries
+        self.base_backoff = base_backoff
+
+        self._tokens = float(burst)
+        self._refilled_at = time.monotonic()
+        self._paused_until = 0.0
+        self._queue: List[Tuple[int, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._dispatcher: Optional[asyncio.Task] = None
+
+        # Метрики
+        self._waits: deque = deque(maxlen=500)
+        self.requests = 0
+        self.rate_limited = 0
+
+    def _ensure_dispatcher(self) -> None:
+        if self._wakeup is None:
+            self._wakeup = asyncio.Event()
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.create_task(self._dispatch_loop())
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._refilled_at) * self.rate)
+        self._refilled_at = now
+
+    async def _dispatch_loop(self) -> None:
+        """Выдает слоты ожидающим запросам по приоритету, не превышая лимит"""
+        while True:
+            if not self._queue:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            pause = self._paused_until - time.monotonic()
+            if pause > 0:
+                await asyncio.sleep(pause)
+                continue
+
+            self._refill()
+            if self._tokens < 1:
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+                continue
+
+            _, _, waiter = heapq.heappop(self._queue)
+            if waiter.done():
+                # Вызывающий уже отменил ожидание
+                continue
+            self._tokens -= 1
+            waiter.set_result(None)
+
+    async def _acquire(self, priority: int) -> None:
+        self._ensure_dispatcher()
+        waiter = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._queue, (priority, next(self._seq), waiter))
+        self._wakeup.set()
+        enqueued_at = time.monotonic()
+        await waiter
+        self._waits.append(time.monotonic() - enqueued_at)
+
+    def _retry_delay(self, error: APIResponseError, attempt: int) -> float:
+        """Задержка перед повтором: Retry-After или экспоненциальная, с джиттером"""
+        retry_after = None
+        headers = getattr(error, "headers", None)
+        if headers is not None:
+            try:
+                retry_after = float(headers.get("retry-after"))
+            except (TypeError, ValueError):
+                retry_after = None
+        if retry_after is not None:
+            return retry_after + random.uniform(0, min(1.0, retry_after * 0.25))
+        return self.base_backoff * (2 ** attempt) * random.uniform(0.5, 1.5)
+
+    async def run(self, factory: Callable[[], Awaitable[Any]], priority: int = PRIORITY_BACKGROUND) -> Any:
+        """
+        Выполняет запрос factory() в выданном слоте, повторяя его после 429
+
+        Args:
+            factory: Функция, создающая корутину запроса к Notion
+            priority: PRIORITY_INTERACTIVE или PRIORITY_BACKGROUND
+
+        Returns:
+            Any: Ответ Notion
+        """
+        for attempt in range(self.max_retries + 1):
+            await self._acquire(priority)
+            self.requests += 1
+            try:
+                return await factory()
+            except APIResponseError as e:
+                if getattr(e, "status", None) != 429 or attempt >= self.max_retries:
+                    raise
+                self.rate_limited += 1
+                delay = self._retry_delay(e, attempt)
+                # Лимит общий для интеграции, поэтому приостанавливаем все запросы
+                self._paused_until = max(self._paused_until, time.monotonic() + delay)
+                logger.warning(f"Notion вернул 429, повтор через {delay:.1f} сек (попытка {attempt + 1}/{self.max_retries})")
+
+    def stats(self) -> Dict:
+        """Возвращает метрики очереди для мониторинга"""
+        waits = sorted(self._waits)
+        depth = {PRIORITY_INTERACTIVE: 0, PRIORITY_BACKGROUND: 0}
+        for priority, _, waiter in self._queue:
+            if not waiter.done():
+                depth[priority] = depth.get(priority, 0) + 1
+        return {
+            "queue_interactive": depth[PRIORITY_INTERACTIVE],
+            "queue_background": depth[PRIORITY_BACKGROUND],
+            "wait_avg": sum(waits) / len(waits) if waits else 0.0,
+            "wait_p95": waits[min(len(waits) - 1, int(len(waits) * 0.95))] if waits else 0.0,
+            "wait_max": waits[-1] if waits else 0.0,
+            "requests": self.requests,
+            "rate_limited": self.rate_limited,
+            "paused_for": max(0.0, self._paused_until - time.monotonic()),
+        }
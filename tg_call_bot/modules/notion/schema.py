@@ -0,0 +1,90 @@
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Tuple
+
+
+@dataclass(frozen=True, slots=True)
+class DriverRecord:
+    """Запись водителя из базы Notion (неизменяемая, без __dict__ - экономит память в кэше)"""
+    id: str
+    name: str = ""
+    status: str = ""
+    about_driver: str = ""
+    number: str = ""
+    date: str = ""
+    notes: str = ""
+    trailer: bool = False
+    last_edited_time: str = ""
+    archived: bool = False
+
+
+# --- Извлечение значений по типу свойства Notion ---
+
+def _plain_text(key: str) -> Callable[[Dict], str]:
+    def extract(prop: Dict) -> str:
+        return "".join([text.get("plain_text", "") for text in prop.get(key) or []])
+    return extract
+
+def _select(prop: Dict) -> str:
+    select_obj = prop.get("select")
+    return select_obj.get("name", "") if select_obj else ""
+
+def _date(prop: Dict) -> str:
+    date_obj = prop.get("date")
+    return date_obj.get("start", "") if date_obj else ""
+
+def _checkbox(prop: Dict) -> bool:
+    return bool(prop.get("checkbox", False))
+
+_EXTRACTORS: Dict[str, Callable[[Dict], Any]] = {
+    "title": _plain_text("title"),
+    "rich_text": _plain_text("rich_text"),
+    "select": _select,
+    "date": _date,
+    "checkbox": _checkbox,
+}
+
+
+# Схема базы водителей: поле DriverRecord -> (свойство Notion, тип свойства, значение по умолчанию)
+DRIVER_SCHEMA: Dict[str, Tuple[str, str, Any]] = {
+    "name": ("Name", "title", "Без названия"),
+    "status": ("status", "select", ""),
+    "about_driver": ("About in the driver", "rich_text", ""),
+    "number": ("Number", "rich_text", ""),
+    "date": ("Date", "date", ""),
+    "notes": ("Notes", "rich_text", ""),
+    "trailer": ("Trailer", "checkbox", False),
+}
+
+
+def compile_schema(schema: Dict[str, Tuple[str, str, Any]]) -> Callable[[Dict], DriverRecord]:
+    """
+    Компилирует схему в функцию разбора страницы Notion в DriverRecord
+
+    Извлекатели подбираются по типу свойства один раз, а не при каждом разборе.
+    Свойство с неожиданным типом или пустым значением получает значение по умолчанию.
+    """
+    steps: List[Tuple[str, str, str, Any, Callable[[Dict], Any]]] = [
+        (field, prop_name, prop_type, default, _EXTRACTORS[prop_type])
+        for field, (prop_name, prop_type, default) in schema.items()
+    ]
+
+    def decode(page: Dict) -> DriverRecord:
+        properties = page.get("properties", {})
+        values = {
+            "id": page["id"],
+            "last_edited_time": page.get("last_edited_time", ""),
+            "archived": bool(page.get("archived") or page.get("in_trash")),
+        }
+        for field, prop_name, prop_type, default, extract in steps:
+            prop = properties.get(prop_name)
+            if prop is not None and prop.get("type") == prop_type:
+                values[field] = extract(prop) or default
+            else:
+                values[field] = default
+        return DriverRecord(**values)
+
+    return decode
+
+
+# Разбор страниц базы водителей, скомпилированный при импорте модуля
+decode_driver = compile_schema(DRIVER_SCHEMA)
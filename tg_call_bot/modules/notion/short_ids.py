@@ -0,0 +1,149 @@
+import logging
+import os
+import sqlite3
+from collections import OrderedDict
+from typing import Optional
+
+# Настройка логирования
+logger = logging.getLogger(__name__)
+
+_ALPHABET = "0123456789abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ"
+_BASE = len(_ALPHABET)
+_INDEX = {ch: i for i, ch in enumerate(_ALPHABET)}
+
+# Полный ID страницы Notion (UUID с дефисами или без) - такие callback остались в старых сообщениях
+_UUID_LENGTHS = (32, 36)
+
+
+def _encode(number: int) -> str:
+    if number == 0:
+        return _ALPHABET[0]
+    digits = []
+    while number:
+        number, rem = divmod(number, _BASE)
+        digits.append(_ALPHABET[rem])
+    return "".join(reversed(digits))
+
+
+def _decode(token: str) -> Optional[int]:
+    number = 0
+    for ch in token:
+        digit = _INDEX.get(ch)
+        if digit is None:
+            return None
+        number = number * _BASE + digit
+    return number
+
+
+class ShortIdRegistry:
+    """
+    Короткие base-62 токены для ID страниц Notion в callback_data
+
+    UUID страницы занимает 36 из 64 байт, отведенных Telegram под callback_data.
+    Токен - это номер записи в SQLite в base-62 (2-3 символа для тысяч водителей),
+    поэтому он стабилен между перезапусками и старые кнопки продолжают работать.
+    Горячие токены держатся в ограниченном LRU, остальные читаются из базы.
+    """
+
+    def __init__(self, db_path: str = None, max_size: int = 4096):
+        """
+        Args:
+            db_path: Путь к файлу SQLite (по умолчанию data/notion_ids.db)
+            max_size: Размер LRU в памяти
+        """
+        if db_path is None:
+            current_dir = os.path.dirname(os.path.abspath(__file__))
+            data_dir = os.path.join(os.path.dirname(os.path.dirname(current_dir)), 'data')
+            db_path = os.path.join(data_dir, 'notion_ids.db')
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+
+        self.db_path = db_path
+        self.max_size = max_size
+        self._by_id: "OrderedDict[str, str]" = OrderedDict()
+        self._by_token: "OrderedDict[str, str]" = OrderedDict()
+
+        self._db = sqlite3.connect(db_path)
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS short_ids (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                page_id TEXT UNIQUE NOT NULL
+            )
+        """)
+        self._db.commit()
+
+    def _remember(self, page_id: str, token: str) -> None:
+        self._by_id[page_id] = token
+        self._by_token[token] = page_id
+        self._by_id.move_to_end(page_id)
+        self._by_token.move_to_end(token)
+        while len(self._by_id) > self.max_size:
+            old_id, old_token = self._by_id.popitem(last=False)
+            self._by_token.pop(old_token, None)
+
+    def token(self, page_id: str) -> str:
+        """Возвращает короткий токен для ID страницы, при необходимости выдавая новый"""
+        token = self._by_id.get(page_id)
+        if token is None:
+            row = self._db.execute("SELECT seq FROM short_ids WHERE page_id = ?", (page_id,)).fetchone()
+            if row is None:
+                seq = self._db.execute("INSERT INTO short_ids (page_id) VALUES (?)", (page_id,)).lastrowid
+                self._db.commit()
+            else:
+                seq = row[0]
+            token = _encode(seq)
+        self._remember(page_id, token)
+        return token
+
+    def resolve(self, token: str) -> Optional[str]:
+        """Возвращает ID страницы по токену или None, если токен неизвестен"""
+        if len(token) in _UUID_LENGTHS:
+            return token
+        page_id = self._by_token.get(token)
+        if page_id is None:
+            seq = _decode(token)
+            if seq is None:
+                return None
+            row = self._db.execute("SELECT page_id FROM short_ids WHERE seq = ?", (seq,)).fetchone()
+            if row is None:
+                logger.warning(f"Неизвестный короткий ID в callback: {token}")
+                return None
+            page_id = row[0]
+        self._remember(page_id, token)
+        return page_id
+
+    def stats(self) -> dict:
+        """Возвращает размер реестра для админ панели"""
+        return {
+            "cached": len(self._by_id),
+            "total": self._db.execute("SELECT COUNT(*) FROM short_ids").fetchone()[0],
+        }
+
+
+# Создаем глобальный экземпляр реестра
+short_ids = ShortIdRegistry()
+
+
+def short_id(page_id: str) -> str:
+    """
+    Короткий токен ID страницы для callback_data
+
+    Args:
+        page_id (str): ID записи водителя
+
+    Returns:
+        str: base-62 токен
+    """
+    return short_ids.token(page_id)
+
+
+def resolve_short_id(token: str) -> Optional[str]:
+    """
+    ID страницы по токену из callback_data
+
+    Args:
+        token (str): Токен из short_id или полный ID из старых кнопок
+
+    Returns:
+        Optional[str]: ID записи водителя или None, если токен неизвестен
+    """
+    return short_ids.resolve(token)
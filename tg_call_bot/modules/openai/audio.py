@@ -0,0 +1,277 @@
+import asyncio
+import difflib
+import io
+import logging
+import os
+import re
+import shutil
+import tempfile
+from typing import BinaryIO, Iterable, List, NamedTuple, Optional, Tuple, Union
+
+from share.config import FFMPEG_BIN
+
+logger = logging.getLogger(__name__)
+
+_DURATION_RE = re.compile(r"Duration:\s*(\d+):(\d+):(\d+(?:\.\d+)?)")
+_SILENCE_START_RE = re.compile(r"silence_start:\s*(-?\d+(?:\.\d+)?)")
+_SILENCE_END_RE = re.compile(r"silence_end:\s*(-?\d+(?:\.\d+)?)")
+_WORD_RE = re.compile(r"\w+")
+
+# Параметры кодирования речи для Whisper: моно, 16 кГц, Opus в OGG
+_SPEECH_OUTPUT = ("-vn", "-ac", "1", "-ar", "16000", "-c:a", "libopus", "-application", "voip", "-f", "ogg")
+
+
+def ffmpeg_available() -> bool:
+    """Есть ли ffmpeg для нарезки аудио"""
+    return shutil.which(FFMPEG_BIN) is not None
+
+
+class FfmpegInput(NamedTuple):
+    """Вход ffmpeg: аргумент -i и файловые дескрипторы, которые передаются дочернему процессу"""
+    arg: str
+    fds: Tuple[int, ...] = ()
+
+
+def memory_file(data: bytes = b"") -> BinaryIO:
+    """
+    Анонимный файл в памяти с настоящим файловым дескриптором (memfd)
+
+    В отличие от BytesIO его можно передать ffmpeg как обычный файл с
+    перемоткой: через stdin MP4/M4A с индексом (moov) в конце не читаются.
+    Где memfd нет, используется безымянный временный файл.
+    """
+    if hasattr(os, "memfd_create"):
+        audio = open(os.memfd_create("audio", os.MFD_CLOEXEC), "w+b")
+    else:
+        audio = tempfile.TemporaryFile()
+    if data:
+        audio.write(data)
+        audio.seek(0)
+    return audio
+
+
+def has_fileno(audio: BinaryIO) -> bool:
+    """Есть ли у файлового объекта дескриптор, который можно передать ffmpeg"""
+    try:
+        audio.fileno()
+    except (AttributeError, OSError, io.UnsupportedOperation):
+        return False
+    return True
+
+
+def ffmpeg_input(audio: Union[str, BinaryIO]) -> FfmpegInput:
+    """
+    Готовит запись для чтения ffmpeg без промежуточных файлов
+
+    Путь передается как есть, файловый объект (memfd из memory_file или
+    временный файл) - через /dev/fd, так что ffmpeg может перематывать запись.
+    """
+    if isinstance(audio, str):
+        return FfmpegInput(audio)
+    fd = audio.fileno()
+    return FfmpegInput(f"/dev/fd/{fd}", fds=(fd,))
+
+
+async def _run_ffmpeg(*args: str, source: FfmpegInput = None) -> Tuple[bytes, str]:
+    """Запускает ffmpeg и возвращает stdout и stderr; при ошибке выбрасывает RuntimeError"""
+    process = await asyncio.create_subprocess_exec(
+        FFMPEG_BIN, "-hide_banner", "-nostdin", *args,
+        stdin=asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        pass_fds=source.fds if source is not None else (),
+    )
+    stdout, stderr = await process.communicate()
+    log = stderr.decode("utf-8", errors="replace")
+    if process.returncode != 0:
+        raise RuntimeError(f"ffmpeg завершился с кодом {process.returncode}: {log[-500:]}")
+    return stdout, log
+
+
+async def analyze_audio(source: FfmpegInput, noise_db: int = -30, min_silence: float = 0.4) -> Tuple[Optional[float], List[Tuple[float, float]]]:
+    """
+    Определяет длительность записи и участки тишины за один проход ffmpeg
+
+    Returns:
+        Tuple[Optional[float], List[Tuple[float, float]]]: Длительность в секундах
+            (None, если не удалось определить) и список (начало, конец) пауз
+    """
+    _, log = await _run_ffmpeg(
+        "-nostats", "-i", source.arg,
+        "-af", f"silencedetect=n={noise_db}dB:d={min_silence}",
+        "-f", "null", "-",
+        source=source,
+    )
+    duration = None
+    match = _DURATION_RE.search(log)
+    if match:
+        hours, minutes, seconds = match.groups()
+        duration = int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+    silences = []
+    start = None
+    for line in log.splitlines():
+        if (m := _SILENCE_START_RE.search(line)):
+            start = max(0.0, float(m.group(1)))
+        elif (m := _SILENCE_END_RE.search(line)) and start is not None:
+            silences.append((start, float(m.group(1))))
+            start = None
+    return duration, silences
+
+
+def plan_chunks(
+    duration: float,
+    silences: List[Tuple[float, float]],
+    chunk_seconds: float,
+    overlap: float,
+    search_window: float = 30.0,
+) -> List[Tuple[float, float]]:
+    """
+    Делит запись на отрезки примерно по chunk_seconds с перекрытием overlap
+
+    Граница отрезка ставится в середину паузы, ближайшей к целевой точке
+    в пределах search_window секунд, чтобы не резать слова. Если пауз рядом
+    нет, режем ровно по целевой точке - перекрытие сохранит слово на стыке.
+    """
+    if duration <= chunk_seconds:
+        return [(0.0, duration)]
+
+    cuts = []
+    position = 0.0
+    # Короткий хвост присоединяем к последнему отрезку, а не выделяем отдельно
+    while duration - position > chunk_seconds + search_window:
+        target = position + chunk_seconds
+        candidates = [
+            (start + end) / 2 for start, end in silences
+            if abs((start + end) / 2 - target) <= search_window and (start + end) / 2 > position + overlap * 2
+        ]
+        cut = min(candidates, key=lambda point: abs(point - target)) if candidates else target
+        cuts.append(cut)
+        position = cut
+
+    chunks = []
+    start = 0.0
+    for cut in cuts:
+        chunks.append((start, min(duration, cut + overlap)))
+        start = max(0.0, cut - overlap)
+    chunks.append((start, duration))
+    return chunks
+
+
+async def extract_chunk(source: FfmpegInput, start: float, end: float, bitrate: str = "24k") -> bytes:
+    """
+    Вырезает отрезок записи в память: моно, 16 кГц, Opus в контейнере OGG
+
+    Речь в таком виде занимает ~0.2 МБ на минуту, поэтому отрезок любой
+    разумной длины проходит ограничение Whisper в 25 МБ.
+    """
+    data, _ = await _run_ffmpeg(
+        "-ss", f"{start:.3f}", "-t", f"{end - start:.3f}", "-i", source.arg,
+        *_SPEECH_OUTPUT, "-b:a", bitrate, "pipe:1",
+        source=source,
+    )
+    return data
+
+
+def speech_bounds(duration: float, silences: List[Tuple[float, float]], edge: float = 0.1) -> Tuple[float, float]:
+    """Начало и конец речи: без тишины в начале и в конце записи"""
+    start, end = 0.0, duration
+    for silence_start, silence_end in silences:
+        if silence_start <= edge:
+            start = max(start, silence_end)
+        if silence_end >= duration - edge:
+            end = min(end, silence_start)
+    if end - start < 1.0:
+        # Запись целиком тишина или почти - не обрезаем, пусть решает Whisper
+        return 0.0, duration
+    return start, end
+
+
+async def compress_audio(source: FfmpegInput, start: float = 0.0, end: Optional[float] = None, bitrate: str = "24k") -> bytes:
+    """
+    Сжимает запись перед отправкой в Whisper: моно, 16 кГц, Opus с низким битрейтом
+
+    start и end обрезают тишину в начале и в конце записи.
+    """
+    trim = []
+    if start > 0:
+        trim += ["-ss", f"{start:.3f}"]
+    if end is not None:
+        trim += ["-t", f"{end - start:.3f}"]
+    data, _ = await _run_ffmpeg(
+        *trim, "-i", source.arg,
+        *_SPEECH_OUTPUT, "-b:a", bitrate, "pipe:1",
+        source=source,
+    )
+    return data
+
+
+def _words(text: str) -> List[Tuple[str, int]]:
+    """Нормализованные слова текста с позицией конца слова в исходной строке"""
+    return [(m.group(0).lower(), m.end()) for m in _WORD_RE.finditer(text)]
+
+
+def merge_transcripts(parts: List[str], max_overlap_words: int = 40, min_match: int = 3) -> str:
+    """
+    Склеивает транскрипты соседних отрезков, убирая повтор на перекрытии
+
+    Whisper распознает перекрытие в двух отрезках не всегда одинаково,
+    поэтому ищется самая длинная общая последовательность слов между
+    концом предыдущего и началом следующего куска, а не точное совпадение.
+    """
+    merged = ""
+    for part in parts:
+        part = part.strip()
+        if not part:
+            continue
+        if not merged:
+            merged = part
+            continue
+
+        tail = _words(merged)[-max_overlap_words:]
+        head = _words(part)[:max_overlap_words]
+        matcher = difflib.SequenceMatcher(None, [w for w, _ in tail], [w for w, _ in head], autojunk=False)
+        match = matcher.find_longest_match(0, len(tail), 0, len(head))
+        if match.size >= min_match:
+            # Обрезаем предыдущий кусок по концу совпадения, следующий - продолжаем после него
+            merged = merged[:tail[match.a + match.size - 1][1]]
+            part = part[head[match.b + match.size - 1][1]:].lstrip(" ,.;:!?-—")
+            merged = f"{merged} {part}".rstrip() if part else merged
+        else:
+            merged = f"{merged} {part}"
+    return merged
+
+
+# --- Отрезки расшифровки с таймкодами ---
+
+def compact_segments(segments: Iterable) -> List[list]:
+    """
+    Отрезки Whisper (verbose_json) в компактном виде: [[начало, конец, текст], ...]
+
+    Время округляется до десятых секунды, пустые отрезки отбрасываются.
+    """
+    compact = []
+    for segment in segments:
+        get = segment.get if isinstance(segment, dict) else lambda key: getattr(segment, key)
+        text = (get("text") or "").strip()
+        if text:
+            compact.append([round(float(get("start")), 1), round(float(get("end")), 1), text])
+    return compact
+
+
+def merge_segments(parts: List[List[list]], chunks: List[Tuple[float, float]]) -> List[list]:
+    """
+    Склеивает отрезки соседних кусков записи в одну шкалу времени
+
+    parts[i] - отрезки куска chunks[i] со временем от его начала. Перекрытие
+    делится пополам: до середины берутся отрезки предыдущего куска, после - следующего.
+    """
+    merged: List[list] = []
+    for i, (segments, (start, end)) in enumerate(zip(parts, chunks)):
+        low = (chunks[i - 1][1] + start) / 2 if i > 0 else float("-inf")
+        high = (end + chunks[i + 1][0]) / 2 if i + 1 < len(chunks) else float("inf")
+        for seg_start, seg_end, text in segments:
+            seg_start, seg_end = round(seg_start + start, 1), round(seg_end + start, 1)
+            if low <= seg_start < high:
+                merged.append([seg_start, seg_end, text])
+    return merged
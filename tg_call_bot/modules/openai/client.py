@@ -1,38 +1,260 @@
-from openai import AsyncOpenAI
-from share.config import OPENAI_KEY
+from openai import AsyncOpenAI, APIStatusError, APITimeoutError
+from share.config import (
+    OPENAI_KEY,
+    WHISPER_MAX_UPLOAD_MB, WHISPER_CHUNK_SECONDS, WHISPER_CHUNK_OVERLAP, WHISPER_CONCURRENCY,
+    AUDIO_PRECOMPRESS, AUDIO_OPUS_BITRATE,
+    GPT_MAP_REDUCE_TOKENS, GPT_MAP_CHUNK_TOKENS, GPT_MAP_CONCURRENCY,
+    OPENAI_WHISPER_DEADLINE, OPENAI_CHAT_DEADLINE, OPENAI_HEDGE_PERCENTILE,
+)
+import asyncio
+import contextlib
 import logging
+import os
+import shutil
+import time
+from typing import BinaryIO, Callable, Dict, List, Optional, Tuple, Union
 
-from share.promt_utils import get_promt_call_analyze
+from .audio import (
+    FfmpegInput, ffmpeg_input, ffmpeg_available, memory_file, has_fileno, analyze_audio, plan_chunks, extract_chunk, merge_transcripts,
+    speech_bounds, compress_audio, compact_segments, merge_segments,
+)
+from .gpt_cache import gpt_cache
+from .model_router import model_router
+from .resilience import resilient
+from .tokens import count_tokens, split_by_tokens
 
 logger = logging.getLogger(__name__)
 
-client = AsyncOpenAI(api_key=OPENAI_KEY)
+# Повторы делает resilient (с паузами, ограничением времени и защитой от сбоев), а не сам клиент
+client = AsyncOpenAI(api_key=OPENAI_KEY, max_retries=0)
 
+# Вызывается с (номер отрезка с 0, всего отрезков, текст отрезка)
+ChunkCallback = Callable[[int, int, str], None]
 
-async def transcription(file_path: str) -> str:
-    """Транскрибирует аудиофайл в текст"""
-    logger.info(f"Транскрибируем аудиофайл в текст")
+# Общий для всех задач лимит одновременных запросов к Whisper
+_whisper_semaphore = asyncio.Semaphore(WHISPER_CONCURRENCY)
+# Лимит одновременных запросов к GPT при анализе длинного звонка по частям
+_map_semaphore = asyncio.Semaphore(GPT_MAP_CONCURRENCY)
+
+
+async def _transcribe_upload(file, with_segments: bool = False) -> Tuple[str, List[list]]:
+    """Распознает файл; с with_segments кроме текста возвращает отрезки с таймкодами
+
+    Отрезки (см. compact_segments) запрашиваются через verbose_json только когда
+    они нужны, иначе Whisper вызывается как раньше и список отрезков пуст.
+    Временные ошибки повторяются, поэтому сбой 5xx не заставляет отправлять запись заново.
+    """
+    params = {"response_format": "verbose_json", "timestamp_granularities": ["segment"]} if with_segments else {}
+
+    def request():
+        # Файловый объект перематывается перед каждой попыткой
+        content = file[1]
+        if hasattr(content, "seek"):
+            content.seek(0)
+        return client.audio.transcriptions.create(
+            model="whisper-1",
+            file=file,
+            **params
+        )
+
+    response = await resilient.call("whisper", request, OPENAI_WHISPER_DEADLINE)
+    if not with_segments:
+        return response.text, []
+    return response.text, compact_segments(getattr(response, "segments", None) or [])
+
+
+async def _transcribe_chunks(source: FfmpegInput, duration: float, silences: list, on_chunk: ChunkCallback = None,
+                             with_segments: bool = False) -> Tuple[str, List[list]]:
+    """Распознает запись по отрезкам параллельно и склеивает результат по порядку
+
+    on_chunk вызывается с (номер с 0, всего отрезков, текст) сразу, как только
+    распознан очередной отрезок, не дожидаясь остальных.
+    """
+    chunks = plan_chunks(duration, silences, WHISPER_CHUNK_SECONDS, WHISPER_CHUNK_OVERLAP)
+    logger.info(f"Запись {duration:.0f} сек разбита на {len(chunks)} отрезков")
+
+    async def run(index: int, start: float, end: float) -> Tuple[str, List[list]]:
+        async with _whisper_semaphore:
+            data = await extract_chunk(source, start, end, AUDIO_OPUS_BITRATE)
+            started = time.monotonic()
+            text, segments = await _transcribe_upload((f"chunk_{index}.ogg", data), with_segments)
+            logger.info(f"Отрезок {index + 1}/{len(chunks)} ({start:.0f}-{end:.0f} сек) распознан за {time.monotonic() - started:.1f} сек")
+        if on_chunk is not None:
+            on_chunk(index, len(chunks), text)
+        return text, segments
+
+    parts = await asyncio.gather(*(run(i, start, end) for i, (start, end) in enumerate(chunks)))
+    return (
+        merge_transcripts([text for text, _ in parts]),
+        merge_segments([segments for _, segments in parts], chunks) if with_segments else [],
+    )
+
+
+async def _precompress(source: FfmpegInput, size_mb: float, duration: float, silences: list):
+    """
+    Сжимает запись в моно Opus 16 кГц и обрезает тишину по краям
+
+    Returns:
+        (файл в памяти, размер в МБ, имя файла, длительность, паузы со сдвигом
+        после обрезки) или None, если сжатие не удалось или не уменьшило файл
+    """
+    start, end = speech_bounds(duration, silences)
+    started = time.monotonic()
     try:
-        with open(file_path, "rb") as audio_file:
-            response = await client.audio.transcriptions.create(
-                model="whisper-1",
-                file=audio_file,
-            )
-        logger.info(f"Успешно транскрибирован файл: {file_path}")
-        return response.text
-    except Exception as e:
-        logger.error(f"Ошибка при транскрибации файла {file_path}: {e}")
-        raise
+        data = await compress_audio(source, start, end, AUDIO_OPUS_BITRATE)
+    except RuntimeError as e:
+        logger.warning(f"Не удалось сжать запись, отправляем исходную: {e}")
+        return None
+    out_mb = len(data) / (1024 * 1024)
+    if not data or out_mb >= size_mb:
+        logger.info(f"Сжатие не уменьшило запись ({size_mb:.1f} МБ → {out_mb:.1f} МБ), отправляем исходную")
+        return None
+    logger.info(
+        f"Запись сжата: {size_mb:.1f} МБ → {out_mb:.1f} МБ (в {size_mb / max(out_mb, 1e-6):.1f} раз), "
+        f"обрезано тишины {duration - (end - start):.1f} сек, сжатие заняло {time.monotonic() - started:.1f} сек"
+    )
+    shifted = [
+        (max(0.0, s - start), min(end, e) - start)
+        for s, e in silences if e > start and s < end
+    ]
+    return memory_file(data), out_mb, "audio.ogg", end - start, shifted
+
+
+async def transcription(
+        audio: Union[str, BinaryIO],
+        filename: str = "audio.mp3",
+        on_chunk: ChunkCallback = None,
+        with_segments: bool = False,
+) -> Union[str, Tuple[str, List[list]]]:
+    """Транскрибирует аудио в текст
+
+    Принимает путь к файлу или файловый объект - он отправляется в Whisper
+    без записи на диск. ffmpeg читает объект по дескриптору (см. memory_file),
+    объект без дескриптора (BytesIO) для этого копируется в memfd.
+    Длинные записи и файлы больше лимита Whisper режутся ffmpeg на отрезки
+    по паузам и распознаются параллельно; готовые отрезки передаются в on_chunk.
+    С with_segments возвращает (текст, отрезки [[начало, конец, текст], ...]).
+    """
+    if isinstance(audio, str):
+        with open(audio, "rb") as audio_file:
+            return await transcription(audio_file, os.path.basename(audio), on_chunk, with_segments)
+
+    logger.info("Транскрибируем аудиофайл в текст")
+    with contextlib.ExitStack() as owned:
+        try:
+            return await _transcribe_file(audio, filename, on_chunk, with_segments, owned)
+        except Exception as e:
+            logger.error(f"Ошибка при транскрибации файла {filename}: {e}")
+            raise
+
+
+async def _transcribe_file(audio: BinaryIO, filename: str, on_chunk: ChunkCallback, with_segments: bool,
+                           owned: contextlib.ExitStack):
+    """Тело transcription(); созданные по пути файлы в памяти закрываются через owned"""
+    audio.seek(0, os.SEEK_END)
+    size_mb = audio.tell() / (1024 * 1024)
+    audio.seek(0)
+    if ffmpeg_available():
+        if not has_fileno(audio):
+            copy = owned.enter_context(memory_file())
+            shutil.copyfileobj(audio, copy)
+            copy.seek(0)
+            audio.seek(0)
+            source = ffmpeg_input(copy)
+        else:
+            source = ffmpeg_input(audio)
+        try:
+            duration, silences = await analyze_audio(source)
+        except RuntimeError as e:
+            logger.warning(f"ffmpeg не смог прочитать {filename}, файл отправляется целиком: {e}")
+            duration, silences = None, []
+        if duration and AUDIO_PRECOMPRESS:
+            compressed = await _precompress(source, size_mb, duration, silences)
+            if compressed is not None:
+                audio, size_mb, filename, duration, silences = compressed
+                owned.enter_context(audio)
+                source = ffmpeg_input(audio)
+        if duration and (duration > WHISPER_CHUNK_SECONDS or size_mb > WHISPER_MAX_UPLOAD_MB):
+            text, segments = await _transcribe_chunks(source, duration, silences, on_chunk, with_segments)
+            logger.info(f"Успешно транскрибирован файл по отрезкам: {filename}")
+            return (text, segments) if with_segments else text
+    elif size_mb > WHISPER_MAX_UPLOAD_MB:
+        logger.warning(f"ffmpeg не найден, файл {size_mb:.1f}MB отправляется целиком и может быть отклонен Whisper")
+
+    audio.seek(0)
+    async with _whisper_semaphore:
+        text, segments = await _transcribe_upload((filename, audio), with_segments)
+    logger.info(f"Успешно транскрибирован файл: {filename}")
+    return (text, segments) if with_segments else text
+
+
+async def _stream_completion(completion_params: dict, on_progress: Callable[[str], None]) -> str:
+    """Получает ответ GPT потоком, передавая накопленный текст в on_progress"""
+    started = time.monotonic()
+    first_token_at = None
+    result = ""
+    stream = await client.chat.completions.create(**completion_params, stream=True)
+    async for chunk in stream:
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta.content
+        if not delta:
+            continue
+        if first_token_at is None:
+            first_token_at = time.monotonic()
+            logger.info(f"Первый фрагмент ответа GPT через {first_token_at - started:.1f} сек")
+        result += delta
+        on_progress(result)
+    logger.info(f"Поток GPT завершен за {time.monotonic() - started:.1f} сек")
+    return result
+
+
+def _hedge_delay(model: str):
+    """Через сколько секунд дублировать запрос к модели (None - не дублировать)"""
+    if OPENAI_HEDGE_PERCENTILE <= 0:
+        return None
+    return model_router.latency_percentile(model, OPENAI_HEDGE_PERCENTILE)
+
+
+def _is_model_failure(error: BaseException) -> bool:
+    """
+    Ошибка, которая говорит о состоянии модели: таймаут, 429 или 5xx
+
+    Только такие ошибки учитываются model_router; ошибки самого запроса
+    (400, 401, 404 и т.п.) не делают модель медленной или нездоровой.
+    """
+    if isinstance(error, (asyncio.TimeoutError, APITimeoutError)):
+        return True
+    if isinstance(error, APIStatusError):
+        return error.status_code == 429 or error.status_code >= 500
+    return False
 
 
 async def create_gptAnswer(
         message: str,
         system_promt: str,
-        model: str = "gpt-4o",
+        model: str = None,
         max_tokens: int = None,
+        use_cache: bool = True,
+        on_progress: Callable[[str], None] = None,
                            ) -> str:
-    """Создает ответ GPT на основе транскрибированного текста"""
-    logger.info(f"Создаем ответ GPT на основе транскрибированного текста")
+    """Создает ответ GPT на основе транскрибированного текста
+
+    Без model модель выбирается по длине текста (см. model_router).
+    Ответ на тот же текст с тем же промтом, моделью и max_tokens берется из кэша.
+    Если передан on_progress, ответ запрашивается потоком, и функция вызывается
+    с накопленным текстом после каждого фрагмента.
+    """
+    if model is None:
+        model = model_router.choose(count_tokens(message))
+    cache_key = gpt_cache.make_key(message, system_promt, model, max_tokens)
+    if use_cache:
+        cached = gpt_cache.get(cache_key)
+        if cached is not None:
+            logger.info("Ответ GPT взят из кэша")
+            return cached
+
+    logger.info("Создаем ответ GPT на основе транскрибированного текста")
     try:
         completion_params = {
             "model": model, 
@@ -46,10 +268,28 @@ async def create_gptAnswer(
         if max_tokens is not None:
             completion_params["max_tokens"] = max_tokens
             
-        response = await client.chat.completions.create(**completion_params)
-        logger.info("Успешно получен ответ от GPT")
-        result = response.choices[0].message.content
+        started = time.monotonic()
+        try:
+            if on_progress is not None:
+                result = await resilient.call(
+                    "chat", lambda: _stream_completion(completion_params, on_progress), OPENAI_CHAT_DEADLINE
+                )
+            else:
+                response = await resilient.call(
+                    "chat", lambda: client.chat.completions.create(**completion_params), OPENAI_CHAT_DEADLINE,
+                    hedge_after=_hedge_delay(model)
+                )
+                result = response.choices[0].message.content
+        except Exception as e:
+            # Открытый предохранитель и ошибки запроса не говорят о здоровье модели
+            if _is_model_failure(e):
+                model_router.record(model, time.monotonic() - started, ok=False)
+            raise
+        model_router.record(model, time.monotonic() - started)
+        logger.info(f"Успешно получен ответ от GPT ({model})")
         logger.info(f"Результат GPT: {len(result) if result else 0} символов")
+        if result and use_cache:
+            gpt_cache.put(cache_key, system_promt, result)
         return result or ""
     except Exception as e:
         logger.error(f"Ошибка при создании GPT ответа: {e}")
@@ -58,8 +298,169 @@ async def create_gptAnswer(
 
 
 
-async def analyze_transcribed_text(transcribed_text: str, system_promt: str, model: str = "gpt-4o", max_tokens: int = None) -> str:
-    """Анализирует транскрибированный текст через GPT"""
+_MAP_PROMPT = """Ты обрабатываешь часть {index} из {total} расшифровки длинного звонка.
+Выпиши из этой части все факты, цитаты и наблюдения, которые понадобятся для задачи ниже.
+Не заполняй шаблон ответа и не делай выводов по всему звонку - дай сжатые заметки по этой части.
+
+Задача:
+{task}"""
+
+
+async def _map_notes(chunks: List[str], system_promt: str, model: str) -> str:
+    """map: параллельно собирает заметки по каждому куску (не больше GPT_MAP_CONCURRENCY запросов)"""
+    partials = await asyncio.gather(*(
+        _map_chunk(index, len(chunks), chunk, system_promt, model)
+        for index, chunk in enumerate(chunks, 1)
+    ))
+    return "\n\n".join(partials)
+
+
+async def _map_chunk(index: int, total: int, chunk: str, system_promt: str, model: str) -> str:
+    async with _map_semaphore:
+        prompt = _MAP_PROMPT.format(index=index, total=total, task=system_promt)
+        result = await create_gptAnswer(chunk, system_promt=prompt, model=model)
+        logger.info(
+            f"map {index}/{total}: {count_tokens(chunk, model) + count_tokens(prompt, model)} токенов на входе, "
+            f"{count_tokens(result, model)} на выходе"
+        )
+        return f"### Часть {index} из {total}\n{result.strip()}"
+
+
+async def _reduce_notes(
+        notes: str,
+        system_promt: str,
+        model: str,
+        max_tokens: int = None,
+        on_progress: Callable[[str], None] = None,
+) -> str:
+    """reduce: сводит заметки исходным промтом, поэтому итог заполняет тот же шаблон ответа"""
+    # Если заметки сами не помещаются в запрос, сжимаем их еще раз
+    for level in range(2, 4):
+        if count_tokens(notes, model) <= GPT_MAP_REDUCE_TOKENS:
+            break
+        chunks = split_by_tokens(notes, GPT_MAP_CHUNK_TOKENS, model)
+        if len(chunks) == 1:
+            break
+        logger.info(f"map-reduce, уровень {level}: {count_tokens(notes, model)} токенов в {len(chunks)} частях")
+        notes = await _map_notes(chunks, system_promt, model)
+
+    reduce_message = (
+        "Ниже заметки по частям одного длинного звонка, собранные по порядку. "
+        "Составь по ним итоговый ответ для всего звонка.\n\n" + notes
+    )
+    result = await create_gptAnswer(
+        reduce_message,
+        system_promt=system_promt,
+        model=model,
+        max_tokens=max_tokens,
+        on_progress=on_progress
+    )
+    logger.info(
+        f"reduce: {count_tokens(reduce_message, model) + count_tokens(system_promt, model)} токенов на входе, "
+        f"{count_tokens(result, model)} на выходе"
+    )
+    return result
+
+
+async def _map_reduce_analyze(
+        transcribed_text: str,
+        system_promt: str,
+        model: str,
+        max_tokens: int = None,
+        on_progress: Callable[[str], None] = None,
+) -> str:
+    """
+    Анализ расшифровки, не помещающейся в один запрос
+
+    map: расшифровка делится на куски по GPT_MAP_CHUNK_TOKENS, по каждому
+    параллельно собираются заметки.
+    reduce: заметки сводятся исходным промтом в итоговый ответ.
+    """
+    chunks = split_by_tokens(transcribed_text, GPT_MAP_CHUNK_TOKENS, model)
+    logger.info(f"map-reduce, уровень 1: {count_tokens(transcribed_text, model)} токенов в {len(chunks)} частях")
+    notes = await _map_notes(chunks, system_promt, model)
+    return await _reduce_notes(notes, system_promt, model, max_tokens, on_progress)
+
+
+class AnalysisPipeline:
+    """
+    Анализ длинного звонка одновременно с его распознаванием
+
+    feed() передается в transcription(on_chunk=...): как только Whisper
+    распознал отрезок, по нему сразу запускается сбор заметок (map).
+    finish() после распознавания только сводит готовые заметки (reduce),
+    поэтому время обработки близко к большему из времени распознавания
+    и анализа, а не к их сумме.
+
+    Заметки собираются, только если по первому распознанному отрезку видно,
+    что звонок целиком не поместится в один запрос (GPT_MAP_REDUCE_TOKENS) -
+    иначе finish() анализирует расшифровку одним запросом, как обычно.
+    """
+
+    def __init__(self, system_promt: str, model: str = None):
+        self.system_promt = system_promt
+        self.model = model
+        self.active: Optional[bool] = None  # None - еще не решено
+        self._total = 0
+        self._tasks: Dict[int, asyncio.Task] = {}
+
+    def feed(self, index: int, total: int, text: str) -> None:
+        """Принимает распознанный отрезок и запускает по нему сбор заметок"""
+        self._total = total
+        if self.active is None:
+            estimate = count_tokens(text) * total
+            if self.model is None:
+                self.model = model_router.choose(estimate)
+            self.active = total > 1 and estimate > GPT_MAP_REDUCE_TOKENS
+            logger.info(
+                f"Расшифровка оценивается в {estimate} токенов, "
+                f"{'заметки собираются по мере распознавания' if self.active else 'анализ после распознавания'}"
+            )
+        if self.active and text.strip():
+            self._tasks[index] = asyncio.create_task(
+                _map_chunk(index + 1, total, text, self.system_promt, self.model)
+            )
+
+    def cancel(self) -> None:
+        """Отменяет незавершенный сбор заметок (ошибка распознавания или отказ от заметок)"""
+        for task in self._tasks.values():
+            task.cancel()
+
+    async def finish(
+            self,
+            transcribed_text: str,
+            max_tokens: int = None,
+            on_progress: Callable[[str], None] = None,
+    ) -> str:
+        """Итоговый анализ: reduce по готовым заметкам или обычный анализ расшифровки"""
+        if self.active and self._tasks and self._total:
+            try:
+                partials = await asyncio.gather(*(self._tasks[i] for i in sorted(self._tasks)))
+            except Exception as e:
+                logger.warning(f"Заметки по отрезкам не собраны, анализируем расшифровку целиком: {e}")
+                self.cancel()
+            else:
+                logger.info(f"Заметки по {len(partials)} отрезкам готовы, сводим итог")
+                result = await _reduce_notes("\n\n".join(partials), self.system_promt, self.model, max_tokens, on_progress)
+                if result and result.strip():
+                    return result
+        self.cancel()
+        return await analyze_transcribed_text(
+            transcribed_text, self.system_promt, self.model, max_tokens, on_progress
+        )
+
+
+async def analyze_transcribed_text(
+        transcribed_text: str,
+        system_promt: str,
+        model: str = None,
+        max_tokens: int = None,
+        on_progress: Callable[[str], None] = None,
+) -> str:
+    """Анализирует транскрибированный текст через GPT
+
+    Без model модель выбирается по длине расшифровки (см. model_router).
+    """
     try:
         logger.info(f"Анализируем транскрибированный текст: {transcribed_text[:100]}...")
         
@@ -67,13 +468,21 @@ async def analyze_transcribed_text(transcribed_text: str, system_promt: str, mod
             logger.warning("Пустой текст для анализа")
             return "Не удалось распознать речь в аудиозаписи"
         
-        # Анализируем через GPT
-        gpt_analysis = await create_gptAnswer(
-            transcribed_text,
-            system_promt=system_promt,
-            model=model,
-            max_tokens=max_tokens
-        )
+        # Длинный звонок анализируем по частям (map-reduce), короткий - одним запросом
+        if model is None:
+            model = model_router.choose(count_tokens(transcribed_text))
+        transcript_tokens = count_tokens(transcribed_text, model)
+        if transcript_tokens > GPT_MAP_REDUCE_TOKENS:
+            gpt_analysis = await _map_reduce_analyze(transcribed_text, system_promt, model, max_tokens, on_progress)
+        else:
+            logger.info(f"Анализ одним запросом: {transcript_tokens + count_tokens(system_promt, model)} токенов на входе")
+            gpt_analysis = await create_gptAnswer(
+                transcribed_text,
+                system_promt=system_promt,
+                model=model,
+                max_tokens=max_tokens,
+                on_progress=on_progress
+            )
         
         if not gpt_analysis or gpt_analysis.strip() == "":
             logger.warning("Пустой результат от GPT")
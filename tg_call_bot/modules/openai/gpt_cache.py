@@ -0,0 +1,141 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from share.config import GPT_CACHE_MEMORY, GPT_CACHE_MAX
+from share.promt_utils import on_prompt_change
+
+# Настройка логирования
+logger = logging.getLogger(__name__)
+
+
+def _sha256(*parts) -> str:
+    return hashlib.sha256(json.dumps(parts, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+class GptCache:
+    """
+    Кэш ответов GPT по (текст, системный промт, модель, max_tokens)
+
+    Горячие ответы держатся в LRU в памяти, все - в SQLite, поэтому повторный
+    анализ той же транскрипции с тем же промтом бесплатен и после перезапуска.
+    При изменении промта или шаблона из админки ответы, полученные со старым
+    текстом, удаляются.
+    """
+
+    def __init__(self, db_path: str = None, memory_size: int = 256, max_entries: int = 2000):
+        """
+        Args:
+            db_path: Путь к файлу SQLite (по умолчанию data/gpt_cache.db)
+            memory_size: Размер LRU в памяти
+            max_entries: Максимум ответов на диске
+        """
+        if db_path is None:
+            current_dir = os.path.dirname(os.path.abspath(__file__))
+            data_dir = os.path.join(os.path.dirname(os.path.dirname(current_dir)), 'data')
+            db_path = os.path.join(data_dir, 'gpt_cache.db')
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+
+        self.db_path = db_path
+        self.memory_size = memory_size
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        # ключ -> (хэш промта, ответ)
+        self._memory: "OrderedDict[str, Tuple[str, str]]" = OrderedDict()
+
+        self._db = sqlite3.connect(db_path)
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS results (
+                key TEXT PRIMARY KEY,
+                prompt_hash TEXT NOT NULL,
+                result TEXT NOT NULL,
+                used_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS results_prompt ON results (prompt_hash);
+            CREATE TABLE IF NOT EXISTS prompts (
+                prompt_hash TEXT PRIMARY KEY,
+                text TEXT NOT NULL
+            );
+        """)
+        self._db.commit()
+
+    @staticmethod
+    def make_key(message: str, system_promt: str, model: str, max_tokens: Optional[int]) -> str:
+        return _sha256(message, system_promt, model, max_tokens)
+
+    def _remember(self, key: str, prompt_hash: str, result: str) -> None:
+        self._memory[key] = (prompt_hash, result)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_size:
+            self._memory.popitem(last=False)
+
+    def get(self, key: str) -> Optional[str]:
+        """Ответ из кэша или None"""
+        cached = self._memory.get(key)
+        if cached is not None:
+            self._memory.move_to_end(key)
+            self.hits += 1
+            return cached[1]
+        row = self._db.execute("SELECT prompt_hash, result FROM results WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self._db.execute("UPDATE results SET used_at = ? WHERE key = ?", (time.time(), key))
+        self._db.commit()
+        self._remember(key, row[0], row[1])
+        self.hits += 1
+        return row[1]
+
+    def put(self, key: str, system_promt: str, result: str) -> None:
+        """Сохраняет ответ"""
+        prompt_hash = _sha256(system_promt)
+        self._db.execute("INSERT OR IGNORE INTO prompts (prompt_hash, text) VALUES (?, ?)", (prompt_hash, system_promt))
+        self._db.execute(
+            "INSERT OR REPLACE INTO results (key, prompt_hash, result, used_at) VALUES (?, ?, ?, ?)",
+            (key, prompt_hash, result, time.time())
+        )
+        # Оставляем на диске только max_entries последних использованных ответов
+        self._db.execute("""
+            DELETE FROM results WHERE key IN (
+                SELECT key FROM results ORDER BY used_at DESC LIMIT -1 OFFSET ?
+            )
+        """, (self.max_entries,))
+        self._db.execute("DELETE FROM prompts WHERE prompt_hash NOT IN (SELECT DISTINCT prompt_hash FROM results)")
+        self._db.commit()
+        self._remember(key, prompt_hash, result)
+
+    def invalidate_prompt(self, old_text: str) -> None:
+        """Удаляет ответы, полученные с промтами, в которые входил old_text"""
+        stale = [
+            prompt_hash for prompt_hash, text in self._db.execute("SELECT prompt_hash, text FROM prompts")
+            if old_text and old_text in text
+        ]
+        if not stale:
+            return
+        placeholders = ",".join("?" for _ in stale)
+        removed = self._db.execute(f"DELETE FROM results WHERE prompt_hash IN ({placeholders})", stale).rowcount
+        self._db.execute(f"DELETE FROM prompts WHERE prompt_hash IN ({placeholders})", stale)
+        self._db.commit()
+        for key in [k for k, (prompt_hash, _) in self._memory.items() if prompt_hash in stale]:
+            self._memory.pop(key, None)
+        logger.info(f"Промт изменен, из кэша GPT удалено {removed} ответов")
+
+    def stats(self) -> Dict:
+        """Возвращает состояние кэша для админ панели"""
+        return {
+            "entries": self._db.execute("SELECT COUNT(*) FROM results").fetchone()[0],
+            "memory": len(self._memory),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+# Создаем глобальный экземпляр кэша и подписываем его на изменения промтов
+gpt_cache = GptCache(memory_size=GPT_CACHE_MEMORY, max_entries=GPT_CACHE_MAX)
+on_prompt_change(gpt_cache.invalidate_prompt)
@@ -1,16 +1,17 @@
 from aiogram import Router, F
 from aiogram.filters import Command
-from aiogram.types import Message, FSInputFile
+from aiogram.types import Message, BufferedInputFile, InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.fsm.context import FSMContext
 
 import logging
-import os
-import tempfile
 
-from share.usecases import transcribe_file
+from share.usecases import run_job, deliver_job
+from share.job_journal import job_journal
+from share.progress import ProgressMessage
+from share.job_queue import audio_queue, queue_notifier, QueueFullError
+from share.config import STREAM_EDIT_INTERVAL
 from share.promt_utils import get_promt_call_analyze, get_promt_call_summary
 from .state import AudioStates
-from .client import create_gptAnswer
 
 logger = logging.getLogger(__name__)
 router = Router()
@@ -26,49 +27,99 @@ async def _get_file_info(message: Message) -> tuple[str, str]:
     else:  # document
         return message.document.file_id, message.document.file_name or "audio.mp3"
 
+async def _deliver_document(bot, job: dict, result: str, late: bool) -> None:
+    """Отправляет результат обработки файлом и убирает сообщение о ходе обработки"""
+    params = job["params"]
+    caption = params["success_caption"]
+    if late:
+        caption = f"⏰ Обработка была прервана перезапуском бота и завершена позже.\n{caption}"
+
+    # Результат собирается в памяти и отправляется без временного файла
+    content = (
+        f"{params['header_text']}\n"
+        f"Файл: {job['filename']}\n"
+        + "=" * 50 + "\n\n"
+        + result
+    )
+    document = BufferedInputFile(content.encode("utf-8"), filename=params["output_filename"])
+    await bot.send_document(job["chat_id"], document=document, caption=caption)
+
+    try:
+        await bot.delete_message(job["chat_id"], params["processing_message_id"])
+    except Exception as e:
+        logger.debug(f"Не удалось удалить сообщение о ходе обработки: {e}")
+
+async def _deliver_bundle(bot, job: dict, result: str, late: bool) -> None:
+    """Отправляет все результаты по записи одним файлом и предлагает сохранить анализ в Notion"""
+    await _deliver_document(bot, job, result, late)
+    if not job["params"].get("section_results", {}).get("analysis", "").strip():
+        return
+    await bot.send_message(
+        job["chat_id"],
+        "💾 Сохранить анализ звонка комментарием к водителю в Notion?",
+        reply_markup=InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text="💾 Выбрать водителя", callback_data=f"bundle_save:{job['id']}")]
+        ])
+    )
+
+# Результаты задач, продолжаемых после перезапуска, доставляются так же
+job_journal.register_delivery("document", _deliver_document)
+job_journal.register_delivery("bundle", _deliver_bundle)
+
 async def _process_audio_file(
     message: Message,
     processing_message: Message,
     system_prompt: str,
     output_filename: str,
     success_caption: str,
-    header_text: str
+    header_text: str,
+    sections: list = None,
+    speaker_split: bool = False
 ) -> None:
-    """Общая функция для обработки аудиофайлов"""
+    """Общая функция для обработки аудиофайлов
+
+    sections - разделы [{"key", "title", "prompt"}] для анализа одной
+    транскрипции несколькими промтами сразу (вместо system_prompt).
+    speaker_split - вместо анализа разделить расшифровку по спикерам.
+    """
+    # Ответ GPT выводится в сообщение о ходе обработки по мере генерации
+    progress = ProgressMessage(processing_message, processing_message.text or header_text, STREAM_EDIT_INTERVAL)
+    job_id = None
     try:
         file_id, filename = await _get_file_info(message)
-        
-        result = await transcribe_file(
-            message.bot,
-            file_id,
-            filename,
-            system_prompt
+        # Задача записывается в журнал до начала обработки и переживает перезапуск бота
+        params = {"sections": sections} if sections else {}
+        if speaker_split:
+            params["speaker_split"] = True
+        job_id = job_journal.create(
+            "bundle" if sections else "document",
+            message.chat.id, message.from_user.id, file_id, filename, system_prompt,
+            **params,
+            output_filename=output_filename,
+            success_caption=success_caption,
+            header_text=header_text,
+            processing_message_id=processing_message.message_id,
         )
-
-        # Создаем временный файл с результатом
-        with tempfile.NamedTemporaryFile(mode='w', suffix='.txt', delete=False, encoding='utf-8') as temp_file:
-            temp_file.write(f"{header_text}\n")
-            temp_file.write(f"Файл: {filename}\n")
-            temp_file.write("=" * 50 + "\n\n")
-            temp_file.write(result)
-            temp_file_path = temp_file.name
         
         try:
-            # Отправляем файл пользователю
-            document = FSInputFile(temp_file_path, filename=output_filename)
-            await message.answer_document(
-                document=document,
-                caption=success_caption
+            # Файл ждет своей очереди: одновременно обрабатывается ограниченное число файлов
+            result = await audio_queue.run(
+                message.from_user.id,
+                lambda: run_job(message.bot, job_id, on_progress=progress.update),
+                on_position=queue_notifier(processing_message)
             )
-            await processing_message.delete()
-            
+        except QueueFullError:
+            job_journal.fail(job_id, "Очередь переполнена", max_attempts=0)
+            return await processing_message.edit_text("⏳ Сейчас обрабатывается слишком много файлов. Попробуйте через несколько минут")
         finally:
-            # Удаляем временный файл
-            if os.path.exists(temp_file_path):
-                os.unlink(temp_file_path)
+            await progress.close()
+
+        await deliver_job(message.bot, job_id, result)
         
     except Exception as e:
         logger.error(f"Ошибка при обработке аудио: {e}")
+        if job_id is not None:
+            job_journal.fail(job_id, str(e), max_attempts=0)
         await processing_message.edit_text("❌ Произошла ошибка при обработке аудио")
 
 
@@ -99,6 +150,16 @@ async def cmd_call_analysis(message: Message, state: FSMContext):
     )
     await state.set_state(AudioStates.waiting_for_audio_analysis)
 
+@router.message(Command("call_full"))
+async def cmd_call_full(message: Message, state: FSMContext):
+    """Команда для получения всех результатов по одной записи"""
+    await message.answer(
+        "📦 Отправьте аудиозапись звонка: будут готовы транскрипция по спикерам, "
+        "анализ звонка и профиль водителя одним файлом.\n"
+        "Поддерживаются форматы: mp3, wav, ogg, m4a"
+    )
+    await state.set_state(AudioStates.waiting_for_audio_full)
+
 # --- Обработка аудио для транскрибации ---
 
 @router.message(AudioStates.waiting_for_audio_transcribe)
@@ -113,22 +174,15 @@ async def handle_transcribe_audio(message: Message, state: FSMContext):
     processing = await message.answer("🎙️ Транскрибирую аудио...")
     
     try:
-        # Промпт для транскрибации по спикерам
-        system_prompt = """Транскрибируй этот аудиофайл и раздели речь по спикерам. 
-        Формат ответа:
-        
-        Спикер 1: [текст]
-        Спикер 2: [текст]
-        
-        """
-        
+        # Речь делится по спикерам по таймкодам Whisper, без переписывания расшифровки GPT
         await _process_audio_file(
             message,
             processing,
-            system_prompt,
+            None,
             "transcription.txt",
             "✅ Транскрипция готова! Результат в файле.",
-            "🎙️ Транскрипция аудиофайла"
+            "🎙️ Транскрипция аудиофайла",
+            speaker_split=True
         )
         
     except Exception as e:
@@ -192,3 +246,36 @@ async def handle_analysis_audio(message: Message, state: FSMContext):
         await processing.edit_text("❌ Произошла ошибка при обработке аудио")
     
     await state.clear()
+
+@router.message(AudioStates.waiting_for_audio_full)
+async def handle_full_audio(message: Message, state: FSMContext):
+    """Обработка аудио для всех результатов сразу: запись распознается один раз"""
+    if not (message.voice or message.audio or message.document):
+        await message.answer("❌ Пожалуйста, отправьте аудиофайл")
+        return
+    
+    processing = await message.answer("📦 Обрабатываю звонок: транскрипция, анализ и профиль водителя...")
+    
+    try:
+        # Все промпты работают с одной транскрипцией одновременно
+        sections = [
+            {"key": "speakers", "title": "🎙️ Транскрипция по спикерам", "speaker_split": True},
+            {"key": "analysis", "title": "📞 Анализ звонка", "prompt": get_promt_call_analyze()},
+            {"key": "summary", "title": "👤 Профиль водителя", "prompt": get_promt_call_summary()},
+        ]
+        
+        await _process_audio_file(
+            message,
+            processing,
+            None,
+            "call_full.txt",
+            "✅ Транскрипция, анализ и профиль водителя готовы! Результат в файле.",
+            "📦 Полная обработка звонка",
+            sections=sections
+        )
+        
+    except Exception as e:
+        logger.error(f"Ошибка при полной обработке звонка: {e}")
+        await processing.edit_text("❌ Произошла ошибка при обработке аудио")
+    
+    await state.clear()
@@ -0,0 +1,171 @@
+import logging
+import math
+import time
+from collections import deque
+from typing import Deque, Dict, List, Optional, Tuple
+
+from share.config import (
+    GPT_MODEL_LARGE, GPT_MODEL_FAST, GPT_ROUTE_SHORT_TOKENS,
+    GPT_FAILOVER_P95, GPT_FAILOVER_ERROR_RATE, GPT_ROUTER_WINDOW, GPT_FAILOVER_COOLDOWN,
+)
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин гистограммы времени ответа в секундах
+LATENCY_BUCKETS = (1, 2, 5, 10, 20, 30, 60, 120, math.inf)
+
+
+class _ModelStats:
+    """Время ответа и ошибки одной модели: последние вызовы и гистограмма за все время"""
+
+    def __init__(self, window: int):
+        # (время вызова, время ответа, успех)
+        self.recent: Deque[Tuple[float, float, bool]] = deque(maxlen=window)
+        self.buckets = [0] * len(LATENCY_BUCKETS)
+        self.calls = 0
+        self.errors = 0
+        self.total_latency = 0.0
+
+    def record(self, latency: float, ok: bool) -> None:
+        self.recent.append((time.monotonic(), latency, ok))
+        self.calls += 1
+        if not ok:
+            self.errors += 1
+            return
+        self.total_latency += latency
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if latency <= bound:
+                self.buckets[i] += 1
+                break
+
+    def percentile(self, q: float) -> float:
+        """Перцентиль времени успешных ответов среди последних вызовов"""
+        latencies = sorted(latency for _, latency, ok in self.recent if ok)
+        if not latencies:
+            return 0.0
+        return latencies[min(len(latencies) - 1, int(q * len(latencies)))]
+
+    def error_rate(self) -> float:
+        if not self.recent:
+            return 0.0
+        return sum(1 for _, _, ok in self.recent if not ok) / len(self.recent)
+
+    def expire(self, max_age: float) -> None:
+        """Забывает последние вызовы старше max_age секунд"""
+        while self.recent and time.monotonic() - self.recent[0][0] > max_age:
+            self.recent.popleft()
+
+
+class ModelRouter:
+    """
+    Выбор модели GPT для запроса
+
+    Короткий текст (до short_tokens токенов) отправляется в быструю модель,
+    длинный - в большую. Если у выбранной модели p95 времени ответа или доля
+    ошибок среди последних вызовов превышают порог, запрос уходит в другую
+    модель, пока та в порядке. Вызовы старше cooldown секунд забываются,
+    поэтому модель, в которую перестали отправлять запросы, через cooldown
+    снова пробуется. Решения и время ответа каждой модели записываются
+    для админ панели.
+    """
+
+    def __init__(self, large: str, fast: str, short_tokens: int = 2000, max_p95: float = 90.0,
+                 max_error_rate: float = 0.3, window: int = 50, min_samples: int = 5, cooldown: float = 300.0):
+        """
+        Args:
+            large: Модель для длинных текстов
+            fast: Модель для коротких текстов
+            short_tokens: Текст до стольких токенов считается коротким
+            max_p95: Порог p95 времени ответа в секундах
+            max_error_rate: Порог доли ошибок
+            window: По скольким последним вызовам оценивается модель
+            min_samples: Меньше вызовов - модель считается здоровой
+            cooldown: Сколько секунд учитывается вызов при оценке модели
+        """
+        self.large = large
+        self.fast = fast
+        self.short_tokens = short_tokens
+        self.max_p95 = max_p95
+        self.max_error_rate = max_error_rate
+        self.window = window
+        self.min_samples = min_samples
+        self.cooldown = cooldown
+        self._models: Dict[str, _ModelStats] = {}
+        # (причина, модель) -> количество решений
+        self.decisions: Dict[Tuple[str, str], int] = {}
+        self.recent_decisions: Deque[Tuple[float, int, str, str]] = deque(maxlen=20)
+
+    def _stats(self, model: str) -> _ModelStats:
+        if model not in self._models:
+            self._models[model] = _ModelStats(self.window)
+        return self._models[model]
+
+    def record(self, model: str, latency: float, ok: bool = True) -> None:
+        """Записывает время ответа модели (или ошибку)"""
+        self._stats(model).record(latency, ok)
+
+    def latency_percentile(self, model: str, q: float) -> Optional[float]:
+        """Перцентиль q времени ответа модели или None, пока вызовов слишком мало"""
+        stats = self._stats(model)
+        if sum(1 for _, _, ok in stats.recent if ok) < self.min_samples:
+            return None
+        return stats.percentile(q)
+
+    def healthy(self, model: str) -> bool:
+        stats = self._stats(model)
+        stats.expire(self.cooldown)
+        if len(stats.recent) < self.min_samples:
+            return True
+        return stats.percentile(0.95) <= self.max_p95 and stats.error_rate() <= self.max_error_rate
+
+    def choose(self, tokens: int) -> str:
+        """Модель для текста длиной tokens токенов"""
+        if tokens <= self.short_tokens:
+            model, alternate, reason = self.fast, self.large, "короткий текст"
+        else:
+            model, alternate, reason = self.large, self.fast, "длинный текст"
+        if model != alternate and not self.healthy(model) and self.healthy(alternate):
+            stats = self._stats(model)
+            logger.warning(
+                f"Модель {model} перегружена (p95 {stats.percentile(0.95):.1f} сек, "
+                f"ошибок {stats.error_rate():.0%}), запрос уходит в {alternate}"
+            )
+            model, reason = alternate, f"резерв вместо {model}"
+        key = (reason, model)
+        self.decisions[key] = self.decisions.get(key, 0) + 1
+        self.recent_decisions.append((time.time(), tokens, model, reason))
+        logger.info(f"Выбрана модель {model}: {reason}, {tokens} токенов")
+        return model
+
+    def stats(self) -> Dict:
+        """Возвращает состояние моделей и решения для админ панели"""
+        models: List[Dict] = []
+        for name, stats in self._models.items():
+            successes = stats.calls - stats.errors
+            models.append({
+                "model": name,
+                "calls": stats.calls,
+                "errors": stats.errors,
+                "avg": stats.total_latency / successes if successes else 0.0,
+                "p50": stats.percentile(0.5),
+                "p95": stats.percentile(0.95),
+                "error_rate": stats.error_rate(),
+                "healthy": self.healthy(name),
+                "histogram": list(zip(LATENCY_BUCKETS, stats.buckets)),
+            })
+        return {
+            "models": models,
+            "decisions": dict(self.decisions),
+        }
+
+
+# Создаем глобальный экземпляр выбора модели
+model_router = ModelRouter(
+    large=GPT_MODEL_LARGE,
+    fast=GPT_MODEL_FAST,
+    short_tokens=GPT_ROUTE_SHORT_TOKENS,
+    max_p95=GPT_FAILOVER_P95,
+    max_error_rate=GPT_FAILOVER_ERROR_RATE,
+    window=GPT_ROUTER_WINDOW,
+    cooldown=GPT_FAILOVER_COOLDOWN,
+)
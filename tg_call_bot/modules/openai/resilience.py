@@ -0,0 +1,255 @@
+import asyncio
+import logging
+import random
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+import openai
+
+from share.config import (
+    OPENAI_MAX_ATTEMPTS, OPENAI_BACKOFF_BASE, OPENAI_BACKOFF_MAX,
+    OPENAI_BREAKER_FAILURES, OPENAI_BREAKER_RESET,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitOpenError(Exception):
+    """Сервис OpenAI недоступен: защита разомкнута, запрос не отправлялся"""
+
+
+def is_retryable(error: BaseException) -> bool:
+    """
+    Временная ли ошибка (стоит повторить запрос)
+
+    Повторяются таймауты, обрывы соединения, 429 (кроме исчерпанной квоты),
+    409 и ответы 5xx. Ошибки запроса (400, 401, 403, 404, 422) не повторяются:
+    повтор вернет то же самое.
+    """
+    if isinstance(error, (asyncio.TimeoutError, openai.APIConnectionError)):
+        return True
+    if isinstance(error, openai.RateLimitError):
+        return getattr(error, "code", None) != "insufficient_quota"
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code == 409 or error.status_code >= 500
+    return False
+
+
+def _retry_after(error: BaseException) -> Optional[float]:
+    """Пауза из заголовка Retry-After ответа, если он есть"""
+    response = getattr(error, "response", None)
+    value = response.headers.get("retry-after") if response is not None else None
+    try:
+        return float(value) if value else None
+    except ValueError:
+        return None
+
+
+class CircuitBreaker:
+    """
+    Защита от запросов к неработающему сервису
+
+    После failure_threshold временных ошибок подряд защита размыкается, и
+    запросы сразу отклоняются CircuitOpenError, не дожидаясь таймаутов.
+    Через reset_timeout секунд пропускается один пробный запрос: успех
+    замыкает защиту, ошибка снова размыкает ее.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.trips = 0
+        self._probe = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def allow(self) -> bool:
+        """
+        Пропускает запрос или отклоняет его CircuitOpenError
+
+        Returns:
+            bool: True, если запрос пробный - его исход нужно сообщить
+            success()/failure() или вернуть пробу release()
+        """
+        state = self.state
+        if state == "closed":
+            return False
+        if state == "half_open" and not self._probe:
+            self._probe = True
+            return True
+        wait = max(0.0, self.reset_timeout - (time.monotonic() - self.opened_at))
+        raise CircuitOpenError(f"OpenAI ({self.name}) временно недоступен, повтор через {wait:.0f} сек")
+
+    def success(self) -> None:
+        if self.opened_at is not None:
+            logger.info(f"OpenAI ({self.name}) снова отвечает, защита замкнута")
+        self.failures = 0
+        self.opened_at = None
+        self._probe = False
+
+    def failure(self) -> None:
+        self.failures += 1
+        if self._probe or (self.opened_at is None and self.failures >= self.failure_threshold):
+            self.opened_at = time.monotonic()
+            self.trips += 1
+            logger.warning(f"OpenAI ({self.name}): {self.failures} сбоев подряд, запросы отклоняются {self.reset_timeout:.0f} сек")
+        self._probe = False
+
+    def release(self) -> None:
+        """Пробный запрос завершился без вывода о здоровье сервиса (ошибка запроса или отмена)"""
+        self._probe = False
+
+
+class ResilientCaller:
+    """
+    Вызовы OpenAI с повторами, ограничением времени и защитой от сбоев
+
+    Временные ошибки повторяются с экспоненциальной паузой и случайным
+    разбросом (или паузой из Retry-After), пока не кончатся попытки или
+    время вызова (deadline). Для каждого вида вызовов ("whisper", "chat")
+    своя защита CircuitBreaker. Запрос GPT может дублироваться (hedging):
+    если ответ не пришел за hedge_after секунд, отправляется второй такой же
+    запрос, и берется ответ, пришедший первым.
+    """
+
+    def __init__(self, max_attempts: int = 4, backoff_base: float = 1.0, backoff_max: float = 30.0,
+                 breaker_failures: int = 5, breaker_reset: float = 30.0):
+        """
+        Args:
+            max_attempts: Попыток на один вызов
+            backoff_base: Пауза перед первым повтором в секундах
+            backoff_max: Максимальная пауза между повторами
+            breaker_failures: Сбоев подряд до размыкания защиты
+            breaker_reset: Секунд до пробного запроса после размыкания
+        """
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.breaker_failures = breaker_failures
+        self.breaker_reset = breaker_reset
+        self.breakers: Dict[str, CircuitBreaker] = {}
+        self.retries: Dict[str, int] = {}
+        self.hedges: Dict[str, int] = {}
+        self.hedge_wins: Dict[str, int] = {}
+
+    def breaker(self, kind: str) -> CircuitBreaker:
+        if kind not in self.breakers:
+            self.breakers[kind] = CircuitBreaker(kind, self.breaker_failures, self.breaker_reset)
+        return self.breakers[kind]
+
+    def _backoff(self, attempt: int, error: BaseException) -> float:
+        delay = _retry_after(error)
+        if delay is None:
+            delay = self.backoff_base * 2 ** (attempt - 1)
+            delay *= random.uniform(0.5, 1.0)
+        return min(delay, self.backoff_max)
+
+    async def call(self, kind: str, factory: Callable[[], Awaitable[Any]], deadline: float,
+                   hedge_after: Optional[float] = None) -> Any:
+        """
+        Выполняет factory() с повторами
+
+        Args:
+            kind: Вид вызова (у каждого своя защита и статистика)
+            factory: Создает новый запрос на каждую попытку
+            deadline: Сколько секунд всего дается на вызов вместе с повторами
+            hedge_after: Через сколько секунд дублировать запрос (None - не дублировать)
+
+        Raises:
+            CircuitOpenError: Защита разомкнута
+            asyncio.TimeoutError: Вызов не уложился в deadline
+        """
+        breaker = self.breaker(kind)
+        finish_by = time.monotonic() + deadline
+        attempt = 0
+        while True:
+            attempt += 1
+            probe = breaker.allow()
+            remaining = finish_by - time.monotonic()
+            try:
+                if remaining <= 0:
+                    raise asyncio.TimeoutError()
+                if hedge_after is not None and hedge_after < remaining:
+                    result = await asyncio.wait_for(self._hedged(kind, factory, hedge_after), timeout=remaining)
+                else:
+                    result = await asyncio.wait_for(factory(), timeout=remaining)
+            except Exception as e:
+                if not is_retryable(e):
+                    if probe:
+                        breaker.release()
+                    raise
+                breaker.failure()
+                delay = self._backoff(attempt, e)
+                if attempt >= self.max_attempts or time.monotonic() + delay >= finish_by:
+                    logger.error(f"OpenAI ({kind}): попытки исчерпаны после {attempt}: {e!r}")
+                    raise
+                self.retries[kind] = self.retries.get(kind, 0) + 1
+                logger.warning(f"OpenAI ({kind}): временная ошибка {e!r}, повтор {attempt + 1} через {delay:.1f} сек")
+                await asyncio.sleep(delay)
+                continue
+            except BaseException:
+                # Отмена (задачи или проигравшего дублирующего запроса) ничего не говорит
+                # о сервисе, но пробу нужно вернуть, иначе защита не замкнется никогда
+                if probe:
+                    breaker.release()
+                raise
+            breaker.success()
+            return result
+
+    async def _hedged(self, kind: str, factory: Callable[[], Awaitable[Any]], hedge_after: float) -> Any:
+        """Дублирует запрос, если первый не ответил за hedge_after секунд, и берет первый ответ"""
+        first = asyncio.ensure_future(factory())
+        done, _ = await asyncio.wait({first}, timeout=hedge_after)
+        if done:
+            return first.result()
+
+        self.hedges[kind] = self.hedges.get(kind, 0) + 1
+        logger.info(f"OpenAI ({kind}): нет ответа за {hedge_after:.1f} сек, отправляем дублирующий запрос")
+        second = asyncio.ensure_future(factory())
+        pending = {first, second}
+        error: Optional[BaseException] = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is second:
+                            self.hedge_wins[kind] = self.hedge_wins.get(kind, 0) + 1
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def stats(self) -> Dict:
+        """Возвращает состояние защиты и повторов для админ панели"""
+        return {
+            kind: {
+                "state": breaker.state,
+                "trips": breaker.trips,
+                "retries": self.retries.get(kind, 0),
+                "hedges": self.hedges.get(kind, 0),
+                "hedge_wins": self.hedge_wins.get(kind, 0),
+            }
+            for kind, breaker in self.breakers.items()
+        }
+
+
+# Создаем глобальный экземпляр для вызовов OpenAI
+resilient = ResilientCaller(
+    max_attempts=OPENAI_MAX_ATTEMPTS,
+    backoff_base=OPENAI_BACKOFF_BASE,
+    backoff_max=OPENAI_BACKOFF_MAX,
+    breaker_failures=OPENAI_BREAKER_FAILURES,
+    breaker_reset=OPENAI_BREAKER_RESET,
+)
@@ -0,0 +1,113 @@
+import logging
+import re
+from typing import List
+
+from share.config import SPEAKER_TURN_GAP, SPEAKER_LABEL_MODEL
+from .client import create_gptAnswer
+from .tokens import count_tokens
+
+logger = logging.getLogger(__name__)
+
+# Промпт для транскрибации по спикерам
+SPEAKERS_PROMPT = """Транскрибируй этот аудиофайл и раздели речь по спикерам. 
+        Формат ответа:
+        
+        Спикер 1: [текст]
+        Спикер 2: [текст]
+        
+        """
+
+_LABEL_PROMPT = """Ниже пронумерованные реплики телефонного разговора (у длинных реплик - только начало и конец).
+Определи, кто говорит в каждой реплике. Обычно собеседников двое, но может быть больше.
+Ответь только номерами спикеров по порядку реплик через пробел, например: 1 2 1 2 2 1
+Номеров должно быть ровно столько, сколько реплик."""
+
+
+def split_turns(segments: List[list], gap: float = 0.8) -> List[list]:
+    """
+    Объединяет отрезки Whisper в реплики [начало, конец, текст]
+
+    Новая реплика начинается после паузы не короче gap секунд или после
+    вопроса - в разговоре на него обычно отвечает собеседник.
+    """
+    turns: List[list] = []
+    for start, end, text in segments:
+        if turns:
+            last = turns[-1]
+            if start - last[1] < gap and not last[2].endswith("?"):
+                last[1] = end
+                last[2] = f"{last[2]} {text}"
+                continue
+        turns.append([start, end, text])
+    return turns
+
+
+def _excerpt(text: str, head: int = 12, tail: int = 6) -> str:
+    words = text.split()
+    if len(words) <= head + tail:
+        return text
+    return " ".join(words[:head]) + " … " + " ".join(words[-tail:])
+
+
+def _timestamp(seconds: float) -> str:
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}" if hours else f"{minutes:02d}:{seconds:02d}"
+
+
+def alternate_speakers(turns: List[list]) -> List[int]:
+    """Реплики двух собеседников по очереди: 1, 2, 1, 2, ..."""
+    return [i % 2 + 1 for i in range(len(turns))]
+
+
+async def label_speakers(turns: List[list], model: str) -> List[int]:
+    """
+    Подписывает реплики номерами спикеров через GPT
+
+    В запрос уходят только короткие выдержки из реплик, а ответ - строка номеров,
+    поэтому запрос намного дешевле и быстрее переписывания всей расшифровки.
+    """
+    message = "\n".join(f"{i}. {_excerpt(text)}" for i, (_, _, text) in enumerate(turns, 1))
+    answer = await create_gptAnswer(message, _LABEL_PROMPT, model=model, max_tokens=len(turns) * 2 + 20)
+    labels = [int(label) for label in re.findall(r"\d+", answer)]
+    if len(labels) != len(turns):
+        raise ValueError(f"GPT подписал {len(labels)} реплик из {len(turns)}")
+    return labels
+
+
+def format_turns(turns: List[list], labels: List[int]) -> str:
+    """Расшифровка по спикерам; подряд идущие реплики одного спикера объединяются"""
+    lines: List[list] = []
+    for (start, _, text), label in zip(turns, labels):
+        if lines and lines[-1][1] == label:
+            lines[-1][2] = f"{lines[-1][2]} {text}"
+        else:
+            lines.append([start, label, text])
+    return "\n\n".join(f"[{_timestamp(start)}] Спикер {label}: {text}" for start, label, text in lines)
+
+
+async def split_speakers(transcript: str, segments: List[list] = None, model: str = SPEAKER_LABEL_MODEL) -> str:
+    """
+    Делит расшифровку по спикерам
+
+    По таймкодам отрезков речь делится на реплики локально; GPT (модель model)
+    только подписывает короткие выдержки, а без модели реплики чередуются между
+    двумя собеседниками совсем без запроса. Если отрезков нет (расшифровка
+    из кэша прежних версий), вся расшифровка переписывается GPT, как раньше.
+    """
+    if not segments:
+        logger.info("Нет таймкодов отрезков, делим речь по спикерам через GPT целиком")
+        return await create_gptAnswer(transcript, system_promt=SPEAKERS_PROMPT)
+
+    turns = split_turns(segments, SPEAKER_TURN_GAP)
+    labels = alternate_speakers(turns)
+    if model and len(turns) > 1:
+        try:
+            labels = await label_speakers(turns, model)
+        except Exception as e:
+            logger.warning(f"Не удалось подписать реплики через GPT, спикеры чередуются: {e}")
+    logger.info(
+        f"Речь разделена на {len(turns)} реплик ({'GPT ' + model if model and len(turns) > 1 else 'без GPT'}), "
+        f"расшифровка {count_tokens(transcript)} токенов в GPT не отправлялась"
+    )
+    return format_turns(turns, labels)
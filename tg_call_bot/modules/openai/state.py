@@ -4,4 +4,5 @@ from aiogram.fsm.state import State, StatesGroup
 class AudioStates(StatesGroup):
     waiting_for_audio_transcribe = State()
     waiting_for_audio_analysis = State()  # для детального анализа звонка
-    waiting_for_audio_summary = State()   # для профиля водителя (суммаризация)
\ No newline at end of file
+    waiting_for_audio_summary = State()   # для профиля водителя (суммаризация)
+    waiting_for_audio_full = State()      # все результаты по одной записи
\ No newline at end of file
@@ -0,0 +1,68 @@
+import logging
+import re
+from functools import lru_cache
+from typing import List
+
+logger = logging.getLogger(__name__)
+
+try:
+    import tiktoken
+except ImportError:  # tiktoken необязателен: без него токены оцениваются по длине текста
+    tiktoken = None
+
+# Для русского текста у моделей OpenAI выходит около 3 символов на токен
+_CHARS_PER_TOKEN = 3
+
+# Предложение или строка вместе с пробелами после них
+_SENTENCE_RE = re.compile(r"[^.!?…\n]*(?:[.!?…]+|\n|$)\s*")
+
+
+@lru_cache(maxsize=8)
+def _encoding(model: str):
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("o200k_base")
+
+
+def count_tokens(text: str, model: str = "gpt-4o") -> int:
+    """Количество токенов в тексте: точно через tiktoken или оценка по длине"""
+    if not text:
+        return 0
+    encoding = _encoding(model)
+    if encoding is None:
+        return len(text) // _CHARS_PER_TOKEN + 1
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def split_by_tokens(text: str, max_tokens: int, model: str = "gpt-4o") -> List[str]:
+    """
+    Делит текст на куски не больше max_tokens по границам предложений
+
+    Предложение длиннее лимита режется по словам.
+    """
+    pieces = [m.group(0) for m in _SENTENCE_RE.finditer(text) if m.group(0)]
+    chunks: List[str] = []
+    current: List[str] = []
+    current_tokens = 0
+    for piece in pieces:
+        tokens = count_tokens(piece, model)
+        if tokens > max_tokens:
+            # Слишком длинное предложение (расшифровка без знаков препинания) - режем по словам
+            words = piece.split(" ")
+            step = max(1, len(words) * max_tokens // tokens)
+            pieces_of_piece = [" ".join(words[i:i + step]) + " " for i in range(0, len(words), step)]
+        else:
+            pieces_of_piece = [piece]
+        for part in pieces_of_piece:
+            part_tokens = count_tokens(part, model)
+            if current and current_tokens + part_tokens > max_tokens:
+                chunks.append("".join(current).strip())
+                current, current_tokens = [], 0
+            current.append(part)
+            current_tokens += part_tokens
+    if current:
+        chunks.append("".join(current).strip())
+    return [chunk for chunk in chunks if chunk]
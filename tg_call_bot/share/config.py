@@ -44,4 +44,91 @@ WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
 PROXY_URL = os.getenv("PROXY_URL")
 
 # Ограничения для OpenAI API
-MAX_AUDIO_SIZE_MB = int(os.getenv("MAX_AUDIO_SIZE_MB", "300"))  # Максимальный размер аудио в МБ
\ No newline at end of file
+MAX_AUDIO_SIZE_MB = int(os.getenv("MAX_AUDIO_SIZE_MB", "300"))  # Максимальный размер аудио в МБ
+
+# Настройки пагинации Notion
+NOTION_PAGE_SIZE = min(int(os.getenv("NOTION_PAGE_SIZE", "100")), 100)  # Записей на страницу запроса (максимум Notion - 100)
+NOTION_MAX_ROWS = int(os.getenv("NOTION_MAX_ROWS", "5000"))  # Максимум записей при загрузке списка водителей
+
+# Кэш списка водителей
+NOTION_ROSTER_TTL = int(os.getenv("NOTION_ROSTER_TTL", "60"))  # Время жизни кэша в секундах, затем дельта-синхронизация
+NOTION_ROSTER_FULL_SYNC = int(os.getenv("NOTION_ROSTER_FULL_SYNC", "1800"))  # Интервал полной перезагрузки в секундах (удаленные записи)
+
+# Объединение одинаковых запросов к Notion
+NOTION_COALESCE_TTL = float(os.getenv("NOTION_COALESCE_TTL", "3"))  # Сколько секунд переиспользовать ответ по странице водителя
+
+# Ограничение частоты запросов к Notion
+NOTION_RATE_LIMIT = float(os.getenv("NOTION_RATE_LIMIT", "3"))  # Запросов в секунду (лимит интеграции Notion)
+NOTION_RATE_BURST = int(os.getenv("NOTION_RATE_BURST", "3"))  # Сколько запросов можно отправить подряд без ожидания
+NOTION_MAX_RETRIES = int(os.getenv("NOTION_MAX_RETRIES", "5"))  # Максимум повторов после ответа 429
+
+# Очередь комментариев Notion
+NOTION_OUTBOX_MAX_ATTEMPTS = int(os.getenv("NOTION_OUTBOX_MAX_ATTEMPTS", "10"))  # Попыток отправки записи до перевода в failed
+
+# Локальная копия базы водителей для поиска (/find)
+NOTION_MIRROR_SYNC = int(os.getenv("NOTION_MIRROR_SYNC", "300"))  # Интервал дельта-синхронизации в секундах
+
+# Размер страницы списка водителей в Telegram
+DRIVERS_PER_PAGE = int(os.getenv("DRIVERS_PER_PAGE", "20"))  # Кнопок водителей на одной странице списка
+
+# Нарезка длинных записей для Whisper
+FFMPEG_BIN = os.getenv("FFMPEG_BIN", "ffmpeg")  # Путь к ffmpeg (без него запись отправляется целиком)
+WHISPER_MAX_UPLOAD_MB = float(os.getenv("WHISPER_MAX_UPLOAD_MB", "24"))  # Файлы больше режутся на отрезки (лимит Whisper - 25 МБ)
+WHISPER_CHUNK_SECONDS = int(os.getenv("WHISPER_CHUNK_SECONDS", "600"))  # Длительность отрезка в секундах
+WHISPER_CHUNK_OVERLAP = float(os.getenv("WHISPER_CHUNK_OVERLAP", "2"))  # Перекрытие соседних отрезков в секундах
+WHISPER_CONCURRENCY = int(os.getenv("WHISPER_CONCURRENCY", "6"))  # Сколько отрезков распознается одновременно
+
+# Кэш транскрипций (повторно отправленные записи не распознаются заново)
+TRANSCRIPT_CACHE_MB = float(os.getenv("TRANSCRIPT_CACHE_MB", "50"))  # Максимальный размер кэша в МБ
+TRANSCRIPT_CACHE_DAYS = float(os.getenv("TRANSCRIPT_CACHE_DAYS", "30"))  # Сколько дней хранить транскрипцию
+
+# Кэш ответов GPT (повторный анализ той же транскрипции с тем же промтом)
+GPT_CACHE_MEMORY = int(os.getenv("GPT_CACHE_MEMORY", "256"))  # Ответов в памяти
+GPT_CACHE_MAX = int(os.getenv("GPT_CACHE_MAX", "2000"))  # Максимум ответов на диске
+
+# Потоковый вывод ответа GPT в сообщение о ходе обработки
+STREAM_EDIT_INTERVAL = float(os.getenv("STREAM_EDIT_INTERVAL", "1.5"))  # Минимальный интервал между редактированиями в секундах
+
+# Очередь обработки аудио
+AUDIO_WORKERS = int(os.getenv("AUDIO_WORKERS", "3"))  # Сколько файлов обрабатывается одновременно
+AUDIO_PER_USER = int(os.getenv("AUDIO_PER_USER", "1"))  # Сколько файлов одного пользователя обрабатывается одновременно
+AUDIO_QUEUE_MAX = int(os.getenv("AUDIO_QUEUE_MAX", "50"))  # Максимум файлов в очереди
+AUDIO_QUEUE_PER_USER = int(os.getenv("AUDIO_QUEUE_PER_USER", "5"))  # Максимум файлов одного пользователя в очереди
+
+# Журнал задач обработки аудио (продолжение после перезапуска)
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))  # Сколько раз продолжать прерванную задачу
+
+# Обработка аудио без временных файлов
+AUDIO_SPOOL_MB = float(os.getenv("AUDIO_SPOOL_MB", "64"))  # Файлы до этого размера держатся в памяти (memfd), больше - во временном файле
+
+# Сжатие записей перед отправкой в Whisper (нужен ffmpeg с libopus)
+AUDIO_PRECOMPRESS = os.getenv("AUDIO_PRECOMPRESS", "true").lower() in ("1", "true", "yes")  # Сжимать в моно Opus 16 кГц и обрезать тишину по краям
+AUDIO_OPUS_BITRATE = os.getenv("AUDIO_OPUS_BITRATE", "24k")  # Битрейт Opus (для речи достаточно 16-32k)
+
+# Анализ длинных звонков по частям (map-reduce)
+GPT_MAP_REDUCE_TOKENS = int(os.getenv("GPT_MAP_REDUCE_TOKENS", "24000"))  # Расшифровка длиннее анализируется по частям
+GPT_MAP_CHUNK_TOKENS = int(os.getenv("GPT_MAP_CHUNK_TOKENS", "8000"))  # Размер одной части в токенах
+GPT_MAP_CONCURRENCY = int(os.getenv("GPT_MAP_CONCURRENCY", "4"))  # Сколько частей анализируется одновременно
+
+# Деление расшифровки по спикерам (/transcribe) по таймкодам Whisper
+SPEAKER_TURN_GAP = float(os.getenv("SPEAKER_TURN_GAP", "0.8"))  # Пауза в секундах, после которой начинается новая реплика
+SPEAKER_LABEL_MODEL = os.getenv("SPEAKER_LABEL_MODEL", "")  # Модель, подписывающая реплики (например gpt-4o-mini); по умолчанию пусто - реплики двух собеседников чередуются без GPT
+
+# Выбор модели GPT по длине текста и состоянию моделей
+GPT_MODEL_LARGE = os.getenv("GPT_MODEL_LARGE", "gpt-4o")  # Модель для длинных звонков
+GPT_MODEL_FAST = os.getenv("GPT_MODEL_FAST", "gpt-4o-mini")  # Быстрая модель для коротких записей
+GPT_ROUTE_SHORT_TOKENS = int(os.getenv("GPT_ROUTE_SHORT_TOKENS", "2000"))  # Текст до стольких токенов идет в быструю модель
+GPT_FAILOVER_P95 = float(os.getenv("GPT_FAILOVER_P95", "90"))  # p95 времени ответа в секундах, после которого модель считается перегруженной
+GPT_FAILOVER_ERROR_RATE = float(os.getenv("GPT_FAILOVER_ERROR_RATE", "0.3"))  # Доля ошибок, после которой модель считается недоступной
+GPT_ROUTER_WINDOW = int(os.getenv("GPT_ROUTER_WINDOW", "50"))  # По скольким последним вызовам оценивается модель
+GPT_FAILOVER_COOLDOWN = float(os.getenv("GPT_FAILOVER_COOLDOWN", "300"))  # Через сколько секунд без вызовов перегруженная модель снова пробуется
+
+# Повторы, ограничение времени и защита при сбоях OpenAI
+OPENAI_WHISPER_DEADLINE = float(os.getenv("OPENAI_WHISPER_DEADLINE", "600"))  # Сколько секунд всего (с повторами) дается на распознавание одного файла или отрезка
+OPENAI_CHAT_DEADLINE = float(os.getenv("OPENAI_CHAT_DEADLINE", "300"))  # Сколько секунд всего (с повторами) дается на один ответ GPT
+OPENAI_MAX_ATTEMPTS = int(os.getenv("OPENAI_MAX_ATTEMPTS", "4"))  # Попыток на один вызов при временных ошибках (5xx, таймаут, 429)
+OPENAI_BACKOFF_BASE = float(os.getenv("OPENAI_BACKOFF_BASE", "1"))  # Пауза перед первым повтором в секундах, дальше удваивается
+OPENAI_BACKOFF_MAX = float(os.getenv("OPENAI_BACKOFF_MAX", "30"))  # Максимальная пауза между повторами в секундах
+OPENAI_HEDGE_PERCENTILE = float(os.getenv("OPENAI_HEDGE_PERCENTILE", "0"))  # Через какой перцентиль времени ответа модели отправлять второй запрос GPT (например, 0.95); 0 - не отправлять
+OPENAI_BREAKER_FAILURES = int(os.getenv("OPENAI_BREAKER_FAILURES", "5"))  # Сколько сбоев подряд размыкает защиту, и запросы сразу отклоняются
+OPENAI_BREAKER_RESET = float(os.getenv("OPENAI_BREAKER_RESET", "30"))  # Через сколько секунд после размыкания пробуется один запрос
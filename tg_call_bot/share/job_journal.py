@@ -0,0 +1,184 @@
+import json
+import logging
+import os
+import sqlite3
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+# Настройка логирования
+logger = logging.getLogger(__name__)
+
+# Этапы задачи по порядку
+STAGE_QUEUED = "queued"
+STAGE_DOWNLOADED = "downloaded"
+STAGE_TRANSCRIBED = "transcribed"
+STAGE_ANALYSED = "analysed"
+STAGE_DELIVERED = "delivered"
+STAGE_FAILED = "failed"
+
+_ORDER = {stage: i for i, stage in enumerate(
+    (STAGE_QUEUED, STAGE_DOWNLOADED, STAGE_TRANSCRIBED, STAGE_ANALYSED, STAGE_DELIVERED)
+)}
+
+# Доставка результата: (bot, задача, результат, доставка после перезапуска)
+Delivery = Callable[[Any, Dict, str, bool], Awaitable[None]]
+
+
+def stage_reached(job: Dict, stage: str) -> bool:
+    """Пройден ли задачей этап stage"""
+    return _ORDER.get(job["stage"], -1) >= _ORDER[stage]
+
+
+class JobJournal:
+    """
+    Журнал задач обработки аудио в SQLite
+
+    Каждая задача записывается до начала обработки, после каждого этапа
+    (скачан, распознан, проанализирован, доставлен) журнал обновляется.
+    Транскрипция и результат сохраняются вместе с этапом, поэтому после
+    перезапуска бота задача продолжается с последнего пройденного этапа:
+    распознанный звонок не отправляется в Whisper повторно.
+    Скачанный файл во временной папке перезапуск не переживает, поэтому
+    задача на этапе "скачан" продолжается со скачивания.
+    """
+
+    def __init__(self, db_path: str = None, keep_days: float = 7):
+        """
+        Args:
+            db_path: Путь к файлу SQLite (по умолчанию data/jobs.db)
+            keep_days: Сколько дней хранить завершенные задачи
+        """
+        if db_path is None:
+            data_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data')
+            db_path = os.path.join(data_dir, 'jobs.db')
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+
+        self.db_path = db_path
+        self.keep_days = keep_days
+        self._deliveries: Dict[str, Delivery] = {}
+
+        self._db = sqlite3.connect(db_path)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                kind TEXT NOT NULL,
+                chat_id INTEGER NOT NULL,
+                user_id INTEGER NOT NULL,
+                file_id TEXT NOT NULL,
+                filename TEXT NOT NULL,
+                system_prompt TEXT,
+                params TEXT NOT NULL DEFAULT '{}',
+                stage TEXT NOT NULL,
+                transcript TEXT,
+                result TEXT,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                last_error TEXT,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )
+        """)
+        self._db.commit()
+
+    # --- Доставка результатов по виду задачи ---
+
+    def register_delivery(self, kind: str, delivery: Delivery) -> None:
+        """Регистрирует функцию доставки результата для задач вида kind"""
+        self._deliveries[kind] = delivery
+
+    def delivery(self, kind: str) -> Optional[Delivery]:
+        return self._deliveries.get(kind)
+
+    # --- Записи ---
+
+    @staticmethod
+    def _to_dict(row: sqlite3.Row) -> Dict:
+        job = dict(row)
+        job["params"] = json.loads(job["params"] or "{}")
+        return job
+
+    def create(self, kind: str, chat_id: int, user_id: int, file_id: str, filename: str,
+               system_prompt: str = None, **params) -> int:
+        """Записывает новую задачу и возвращает ее ID"""
+        now = time.time()
+        job_id = self._db.execute("""
+            INSERT INTO jobs (kind, chat_id, user_id, file_id, filename, system_prompt, params, stage, created_at, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, (kind, chat_id, user_id, file_id, filename, system_prompt,
+              json.dumps(params, ensure_ascii=False), STAGE_QUEUED, now, now)).lastrowid
+        self._db.commit()
+        return job_id
+
+    def get(self, job_id: int) -> Optional[Dict]:
+        row = self._db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._to_dict(row) if row else None
+
+    def advance(self, job_id: int, stage: str, **fields) -> None:
+        """Отмечает пройденный этап; fields - сохраняемые вместе с ним transcript/result"""
+        columns = ["stage = ?", "updated_at = ?"] + [f"{name} = ?" for name in fields]
+        self._db.execute(
+            f"UPDATE jobs SET {', '.join(columns)} WHERE id = ?",
+            [stage, time.time(), *fields.values(), job_id]
+        )
+        self._db.commit()
+
+    def set_params(self, job_id: int, **params) -> None:
+        """Дописывает параметры задачи (например, результаты по разделам)"""
+        job = self.get(job_id)
+        if job is None:
+            return
+        job["params"].update(params)
+        self._db.execute(
+            "UPDATE jobs SET params = ?, updated_at = ? WHERE id = ?",
+            (json.dumps(job["params"], ensure_ascii=False), time.time(), job_id)
+        )
+        self._db.commit()
+
+    def fail(self, job_id: int, error: str, max_attempts: int) -> bool:
+        """
+        Записывает ошибку обработки
+
+        Счетчик attempts здесь не меняется: его увеличивает только
+        продолжение задачи после перезапуска (_resume_job), поэтому
+        max_attempts - сколько продолжений разрешено (0 - ни одного).
+
+        Returns:
+            bool: True, если попытки исчерпаны и задача помечена как неудачная
+        """
+        job = self.get(job_id)
+        if job is None:
+            return True
+        failed = job["attempts"] >= max_attempts
+        self._db.execute(
+            "UPDATE jobs SET last_error = ?, stage = ?, updated_at = ? WHERE id = ?",
+            (error, STAGE_FAILED if failed else job["stage"], time.time(), job_id)
+        )
+        self._db.commit()
+        return failed
+
+    def unfinished(self) -> List[Dict]:
+        """Задачи, прерванные до доставки результата"""
+        rows = self._db.execute(
+            "SELECT * FROM jobs WHERE stage NOT IN (?, ?) ORDER BY id",
+            (STAGE_DELIVERED, STAGE_FAILED)
+        ).fetchall()
+        return [self._to_dict(row) for row in rows]
+
+    def purge(self) -> None:
+        """Удаляет завершенные задачи старше keep_days"""
+        self._db.execute(
+            "DELETE FROM jobs WHERE stage IN (?, ?) AND updated_at < ?",
+            (STAGE_DELIVERED, STAGE_FAILED, time.time() - self.keep_days * 86400)
+        )
+        self._db.commit()
+
+    def stats(self) -> Dict:
+        """Количество задач по этапам для админ панели"""
+        return {
+            row[0]: row[1]
+            for row in self._db.execute("SELECT stage, COUNT(*) FROM jobs GROUP BY stage")
+        }
+
+
+# Создаем глобальный экземпляр журнала
+job_journal = JobJournal()
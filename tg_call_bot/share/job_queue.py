@@ -0,0 +1,229 @@
+import asyncio
+import logging
+import math
+import time
+from collections import OrderedDict, deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional
+
+from aiogram.types import Message
+
+from share.config import AUDIO_WORKERS, AUDIO_PER_USER, AUDIO_QUEUE_MAX, AUDIO_QUEUE_PER_USER
+
+logger = logging.getLogger(__name__)
+
+# Вызывается с позицией в очереди (0 - задача запущена) и оценкой ожидания в секундах
+PositionCallback = Callable[[int, float], Awaitable[None]]
+
+
+class QueueFullError(Exception):
+    """Очередь обработки аудио переполнена"""
+
+
+class _Job:
+    __slots__ = ("user_id", "started", "enqueued_at")
+
+    def __init__(self, user_id: int):
+        self.user_id = user_id
+        self.started: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.enqueued_at = time.monotonic()
+
+
+class AudioJobQueue:
+    """
+    Очередь обработки аудио с ограничением параллельности и честностью между пользователями
+
+    Одновременно выполняется не больше workers задач и не больше per_user
+    задач одного пользователя. Свободный слот получает пользователь с ожидающими
+    задачами, которого обслуживали давнее всех (новый - раньше всех), поэтому
+    десять файлов одного пользователя не задерживают единственный файл другого.
+    """
+
+    def __init__(self, workers: int = 3, per_user: int = 1, max_pending: int = 50, per_user_pending: int = 5):
+        """
+        Args:
+            workers: Сколько задач выполняется одновременно
+            per_user: Сколько задач одного пользователя выполняется одновременно
+            max_pending: Максимум ожидающих задач всего
+            per_user_pending: Максимум ожидающих задач одного пользователя
+        """
+        self.workers = workers
+        self.per_user = per_user
+        self.max_pending = max_pending
+        self.per_user_pending = per_user_pending
+
+        # Пользователь -> его ожидающие задачи в порядке появления пользователей
+        self._pending: "OrderedDict[int, Deque[_Job]]" = OrderedDict()
+        self._running: Dict[int, int] = {}
+        self._active = 0
+        # Номер хода, на котором пользователь последний раз получил слот;
+        # хранится, пока у пользователя есть ожидающие или выполняемые задачи
+        self._served: Dict[int, int] = {}
+        self._turn = 0
+
+        self._avg_duration = 60.0
+        self._avg_wait = 0.0
+        self.completed = 0
+        self.rejected = 0
+        self._busy_time = 0.0
+        self._created_at = time.monotonic()
+
+    @property
+    def depth(self) -> int:
+        return sum(len(jobs) for jobs in self._pending.values())
+
+    def _order(self, user_id: int) -> int:
+        # Кого обслуживали давнее, тот идет раньше; новые пользователи - первыми
+        return self._served.get(user_id, -1)
+
+    def _forget(self, user_id: int) -> None:
+        if user_id not in self._pending and user_id not in self._running:
+            self._served.pop(user_id, None)
+
+    def _dispatch(self) -> None:
+        """Раздает свободные слоты ожидающим задачам, начиная с давнее всех обслуженного пользователя"""
+        while self._active < self.workers:
+            eligible = [user_id for user_id in self._pending if self._running.get(user_id, 0) < self.per_user]
+            if not eligible:
+                return
+            user_id = min(eligible, key=self._order)
+            jobs = self._pending[user_id]
+            job = jobs.popleft()
+            if not jobs:
+                del self._pending[user_id]
+            self._turn += 1
+            self._served[user_id] = self._turn
+            self._active += 1
+            self._running[user_id] = self._running.get(user_id, 0) + 1
+            job.started.set_result(None)
+
+    def _release(self, user_id: int) -> None:
+        self._active -= 1
+        self._running[user_id] -= 1
+        if not self._running[user_id]:
+            del self._running[user_id]
+            self._forget(user_id)
+        self._dispatch()
+
+    def _remove(self, job: _Job) -> None:
+        jobs = self._pending.get(job.user_id)
+        if jobs and job in jobs:
+            jobs.remove(job)
+            if not jobs:
+                del self._pending[job.user_id]
+                self._forget(job.user_id)
+
+    def position(self, job: _Job) -> int:
+        """Позиция задачи в порядке запуска (1 - следующая)"""
+        users = sorted(self._pending, key=self._order)
+        queues = [list(self._pending[user_id]) for user_id in users]
+        position = 0
+        for depth in range(max((len(q) for q in queues), default=0)):
+            for jobs in queues:
+                if depth < len(jobs):
+                    position += 1
+                    if jobs[depth] is job:
+                        return position
+        return position
+
+    def eta(self, position: int) -> float:
+        """Оценка ожидания до запуска задачи на позиции position, в секундах"""
+        return math.ceil(position / self.workers) * self._avg_duration
+
+    async def run(self, user_id: int, factory: Callable[[], Awaitable[Any]], on_position: Optional[PositionCallback] = None) -> Any:
+        """
+        Ставит задачу в очередь, дожидается слота и выполняет factory()
+
+        Raises:
+            QueueFullError: Очередь переполнена или у пользователя слишком много задач
+        """
+        if self.depth >= self.max_pending or len(self._pending.get(user_id, ())) >= self.per_user_pending:
+            self.rejected += 1
+            raise QueueFullError("Очередь обработки аудио переполнена")
+
+        job = _Job(user_id)
+        self._pending.setdefault(user_id, deque()).append(job)
+        self._dispatch()
+
+        try:
+            last = None
+            while not job.started.done():
+                position = self.position(job)
+                if position != last and on_position is not None:
+                    await _safe_notify(on_position, position, self.eta(position))
+                last = position
+                try:
+                    await asyncio.wait_for(asyncio.shield(job.started), timeout=5)
+                except asyncio.TimeoutError:
+                    pass
+        except BaseException:
+            if job.started.done():
+                self._release(user_id)
+            else:
+                self._remove(job)
+            raise
+
+        waited = time.monotonic() - job.enqueued_at
+        self._avg_wait = self._avg_wait * 0.8 + waited * 0.2
+        started = time.monotonic()
+        try:
+            if last is not None and on_position is not None:
+                await _safe_notify(on_position, 0, 0.0)
+            return await factory()
+        finally:
+            duration = time.monotonic() - started
+            self._busy_time += duration
+            self._avg_duration = self._avg_duration * 0.8 + duration * 0.2
+            self.completed += 1
+            self._release(user_id)
+
+    def stats(self) -> Dict:
+        """Возвращает состояние очереди для админ панели"""
+        elapsed = max(1e-9, time.monotonic() - self._created_at)
+        return {
+            "depth": self.depth,
+            "users_waiting": len(self._pending),
+            "running": self._active,
+            "workers": self.workers,
+            "utilization": min(1.0, self._busy_time / (elapsed * self.workers)),
+            "avg_wait": self._avg_wait,
+            "avg_duration": self._avg_duration,
+            "completed": self.completed,
+            "rejected": self.rejected,
+        }
+
+
+async def _safe_notify(callback: PositionCallback, position: int, eta: float) -> None:
+    try:
+        await callback(position, eta)
+    except Exception as e:
+        logger.warning(f"Не удалось сообщить позицию в очереди: {e}")
+
+
+def queue_notifier(message: Message) -> PositionCallback:
+    """
+    Показывает позицию в очереди в сообщении о ходе обработки
+
+    Когда задача запускается, сообщению возвращается исходный текст.
+    """
+    original = message.text or ""
+
+    async def notify(position: int, eta: float) -> None:
+        if position == 0:
+            await message.edit_text(original, parse_mode=None)
+            return
+        minutes = max(1, round(eta / 60))
+        await message.edit_text(
+            f"⏳ Задача в очереди: {position}-я, ожидание около {minutes} мин.",
+            parse_mode=None
+        )
+
+    return notify
+
+
+# Создаем глобальную очередь обработки аудио
+audio_queue = AudioJobQueue(
+    workers=AUDIO_WORKERS,
+    per_user=AUDIO_PER_USER,
+    max_pending=AUDIO_QUEUE_MAX,
+    per_user_pending=AUDIO_QUEUE_PER_USER,
+)
@@ -0,0 +1,77 @@
+import asyncio
+import logging
+import time
+from typing import Optional
+
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+from aiogram.types import Message
+
+logger = logging.getLogger(__name__)
+
+# Ограничение Telegram - 4096 символов, оставляем запас под заголовок
+_TEXT_LIMIT = 3800
+
+
+class ProgressMessage:
+    """
+    Постепенный вывод текста в сообщение о ходе обработки
+
+    update() можно вызывать на каждый фрагмент ответа: промежуточные
+    значения схлопываются, и сообщение редактируется не чаще раза в interval
+    секунд, чтобы не упираться в лимиты Telegram на редактирование.
+    """
+
+    def __init__(self, message: Message, header: str, interval: float = 1.5):
+        """
+        Args:
+            message: Сообщение, которое редактируется
+            header: Первая строка сообщения (например, "📞 Анализирую звонок...")
+            interval: Минимальный интервал между редактированиями в секундах
+        """
+        self.message = message
+        self.header = header
+        self.interval = interval
+        self._latest = ""
+        self._shown = ""
+        self._edited_at = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    def _render(self, text: str) -> str:
+        if len(text) > _TEXT_LIMIT:
+            # Показываем конец текста - туда сейчас дописывается ответ
+            text = "…" + text[-_TEXT_LIMIT:]
+        return f"{self.header}\n\n{text}"
+
+    def update(self, text: str) -> None:
+        """Запоминает текущий текст; сообщение обновится при ближайшей возможности"""
+        self._latest = text
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._flush())
+
+    async def _flush(self) -> None:
+        while self._latest != self._shown:
+            wait = self.interval - (time.monotonic() - self._edited_at)
+            if wait > 0:
+                await asyncio.sleep(wait)
+            text = self._latest
+            try:
+                await self.message.edit_text(self._render(text), parse_mode=None)
+            except TelegramRetryAfter as e:
+                await asyncio.sleep(e.retry_after)
+                continue
+            except TelegramBadRequest as e:
+                # "message is not modified" или сообщение уже удалено
+                logger.debug(f"Не удалось обновить сообщение о ходе обработки: {e}")
+            except Exception as e:
+                logger.warning(f"Ошибка при обновлении сообщения о ходе обработки: {e}")
+            self._shown = text
+            self._edited_at = time.monotonic()
+
+    async def close(self) -> None:
+        """Останавливает обновления (перед удалением или заменой сообщения)"""
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
@@ -3,6 +3,7 @@ from __future__ import annotations
 import logging
 from functools import lru_cache
 from pathlib import Path
+from typing import Callable
 
 logger = logging.getLogger(__name__)
 
@@ -54,6 +55,24 @@ def _write_text(path: Path, content: str) -> bool:
         return False
 
 
+# --- Подписчики на изменение промтов ---
+
+_change_listeners: list[Callable[[str], None]] = []
+
+def on_prompt_change(listener: Callable[[str], None]) -> None:
+    """Регистрирует функцию, которая вызывается со старым текстом измененного промта или шаблона"""
+    _change_listeners.append(listener)
+
+def _notify_change(old: str, new: str) -> None:
+    if old == _normalize_text(new):
+        return
+    for listener in list(_change_listeners):
+        try:
+            listener(old)
+        except Exception:
+            logger.exception("Ошибка в обработчике изменения промта")
+
+
 # --- Публичные функции (тонкие и простые) ---
 
 @lru_cache(maxsize=2)
@@ -69,16 +88,20 @@ def get_promt_call_analyze() -> str:
     return f"{get_main_prompt()}\n\n{get_response_template()}"
 
 def save_main_prompt(content: str) -> bool:
+    old = get_main_prompt()
     ok = _write_text(_MAIN_PATH, content)
     if ok:
         # сбрасываем кэш, чтобы сразу видеть изменения
         get_main_prompt.cache_clear()
+        _notify_change(old, content)
     return ok
 
 def save_response_template(content: str) -> bool:
+    old = get_response_template()
     ok = _write_text(_TEMPLATE_PATH, content)
     if ok:
         get_response_template.cache_clear()
+        _notify_change(old, content)
     return ok
 
 # --- Функции для суммаризации ---
@@ -96,13 +119,17 @@ def get_promt_call_summary() -> str:
     return f"{get_summary_main_prompt()}\n\n{get_summary_template()}"
 
 def save_summary_main_prompt(content: str) -> bool:
+    old = get_summary_main_prompt()
     ok = _write_text(_SUMMARY_MAIN_PATH, content)
     if ok:
         get_summary_main_prompt.cache_clear()
+        _notify_change(old, content)
     return ok
 
 def save_summary_template(content: str) -> bool:
+    old = get_summary_template()
     ok = _write_text(_SUMMARY_TEMPLATE_PATH, content)
     if ok:
         get_summary_template.cache_clear()
+        _notify_change(old, content)
     return ok
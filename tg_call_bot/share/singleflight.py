@@ -0,0 +1,93 @@
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, Hashable, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class SingleFlight:
+    """
+    Объединение одинаковых конкурентных запросов (single-flight)
+
+    Первый вызов с ключом запускает запрос, остальные вызовы с тем же ключом
+    ждут его результат вместо повторного запроса. Успешный результат может
+    храниться ttl секунд, чтобы почти одновременные запросы тоже не дублировались.
+
+    Счетчики:
+        hits - результат взят из недавнего успешного ответа
+        misses - запрос действительно выполнен
+        coalesced - вызов присоединился к уже выполняющемуся запросу
+    """
+
+    def __init__(self, name: str, ttl: float = 0.0):
+        """
+        Args:
+            name: Имя для логов и статистики
+            ttl: Сколько секунд хранить успешный результат (0 - не хранить)
+        """
+        self.name = name
+        self.ttl = ttl
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+        self._results: Dict[Hashable, Tuple[float, Any]] = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    async def do(self, key: Hashable, factory: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Выполняет запрос factory() один раз для всех конкурентных вызовов с ключом key
+
+        Ошибки не кэшируются: их получают все ожидающие вызовы, следующий вызов
+        выполнит запрос заново.
+        """
+        cached = self._results.get(key)
+        if cached is not None:
+            expires, value = cached
+            if expires > time.monotonic():
+                self.hits += 1
+                return value
+            self._results.pop(key, None)
+
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            self.misses += 1
+            task = asyncio.ensure_future(factory())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._complete(key, t))
+
+        # shield: отмена одного из ожидающих не отменяет общий запрос
+        return await asyncio.shield(task)
+
+    def _complete(self, key: Hashable, task: asyncio.Future) -> None:
+        self._inflight.pop(key, None)
+        if self.ttl > 0 and not task.cancelled() and task.exception() is None:
+            if len(self._results) >= 1024:
+                self._purge_expired()
+            self._results[key] = (time.monotonic() + self.ttl, task.result())
+
+    def _purge_expired(self) -> None:
+        now = time.monotonic()
+        for key in [k for k, (expires, _) in self._results.items() if expires <= now]:
+            self._results.pop(key, None)
+
+    def forget(self, key: Hashable) -> None:
+        """Удаляет сохраненный результат, например после изменения данных"""
+        self._results.pop(key, None)
+
+    def forget_prefix(self, prefix: Tuple) -> None:
+        """Удаляет сохраненные результаты всех ключей-кортежей, начинающихся с prefix"""
+        for key in [k for k in self._results if isinstance(k, tuple) and k[:len(prefix)] == prefix]:
+            self._results.pop(key, None)
+
+    def stats(self) -> Dict[str, int]:
+        """Возвращает счетчики для мониторинга"""
+        self._purge_expired()
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "inflight": len(self._inflight),
+        }
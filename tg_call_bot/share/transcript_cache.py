@@ -0,0 +1,163 @@
+import json
+import logging
+import os
+import sqlite3
+import time
+from typing import Dict, List, Optional
+
+from share.config import TRANSCRIPT_CACHE_MB, TRANSCRIPT_CACHE_DAYS
+
+# Настройка логирования
+logger = logging.getLogger(__name__)
+
+
+class TranscriptCache:
+    """
+    Постоянный кэш транскрипций Whisper
+
+    Основной ключ - file_unique_id из Telegram: он одинаков для повторно
+    отправленного файла, и попадание по нему не требует даже скачивания.
+    Запасной ключ - SHA-256 содержимого, он находит тот же звонок,
+    загруженный заново другим сообщением или пользователем.
+    Старые записи удаляются по возрасту, а при превышении размера -
+    те, что дольше всего не использовались.
+    Вместе с текстом хранятся отрезки Whisper с таймкодами в компактном
+    виде [[начало, конец, текст], ...] - по ним делится речь по спикерам.
+    """
+
+    def __init__(self, db_path: str = None, max_mb: float = 50, max_age_days: float = 30):
+        """
+        Args:
+            db_path: Путь к файлу SQLite (по умолчанию data/transcripts.db)
+            max_mb: Максимальный суммарный размер текстов в МБ
+            max_age_days: Сколько дней хранить транскрипцию
+        """
+        if db_path is None:
+            data_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data')
+            db_path = os.path.join(data_dir, 'transcripts.db')
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+
+        self.db_path = db_path
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.max_age = max_age_days * 86400
+        self.hits = 0
+        self.misses = 0
+
+        self._db = sqlite3.connect(db_path)
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS transcripts (
+                content_hash TEXT PRIMARY KEY,
+                text TEXT NOT NULL,
+                segments TEXT,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                used_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS file_ids (
+                file_unique_id TEXT PRIMARY KEY,
+                content_hash TEXT NOT NULL REFERENCES transcripts(content_hash) ON DELETE CASCADE
+            );
+        """)
+        # Кэш, созданный до появления отрезков, дополняется колонкой segments
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(transcripts)")}
+        if "segments" not in columns:
+            self._db.execute("ALTER TABLE transcripts ADD COLUMN segments TEXT")
+        self._db.execute("PRAGMA foreign_keys = ON")
+        self._db.commit()
+        self.evict()
+
+    def _touch(self, content_hash: str) -> None:
+        self._db.execute("UPDATE transcripts SET used_at = ? WHERE content_hash = ?", (time.time(), content_hash))
+        self._db.commit()
+
+    def get_by_file(self, file_unique_id: str) -> Optional[str]:
+        """Транскрипция по file_unique_id из Telegram"""
+        row = self._db.execute("""
+            SELECT t.content_hash, t.text FROM file_ids f
+            JOIN transcripts t ON t.content_hash = f.content_hash
+            WHERE f.file_unique_id = ? AND t.created_at > ?
+        """, (file_unique_id, time.time() - self.max_age)).fetchone()
+        if row is None:
+            return None
+        self.hits += 1
+        self._touch(row[0])
+        return row[1]
+
+    def get_by_hash(self, content_hash: str, file_unique_id: str = None) -> Optional[str]:
+        """Транскрипция по хэшу содержимого; file_unique_id запоминается для следующих запросов"""
+        row = self._db.execute(
+            "SELECT text FROM transcripts WHERE content_hash = ? AND created_at > ?",
+            (content_hash, time.time() - self.max_age)
+        ).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        if file_unique_id:
+            self._db.execute(
+                "INSERT OR REPLACE INTO file_ids (file_unique_id, content_hash) VALUES (?, ?)",
+                (file_unique_id, content_hash)
+            )
+        self._touch(content_hash)
+        return row[0]
+
+    def get_segments(self, file_unique_id: str) -> Optional[List[list]]:
+        """Отрезки с таймкодами по file_unique_id или None, если их нет"""
+        row = self._db.execute("""
+            SELECT t.segments FROM file_ids f
+            JOIN transcripts t ON t.content_hash = f.content_hash
+            WHERE f.file_unique_id = ?
+        """, (file_unique_id,)).fetchone()
+        if row is None or row[0] is None:
+            return None
+        return json.loads(row[0])
+
+    def put(self, content_hash: str, text: str, file_unique_id: str = None, segments: List[list] = None) -> None:
+        """Сохраняет транскрипцию и ее отрезки"""
+        now = time.time()
+        segments_json = json.dumps(segments, ensure_ascii=False, separators=(",", ":")) if segments is not None else None
+        self._db.execute(
+            "INSERT OR REPLACE INTO transcripts (content_hash, text, segments, size, created_at, used_at) VALUES (?, ?, ?, ?, ?, ?)",
+            (content_hash, text, segments_json, len(text.encode("utf-8")) + len((segments_json or "").encode("utf-8")), now, now)
+        )
+        if file_unique_id:
+            self._db.execute(
+                "INSERT OR REPLACE INTO file_ids (file_unique_id, content_hash) VALUES (?, ?)",
+                (file_unique_id, content_hash)
+            )
+        self._db.commit()
+        self.evict()
+
+    def evict(self) -> None:
+        """Удаляет устаревшие записи и самые давно использованные сверх лимита размера"""
+        removed = self._db.execute(
+            "DELETE FROM transcripts WHERE created_at <= ?", (time.time() - self.max_age,)
+        ).rowcount
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM transcripts").fetchone()[0]
+        if total > self.max_bytes:
+            for content_hash, size in self._db.execute(
+                "SELECT content_hash, size FROM transcripts ORDER BY used_at"
+            ).fetchall():
+                if total <= self.max_bytes:
+                    break
+                self._db.execute("DELETE FROM transcripts WHERE content_hash = ?", (content_hash,))
+                total -= size
+                removed += 1
+        self._db.commit()
+        if removed:
+            logger.info(f"Из кэша транскрипций удалено {removed} записей")
+
+    def stats(self) -> Dict:
+        """Возвращает состояние кэша для админ панели"""
+        count, size = self._db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM transcripts").fetchone()
+        return {
+            "entries": count,
+            "size_mb": size / (1024 * 1024),
+            "max_mb": self.max_bytes / (1024 * 1024),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+# Создаем глобальный экземпляр кэша
+transcript_cache = TranscriptCache(max_mb=TRANSCRIPT_CACHE_MB, max_age_days=TRANSCRIPT_CACHE_DAYS)
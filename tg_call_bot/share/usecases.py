@@ -1,40 +1,249 @@
-import os, logging
-from modules.openai.client import transcription, analyze_transcribed_text
+import os, logging, hashlib, asyncio, tempfile
+from typing import BinaryIO, List
+from modules.openai.client import transcription, AnalysisPipeline
+from modules.openai.audio import memory_file
+from modules.openai.speakers import split_speakers
 from share.utils import cleanup_temp_files
-from share.config import MAX_AUDIO_SIZE_MB
+from share.config import MAX_AUDIO_SIZE_MB, JOB_MAX_ATTEMPTS, AUDIO_SPOOL_MB
+from share.singleflight import SingleFlight
+from share.transcript_cache import transcript_cache
+from share.job_journal import (
+    job_journal, stage_reached,
+    STAGE_DOWNLOADED, STAGE_TRANSCRIBED, STAGE_ANALYSED, STAGE_DELIVERED,
+)
+from share.job_queue import audio_queue
 
 logger = logging.getLogger(__name__)
 TEMP_DIR = os.path.join(os.path.dirname(__file__), "..", "temp")
+os.makedirs(TEMP_DIR, exist_ok=True)
 
-async def transcribe_file(bot, file_id: str, filename_hint: str = "audio.mp3", system_promt: str = None) -> str:
-    """Скачивает файл из Telegram, транскрибирует его и анализирует через GPT"""
-    os.makedirs(TEMP_DIR, exist_ok=True)
-    cleanup_temp_files(TEMP_DIR)  # очистка старше 60 мин
-    tg_file = await bot.get_file(file_id)
-    
-    # Проверяем размер файла
-    file_size_mb = tg_file.file_size / (1024 * 1024) if tg_file.file_size else 0
-    if file_size_mb > MAX_AUDIO_SIZE_MB:
-        logger.warning(f"Файл слишком большой: {file_size_mb:.1f}MB (максимум {MAX_AUDIO_SIZE_MB}MB)")
-        return f"❌ Файл слишком большой ({file_size_mb:.1f}MB). Максимальный размер: {MAX_AUDIO_SIZE_MB}MB"
+# Одновременные запросы на один и тот же файл ждут одну транскрипцию
+_transcribe_flight = SingleFlight("transcribe")
+
+
+def _file_hash(audio: BinaryIO) -> str:
+    digest = hashlib.sha256()
+    audio.seek(0)
+    for block in iter(lambda: audio.read(1024 * 1024), b""):
+        digest.update(block)
+    audio.seek(0)
+    return digest.hexdigest()
+
+
+async def _download_and_transcribe(bot, tg_file, ext: str, on_downloaded=None, on_chunk=None,
+                                   with_segments: bool = False) -> str:
+    # Файл до AUDIO_SPOOL_MB скачивается в память (memfd), больший - во временный
+    # файл без имени. У обоих есть дескриптор, поэтому ffmpeg читает их с перемоткой
+    size_mb = (tg_file.file_size or 0) / (1024 * 1024)
+    audio = memory_file() if size_mb <= AUDIO_SPOOL_MB else tempfile.TemporaryFile(dir=TEMP_DIR)
+    with audio:
+        await bot.download_file(tg_file.file_path, destination=audio)
+        if on_downloaded is not None:
+            on_downloaded()
+
+        # Тот же звонок мог прийти другим сообщением - ищем по содержимому
+        content_hash = _file_hash(audio)
+        cached = transcript_cache.get_by_hash(content_hash, tg_file.file_unique_id)
+        if cached is not None and (not with_segments or transcript_cache.get_segments(tg_file.file_unique_id) is not None):
+            logger.info("Транскрипция найдена в кэше по содержимому файла")
+            return cached
+        if cached is not None:
+            logger.info("В кэше нет таймкодов для деления по спикерам, распознаем файл заново")
+
+        # Отрезки с таймкодами запрашиваются только для деления по спикерам
+        # и сохраняются вместе с текстом
+        segments = None
+        if with_segments:
+            transcribed_text, segments = await transcription(audio, f"audio.{ext}", on_chunk=on_chunk, with_segments=True)
+        else:
+            transcribed_text = await transcription(audio, f"audio.{ext}", on_chunk=on_chunk)
+        if transcribed_text:
+            transcript_cache.put(content_hash, transcribed_text, tg_file.file_unique_id, segments)
+        return transcribed_text
+
+
+async def get_transcript(bot, tg_file, filename_hint: str = "audio.mp3", on_downloaded=None, on_chunk=None,
+                         with_segments: bool = False) -> str:
+    """Возвращает транскрипцию файла Telegram из кэша или распознает его через Whisper
+
+    on_chunk получает распознанные отрезки длинной записи по мере готовности
+    (только у запроса, который действительно распознает файл). С with_segments
+    в кэш вместе с текстом сохраняются таймкоды (см. transcript_cache.get_segments);
+    расшифровка из кэша без таймкодов в этом случае считается промахом.
+    """
+    cached = None
+    if not with_segments or transcript_cache.get_segments(tg_file.file_unique_id) is not None:
+        cached = transcript_cache.get_by_file(tg_file.file_unique_id)
+    if cached is not None:
+        logger.info(f"Транскрипция найдена в кэше по file_unique_id")
+        return cached
     ext = filename_hint.split(".")[-1] if "." in filename_hint else "mp3"
-    path = os.path.join(TEMP_DIR, f"{file_id}.{ext}")
-    await bot.download_file(tg_file.file_path, path)
+    return await _transcribe_flight.do(
+        (tg_file.file_unique_id, with_segments),
+        lambda: _download_and_transcribe(bot, tg_file, ext, on_downloaded, on_chunk, with_segments)
+    )
+
+
+# --- Задачи с журналом (переживают перезапуск бота) ---
+
+async def run_job(bot, job_id: int, on_progress=None) -> str:
+    """
+    Выполняет задачу из журнала, начиная с первого непройденного этапа
+
+    Транскрипция и результат сохраняются в журнал сразу после получения,
+    поэтому прерванная задача не распознается и не анализируется повторно.
+    """
+    job = job_journal.get(job_id)
+    if stage_reached(job, STAGE_ANALYSED):
+        return job["result"] or ""
+
+    sections = _job_sections(job)
+    pipelines = {s["key"]: AnalysisPipeline(s["prompt"]) for s in sections if s.get("prompt")}
     try:
-        # Сначала транскрибируем
-        transcribed_text = await transcription(path)
-        if not transcribed_text:
-            return ""
-        
-        # Если есть system_promt, анализируем через GPT
-        if system_promt:
-            analyzed_text = await analyze_transcribed_text(transcribed_text, system_promt)
-            return analyzed_text or transcribed_text
-        
-        # Иначе возвращаем просто транскрибированный текст
-        return transcribed_text
+        return await _run_job_stages(bot, job, sections, pipelines, on_progress)
     finally:
-        try:
-            os.remove(path)
-        except Exception as e:
-            logger.warning(f"Temp cleanup fail: {e}") 
\ No newline at end of file
+        for pipeline in pipelines.values():
+            pipeline.cancel()
+
+
+def _job_sections(job: dict) -> List[dict]:
+    """Разделы анализа задачи: {"key", "title", "prompt"} или {"key", "title", "speaker_split": True}
+
+    Обычная задача анализируется одним промтом или делится по спикерам
+    (параметр speaker_split); задача с параметром sections (одна запись -
+    несколько результатов) - каждым разделом.
+    """
+    sections = job["params"].get("sections")
+    if sections:
+        return sections
+    if job["params"].get("speaker_split"):
+        return [{"key": "result", "title": "", "speaker_split": True}]
+    if job["system_prompt"]:
+        return [{"key": "result", "title": "", "prompt": job["system_prompt"]}]
+    return []
+
+
+async def _analyse_section(section: dict, transcript: str, segments, pipelines: dict, on_progress=None) -> str:
+    if section.get("speaker_split"):
+        return await split_speakers(transcript, segments)
+    return await pipelines[section["key"]].finish(transcript, on_progress=on_progress)
+
+
+async def _run_job_stages(bot, job: dict, sections: list, pipelines: dict, on_progress=None) -> str:
+    job_id = job["id"]
+    transcript = job["transcript"]
+    if not stage_reached(job, STAGE_TRANSCRIBED):
+        tg_file = await bot.get_file(job["file_id"])
+        file_size_mb = tg_file.file_size / (1024 * 1024) if tg_file.file_size else 0
+        if file_size_mb > MAX_AUDIO_SIZE_MB:
+            logger.warning(f"Файл слишком большой: {file_size_mb:.1f}MB (максимум {MAX_AUDIO_SIZE_MB}MB)")
+            result = f"❌ Файл слишком большой ({file_size_mb:.1f}MB). Максимальный размер: {MAX_AUDIO_SIZE_MB}MB"
+            job_journal.advance(job_id, STAGE_ANALYSED, result=result)
+            return result
+
+        def feed(index: int, total: int, text: str) -> None:
+            # Один распознанный отрезок идет во все разделы анализа
+            for pipeline in pipelines.values():
+                pipeline.feed(index, total, text)
+
+        speaker_split = any(s.get("speaker_split") for s in sections)
+        transcript = await get_transcript(
+            bot, tg_file, job["filename"],
+            on_downloaded=lambda: job_journal.advance(job_id, STAGE_DOWNLOADED),
+            on_chunk=feed if pipelines else None,
+            with_segments=speaker_split
+        )
+        if speaker_split:
+            # Таймкоды нужны для деления по спикерам и после перезапуска
+            job["params"]["segments"] = transcript_cache.get_segments(tg_file.file_unique_id)
+            job_journal.set_params(job_id, segments=job["params"]["segments"])
+        job_journal.advance(job_id, STAGE_TRANSCRIBED, transcript=transcript)
+
+    segments = job["params"].get("segments")
+    result = transcript or ""
+    if transcript and job["params"].get("sections"):
+        result = await _analyse_sections(job_id, transcript, segments, sections, pipelines, on_progress)
+    elif transcript and sections:
+        analyzed_text = await _analyse_section(sections[0], transcript, segments, pipelines, on_progress)
+        result = analyzed_text or transcript
+    job_journal.advance(job_id, STAGE_ANALYSED, result=result)
+    return result
+
+
+async def _analyse_sections(job_id: int, transcript: str, segments, sections: list, pipelines: dict, on_progress=None) -> str:
+    """
+    Анализирует одну транскрипцию всеми промтами разделов одновременно
+
+    Результаты разделов сохраняются в параметры задачи (section_results),
+    чтобы их можно было использовать по отдельности, например для Notion.
+    on_progress получает список готовых разделов.
+    """
+    done = []
+
+    async def run(section: dict) -> str:
+        text = await _analyse_section(section, transcript, segments, pipelines)
+        done.append(section["title"])
+        if on_progress is not None:
+            on_progress("Готово: " + ", ".join(done))
+        return text or ""
+
+    texts = await asyncio.gather(*(run(section) for section in sections))
+    job_journal.set_params(job_id, section_results={s["key"]: text for s, text in zip(sections, texts)})
+    return "\n\n".join(
+        f"{s['title']}\n" + "-" * 50 + f"\n{text.strip() or 'Нет результата'}"
+        for s, text in zip(sections, texts)
+    )
+
+
+async def deliver_job(bot, job_id: int, result: str, late: bool = False) -> None:
+    """Доставляет результат функцией, зарегистрированной для вида задачи, и закрывает задачу"""
+    job = job_journal.get(job_id)
+    delivery = job_journal.delivery(job["kind"])
+    if delivery is None:
+        logger.warning(f"Нет доставки для задач вида {job['kind']}, задача {job_id} не доставлена")
+        return
+    await delivery(bot, job, result, late)
+    job_journal.advance(job_id, STAGE_DELIVERED)
+
+
+async def _resume_job(bot, job: dict) -> None:
+    job_id = job["id"]
+    attempts = job["attempts"] + 1
+    if attempts > JOB_MAX_ATTEMPTS:
+        job_journal.fail(job_id, "Превышено число попыток после перезапуска", max_attempts=0)
+        await _notify(bot, job["chat_id"], f"❌ Не удалось завершить обработку файла {job['filename']}. Отправьте его еще раз")
+        return
+    job_journal.advance(job_id, job["stage"], attempts=attempts)
+    logger.info(f"Продолжаем задачу {job_id} с этапа {job['stage']} (попытка {attempts})")
+    try:
+        result = await audio_queue.run(job["user_id"], lambda: run_job(bot, job_id))
+        await deliver_job(bot, job_id, result, late=True)
+    except Exception as e:
+        logger.exception(f"Ошибка при продолжении задачи {job_id}")
+        if job_journal.fail(job_id, str(e), max_attempts=JOB_MAX_ATTEMPTS):
+            await _notify(bot, job["chat_id"], f"❌ Не удалось завершить обработку файла {job['filename']}. Отправьте его еще раз")
+
+
+async def _notify(bot, chat_id: int, text: str) -> None:
+    try:
+        await bot.send_message(chat_id, text, parse_mode=None)
+    except Exception as e:
+        logger.warning(f"Не удалось уведомить чат {chat_id}: {e}")
+
+
+def resume_jobs(bot) -> int:
+    """
+    Продолжает задачи, прерванные перезапуском бота (вызывается при старте)
+
+    Returns:
+        int: Количество продолжаемых задач
+    """
+    # Файлы, оставшиеся в temp/ от прежних версий, которые скачивали записи на диск
+    cleanup_temp_files(TEMP_DIR)
+    job_journal.purge()
+    jobs = job_journal.unfinished()
+    for job in jobs:
+        asyncio.create_task(_resume_job(bot, job))
+    if jobs:
+        logger.info(f"После перезапуска продолжается {len(jobs)} задач обработки аудио")
+    return len(jobs)
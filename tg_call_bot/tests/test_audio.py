@@ -0,0 +1,37 @@
+from modules.openai.audio import merge_transcripts, plan_chunks
+
+
+def test_plan_chunks_short_record_is_one_chunk():
+    assert plan_chunks(300.0, [], chunk_seconds=600, overlap=2) == [(0.0, 300.0)]
+
+
+def test_plan_chunks_cuts_in_nearest_silence_with_overlap():
+    silences = [(590.0, 594.0), (1195.0, 1199.0)]
+    chunks = plan_chunks(1500.0, silences, chunk_seconds=600, overlap=2)
+
+    # Границы - середины пауз, соседние отрезки перекрываются на 2 * overlap
+    assert chunks == [(0.0, 594.0), (590.0, 1199.0), (1195.0, 1500.0)]
+
+
+def test_plan_chunks_without_silence_cuts_at_target_and_keeps_short_tail():
+    chunks = plan_chunks(1220.0, [], chunk_seconds=600, overlap=1)
+
+    assert chunks[0] == (0.0, 601.0)
+    assert chunks[-1][1] == 1220.0
+    # Хвост короче search_window присоединяется к последнему отрезку
+    assert len(chunks) == 2
+
+
+def test_merge_transcripts_drops_repeated_overlap():
+    parts = [
+        "Добрый день, это диспетчер. Груз будет готов завтра к десяти утра",
+        "готов завтра к десяти утра, подъезжайте на склад номер три",
+    ]
+
+    assert merge_transcripts(parts) == (
+        "Добрый день, это диспетчер. Груз будет готов завтра к десяти утра подъезжайте на склад номер три"
+    )
+
+
+def test_merge_transcripts_joins_parts_without_common_words():
+    assert merge_transcripts(["Первая часть", "", "вторая часть звонка"]) == "Первая часть вторая часть звонка"
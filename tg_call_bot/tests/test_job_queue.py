@@ -0,0 +1,82 @@
+import asyncio
+
+import pytest
+
+from share.job_queue import AudioJobQueue, QueueFullError
+
+
+def test_free_slot_goes_to_next_user_in_turn():
+    queue = AudioJobQueue(workers=1, per_user=1)
+    order = []
+
+    async def scenario():
+        gate = asyncio.Event()
+
+        def job(user_id: int, name: str, wait: bool = False):
+            async def run():
+                order.append(name)
+                if wait:
+                    await gate.wait()
+            return queue.run(user_id, run)
+
+        # Первая задача пользователя 1 занимает единственный слот
+        first = asyncio.create_task(job(1, "a1", wait=True))
+        await asyncio.sleep(0)
+        rest = [
+            asyncio.create_task(job(1, "a2")),
+            asyncio.create_task(job(1, "a3")),
+            asyncio.create_task(job(2, "b1")),
+        ]
+        await asyncio.sleep(0)
+        # Единственный файл второго пользователя идет сразу за текущим
+        assert queue.depth == 3
+        gate.set()
+        await asyncio.gather(first, *rest)
+
+    asyncio.run(scenario())
+    assert order == ["a1", "b1", "a2", "a3"]
+
+
+def test_per_user_limit_keeps_slot_for_other_users():
+    queue = AudioJobQueue(workers=2, per_user=1)
+    running = []
+
+    async def scenario():
+        gate = asyncio.Event()
+
+        def job(user_id: int, name: str):
+            async def run():
+                running.append(name)
+                await gate.wait()
+            return queue.run(user_id, run)
+
+        tasks = [asyncio.create_task(job(1, "a1")), asyncio.create_task(job(1, "a2")),
+                 asyncio.create_task(job(2, "b1"))]
+        await asyncio.sleep(0.01)
+        # Второй слот не отдан второй задаче пользователя 1
+        assert sorted(running) == ["a1", "b1"]
+        gate.set()
+        await asyncio.gather(*tasks)
+
+    asyncio.run(scenario())
+
+
+def test_per_user_pending_limit_rejects():
+    queue = AudioJobQueue(workers=1, per_user=1, per_user_pending=1)
+
+    async def scenario():
+        gate = asyncio.Event()
+
+        async def run():
+            await gate.wait()
+
+        first = asyncio.create_task(queue.run(1, run))
+        second = asyncio.create_task(queue.run(1, run))
+        await asyncio.sleep(0)
+        with pytest.raises(QueueFullError):
+            await queue.run(1, run)
+        gate.set()
+        await asyncio.gather(first, second)
+
+    asyncio.run(scenario())
+    assert queue.rejected == 1
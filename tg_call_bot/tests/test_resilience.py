@@ -0,0 +1,69 @@
+import asyncio
+import time
+
+import pytest
+
+from modules.openai.resilience import CircuitBreaker, CircuitOpenError, ResilientCaller
+
+
+def _half_open(caller: ResilientCaller, kind: str) -> CircuitBreaker:
+    breaker = caller.breaker(kind)
+    breaker.opened_at = time.monotonic() - breaker.reset_timeout
+    assert breaker.state == "half_open"
+    return breaker
+
+
+def test_cancelled_probe_is_released():
+    caller = ResilientCaller(breaker_failures=1, breaker_reset=30)
+
+    async def scenario():
+        breaker = _half_open(caller, "chat")
+        started = asyncio.Event()
+
+        async def hang():
+            started.set()
+            await asyncio.sleep(10)
+
+        probe = asyncio.create_task(caller.call("chat", hang, deadline=60))
+        await started.wait()
+        # Пока идет проба, остальные запросы отклоняются
+        with pytest.raises(CircuitOpenError):
+            await caller.call("chat", hang, deadline=60)
+
+        probe.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await probe
+
+        # После отмены пробы следующий запрос становится новой пробой и замыкает защиту
+        async def ok():
+            return "ok"
+
+        assert await caller.call("chat", ok, deadline=60) == "ok"
+        assert breaker.state == "closed"
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_non_probe_keeps_running_probe():
+    caller = ResilientCaller()
+
+    async def scenario():
+        breaker = caller.breaker("chat")
+        started = asyncio.Event()
+
+        async def hang():
+            started.set()
+            await asyncio.sleep(10)
+
+        # Запрос начат при замкнутой защите, его отмена не трогает пробу
+        regular = asyncio.create_task(caller.call("chat", hang, deadline=60))
+        await started.wait()
+        _half_open(caller, "chat")
+        assert breaker.allow() is True
+        regular.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await regular
+        with pytest.raises(CircuitOpenError):
+            breaker.allow()
+
+    asyncio.run(scenario())
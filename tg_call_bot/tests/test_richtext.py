@@ -0,0 +1,40 @@
+from modules.notion.richtext import (
+    RICH_TEXT_ITEMS_LIMIT, TEXT_LIMIT, split_comment, split_text, to_rich_text, _utf16_len,
+)
+
+
+def test_split_text_respects_limit_and_word_boundaries():
+    words = " ".join(f"слово{i}" for i in range(2000))
+    chunks = split_text(words)
+
+    assert "".join(chunks) == words
+    assert all(_utf16_len(chunk) <= TEXT_LIMIT for chunk in chunks)
+    # Разрез приходится на пробел, слова не рвутся
+    assert all(chunk.endswith(" ") for chunk in chunks[:-1])
+
+
+def test_split_text_exact_limit_is_one_chunk():
+    assert split_text("а" * TEXT_LIMIT) == ["а" * TEXT_LIMIT]
+    assert [len(c) for c in split_text("а" * (TEXT_LIMIT + 1))] == [TEXT_LIMIT, 1]
+
+
+def test_split_text_counts_emoji_as_two_units():
+    # Эмодзи занимает две единицы UTF-16, поэтому в кусок их помещается вдвое меньше
+    chunks = split_text("😀" * TEXT_LIMIT)
+
+    assert "".join(chunks) == "😀" * TEXT_LIMIT
+    assert [len(c) for c in chunks] == [TEXT_LIMIT // 2, TEXT_LIMIT // 2]
+
+
+def test_split_comment_short_text_is_single_part():
+    text = "x " * (TEXT_LIMIT * 3)
+    assert split_comment(text) == [text]
+
+
+def test_split_comment_parts_fit_rich_text_limit():
+    text = "\n".join("строка " * 40 for _ in range(RICH_TEXT_ITEMS_LIMIT * 20))
+    parts = split_comment(text)
+
+    assert len(parts) > 1
+    assert parts[0].startswith(f"(1/{len(parts)}) ")
+    assert all(len(to_rich_text(part)) <= RICH_TEXT_ITEMS_LIMIT for part in parts)
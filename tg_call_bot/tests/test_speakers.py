@@ -0,0 +1,42 @@
+from modules.openai.audio import merge_segments
+from modules.openai.speakers import format_turns, split_turns
+
+
+def test_split_turns_joins_segments_until_pause():
+    segments = [
+        [0.0, 2.0, "Алло, добрый день."],
+        [2.3, 4.0, "Это диспетчер."],
+        [5.5, 7.0, "Да, слушаю."],
+    ]
+
+    assert split_turns(segments, gap=0.8) == [
+        [0.0, 4.0, "Алло, добрый день. Это диспетчер."],
+        [5.5, 7.0, "Да, слушаю."],
+    ]
+
+
+def test_split_turns_starts_new_turn_after_question():
+    segments = [[0.0, 2.0, "Вы на месте?"], [2.1, 3.0, "Да, уже на складе."]]
+
+    assert len(split_turns(segments, gap=0.8)) == 2
+
+
+def test_format_turns_merges_consecutive_turns_of_one_speaker():
+    turns = [[0.0, 2.0, "Алло?"], [2.5, 4.0, "Слушаю."], [65.0, 66.0, "Записал."]]
+
+    assert format_turns(turns, [1, 2, 2]) == "[00:00] Спикер 1: Алло?\n\n[00:02] Спикер 2: Слушаю. Записал."
+
+
+def test_merge_segments_shifts_chunks_and_splits_overlap_in_half():
+    chunks = [(0.0, 604.0), (596.0, 900.0)]
+    parts = [
+        [[590.0, 597.0, "до стыка"], [599.0, 603.0, "повтор на стыке"]],
+        [[3.0, 7.0, "повтор на стыке"], [10.0, 12.0, "после стыка"]],
+    ]
+
+    # Середина перекрытия - 600 сек: повтор берется только из второго куска
+    assert merge_segments(parts, chunks) == [
+        [590.0, 597.0, "до стыка"],
+        [599.0, 603.0, "повтор на стыке"],
+        [606.0, 608.0, "после стыка"],
+    ]